@@ -0,0 +1,16 @@
+#version 330 core
+
+uniform vec2 resolution;
+uniform float bar[64];
+
+out vec4 color;
+
+void main() {
+  vec2 p = gl_FragCoord.xy / resolution.xy;
+
+  float x = p.x * 63.0;
+  float level = mix(bar[int(x)], bar[min(int(x) + 1, 63)], fract(x));
+  float dif = distance(p.y, 0.5) - abs(level);
+
+  color = vec4(vec3(1.0), 1.0 - pow(max(dif, 0.0), 0.2));
+}
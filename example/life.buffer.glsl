@@ -0,0 +1,47 @@
+#version 330 core
+
+// Game of life simulated at a quarter of the screen resolution, see life.multipass.json
+
+uniform vec2 resolution;
+uniform vec2 mouse;
+uniform int frame;
+uniform sampler2D state;
+
+float random (in vec2 point) {
+	return fract(100.0 * sin(point.x + fract(100.0 * sin(point.y)))); // http://www.matteo-basei.it/noise
+}
+
+layout(location = 0) out vec4 diffuseColor;
+
+void main() {
+	ivec2 p = ivec2(gl_FragCoord.xy);
+	ivec2 size = ivec2(resolution);
+
+	int n = 0;
+
+	for (int x = -1; x <= 1; ++ x) {
+		for (int y = -1; y <= 1; ++ y) {
+			if (x == 0 && y == 0)
+				continue;
+
+			n += texelFetch(state, (p + ivec2(x, y) + size) % size, 0).x > 0.5 ? 1 : 0;
+		}
+	}
+
+	bool self = texelFetch(state, p, 0).x > 0.5;
+	bool alive = ((n == 2 || n == 3) && self) || (n == 3 && !self);
+
+	// the age of a cell fades from 1 to 0 in the green channel
+	float age = alive ? 1.0 : max(texelFetch(state, p, 0).y - 0.02, 0.0);
+
+	if (distance(gl_FragCoord.xy, mouse * resolution) <= 2.0) {
+		alive = true;
+	}
+
+	// init
+	if (frame <= 1) {
+		alive = random(gl_FragCoord.xy) > 0.5;
+	}
+
+	diffuseColor = vec4(alive ? 1.0 : 0.0, alive ? 1.0 : age, 0.0, 1.0);
+}
@@ -0,0 +1,21 @@
+#version 330 core
+
+// Upscales and colors the state of life.buffer.glsl
+
+uniform vec2 resolution;
+uniform sampler2D state;
+
+layout(location = 0) out vec4 diffuseColor;
+
+void main() {
+	vec4 cell = texture(state, gl_FragCoord.xy / resolution);
+
+	vec3 dead = vec3(0.05, 0.05, 0.1);
+	vec3 fading = vec3(0.1, 0.3, 0.6);
+	vec3 alive = vec3(0.9, 0.95, 1.0);
+
+	vec3 color = mix(dead, fading, cell.y);
+	color = mix(color, alive, cell.x);
+
+	diffuseColor = vec4(color, 1.0);
+}
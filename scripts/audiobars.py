@@ -0,0 +1,22 @@
+import pyaudio
+import numpy as np
+
+# Runs in its own process because of the tick function, so waiting for audio never drops a frame
+TICKRATE = 60
+
+CHUNK = 512
+BARS = 64
+
+audio = None
+stream = None
+
+def init():
+    global audio, stream
+    audio = pyaudio.PyAudio()
+    stream = audio.open(format=pyaudio.paInt16, channels=1, rate=44100, input=True, frames_per_buffer=CHUNK * 2)
+
+def tick(_):
+    data = np.frombuffer(stream.read(CHUNK, exception_on_overflow=False), dtype=np.int16)
+
+    # becomes the "bar" uniform of every shader that declares it
+    return { "bar": (data[::CHUNK // BARS][:BARS] * 0.001).astype(np.float32) }
@@ -0,0 +1,30 @@
+from shadow.scripting import every, on_event
+
+# Publishes the cpu load as the "cpu" uniform and counts clicks as "clicks", nothing runs per frame
+last = None
+clicks = 0
+
+def read_cpu_times():
+    with open("/proc/stat", "r") as file:
+        times = [ int(t) for t in file.readline().split()[1:] ]
+    return times[3] + times[4], sum(times) # idle and iowait, total
+
+@every(1.0)
+def cpu():
+    global last
+
+    idle, total = read_cpu_times()
+    if last is None:
+        last = (idle, total)
+        return None
+
+    load = 1 - (idle - last[0]) / max(total - last[1], 1)
+    last = (idle, total)
+
+    return { "cpu": load }
+
+@on_event("mouse_down")
+async def click(_):
+    global clicks
+    clicks += 1
+    return { "clicks": clicks }
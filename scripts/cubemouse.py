@@ -1,4 +1,3 @@
-import mouse
 import numpy as np
 
 FACTOR = 0.1 # you can change this
@@ -50,10 +49,8 @@ currentY = 0.5
 def render(_, show):
     global currentX, currentY
 
-    mouseX, mouseY = mouse.get_position()
-
-    mouseX = mouseX / show.width
-    mouseY = 1 - mouseY / show.height
+    # sampled once per frame by shadow, polling the mouse here again is not needed
+    mouseX, mouseY = show.input.cursor(show)
 
     currentX += (mouseX - currentX) * FACTOR
     currentY += (mouseY - currentY) * FACTOR
@@ -1,15 +1,20 @@
 from OpenGL import GL as gl
 
-import logging, ctypes, sys
+import logging, ctypes
 
 log = logging.getLogger(__name__)
 
+# Nanoseconds to wait for a readback that did not finish after num - 1 frames
+FENCE_TIMEOUT = 1000 * 1000 * 1000
+
+# Reads back the current framebuffer asynchronously through a ring of pixel pack buffers. Every
+# download starts a new transfer and returns the one that was started num - 1 frames ago, which
+# the gpu had enough time to finish. Fence sync objects tell when a transfer is done.
 class PboDownloader():
     def __init__(self, fmt, width, height, num) -> None:
         self.fmt = fmt
-        self.num_pbos = num
+        self.num_pbos = max(num, 2)
         self.dx = 0
-        self.num_downloads = 0
         self.width = width
         self.height = height
 
@@ -24,15 +29,14 @@ class PboDownloader():
             log.error("Unhandled pixel format, use GL_R, GL_RG, GL_RGB or GL_RGBA.")
 
         if self.nbytes == 0:
-            log.error("Invalid width or height given: %{width} x %{height}")
-
-        self.pbos = (ctypes.c_int * num)()
+            log.error(f"Invalid width or height given: {width} x {height}")
 
-        self.pixels = (ctypes.c_char * self.nbytes)()
+        self.pbos = (ctypes.c_uint * self.num_pbos)()
+        self.fences = [ None ] * self.num_pbos
 
-        gl.glGenBuffers(num, self.pbos)
+        gl.glGenBuffers(self.num_pbos, self.pbos)
 
-        for i in range(num):
+        for i in range(self.num_pbos):
             log.debug("pbodownloader.pbos[%d] = %d, nbytes: %d", i, self.pbos[i], self.nbytes)
 
             gl.glBindBuffer(gl.GL_PIXEL_PACK_BUFFER, self.pbos[i])
@@ -40,28 +44,47 @@ class PboDownloader():
 
         gl.glBindBuffer(gl.GL_PIXEL_PACK_BUFFER, 0)
 
-    def download(self):
-        if self.num_downloads < self.num_pbos:
-            gl.glBindBuffer(gl.GL_PIXEL_PACK_BUFFER, self.pbos[self.dx])
-            gl.glReadPixels(0, 0, self.width, self.height, self.fmt, gl.GL_UNSIGNED_BYTE, 0)   # When a GL_PIXEL_PACK_BUFFER is bound, the last 0 is used as offset into the buffer to read into.
+    # Copies the oldest finished readback to the memory at address dest (if not None) and
+    # starts a new readback of the current framebuffer. Returns True if pixels were copied.
+    def download(self, dest=None) -> bool:
+        copied = False
+
+        gl.glBindBuffer(gl.GL_PIXEL_PACK_BUFFER, self.pbos[self.dx])
+
+        # The buffer still holds the readback from num - 1 frames ago
+        fence = self.fences[self.dx]
+        if fence is not None:
+            self.fences[self.dx] = None
+
+            result = gl.glClientWaitSync(fence, gl.GL_SYNC_FLUSH_COMMANDS_BIT, FENCE_TIMEOUT)
+            gl.glDeleteSync(fence)
+
+            if result == gl.GL_TIMEOUT_EXPIRED or result == gl.GL_WAIT_FAILED:
+                log.warning("Waiting for pixel readback failed")
+            elif dest is not None:
+                ptr = gl.glMapBufferRange(gl.GL_PIXEL_PACK_BUFFER, 0, self.nbytes, gl.GL_MAP_READ_BIT)
+                if ptr:
+                    # copy the pixels out, the mapped pointer is invalid after unmapping
+                    ctypes.memmove(dest, ptr, self.nbytes)
+                    gl.glUnmapBuffer(gl.GL_PIXEL_PACK_BUFFER)
+                    copied = True
+                else:
+                    log.error("Failed to map the buffer")
+
+        # Trigger the next read. When a GL_PIXEL_PACK_BUFFER is bound, the last 0 is used as offset into the buffer to read into.
+        gl.glReadPixels(0, 0, self.width, self.height, self.fmt, gl.GL_UNSIGNED_BYTE, 0)
+        self.fences[self.dx] = gl.glFenceSync(gl.GL_SYNC_GPU_COMMANDS_COMPLETE, 0)
 
-        else:
-            gl.glBindBuffer(gl.GL_PIXEL_PACK_BUFFER, self.pbos[self.dx])
-
-            ptr = gl.glMapBuffer(gl.GL_PIXEL_PACK_BUFFER, gl.GL_READ_ONLY)
-            if ptr != None:
-                self.pixels = (ctypes.c_char * self.nbytes).from_address(ptr)
-                gl.glUnmapBuffer(gl.GL_PIXEL_PACK_BUFFER)
-            else:
-                log.error("Failed to map the buffer")
+        gl.glBindBuffer(gl.GL_PIXEL_PACK_BUFFER, 0)
 
-            # Trigger the next read.
-            gl.glReadPixels(0, 0, self.width, self.height, self.fmt, gl.GL_UNSIGNED_BYTE, 0)
+        self.dx = (self.dx + 1) % self.num_pbos
 
-        self.dx += 1
-        self.dx = self.dx % self.num_pbos
+        return copied
 
-        self.num_downloads += 1
+    def cleanup(self):
+        for fence in self.fences:
+            if fence is not None:
+                gl.glDeleteSync(fence)
 
-        if self.num_downloads == sys.maxsize:
-            self.num_downloads = self.num_pbos
+        self.fences = [ None ] * self.num_pbos
+        gl.glDeleteBuffers(self.num_pbos, self.pbos)
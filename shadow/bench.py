@@ -0,0 +1,246 @@
+#!/usr/bin/python3
+from OpenGL import GL as gl
+from screeninfo import Monitor
+
+from .config import Config, BackgroundMode
+from .shadow import Shadow
+from .input import FrameInput
+from .glutils import GpuTimer
+from .framelimiter import FrameStats
+from .profiler import Profiler, NodeProfile, AllocationMeter, get_process_memory, get_free_vram
+
+import logging
+import argparse
+import json
+import time
+import sys
+import os
+import glfw
+
+log = logging.getLogger(__name__)
+
+# Format of the json reports, increased on incompatible changes
+REPORT_VERSION = 1
+
+# Input that never changes, so runs are reproducible and need no display server
+class FixedInput():
+    def __init__(self, width, height) -> None:
+        self.input = FrameInput(width / 2, height / 2, frozenset(), 0, 0, False)
+
+    def sample(self, _):
+        return self.input
+
+    def cleanup(self):
+        pass
+
+# Renders into an invisible window, measuring the memory every component needs when it is created
+class ShadowHeadless(Shadow):
+    def __init__(self, files, width, height):
+        self.allocations = {} # id of component -> (memory, vram)
+
+        monitor = Monitor(x=0, y=0, width=width, height=height, name="bench")
+        super().__init__([ monitor ], files, width, height)
+
+        # image stacks are measured by their layers
+        for node in self.graph.nodes:
+            if hasattr(node, "images"):
+                sizes = [ self.allocations.get(id(i), (0, None)) for i in node.images ]
+                vram = [ v for _, v in sizes if v is not None ]
+                self.allocations[id(node)] = (sum(m for m, _ in sizes), sum(vram) if vram else None)
+
+    def create_component(self, file):
+        meter = AllocationMeter()
+        c = super().create_component(file)
+
+        # measured frames must not include shaders that are still compiling
+        if hasattr(c, "wait"):
+            c.wait()
+
+        if c is not None:
+            self.allocations[id(c)] = meter.stop()
+
+        return c
+
+    def create_input_sampler(self):
+        return FixedInput(self.width, self.height)
+
+    def swap(self):
+        pass
+
+# Creates the context without a display server if there is none, e.g. in ci
+def init_glfw(egl) -> bool:
+    headless = not os.environ.get("DISPLAY") and not os.environ.get("WAYLAND_DISPLAY")
+
+    if headless and hasattr(glfw, "PLATFORM_NULL"):
+        log.debug('no display server found, using the null platform with osmesa')
+        glfw.init_hint(glfw.PLATFORM, glfw.PLATFORM_NULL)
+
+    if not glfw.init():
+        return False
+
+    if headless and hasattr(glfw, "PLATFORM_NULL"):
+        glfw.window_hint(glfw.CONTEXT_CREATION_API, glfw.OSMESA_CONTEXT_API)
+    elif egl:
+        glfw.window_hint(glfw.CONTEXT_CREATION_API, glfw.EGL_CONTEXT_API)
+
+    return True
+
+def run(show, frames, warmup, dt, uncached) -> dict:
+    for _ in range(warmup):
+        if uncached:
+            show.graph.invalidate()
+        show.render(dt)
+    gl.glFinish()
+
+    profiler = Profiler(show.graph.nodes, frames, show.allocations)
+    show.graph.profiler = profiler
+
+    timer = GpuTimer()
+    cpu = FrameStats(frames)
+    gpu = FrameStats(frames)
+
+    for _ in range(frames):
+        elapsed = timer.result()
+        if elapsed is not None:
+            gpu.add(elapsed)
+
+        if uncached:
+            show.graph.invalidate()
+
+        start = time.perf_counter()
+        timer.begin()
+        show.render(dt)
+        timer.end()
+
+        # wait for the gpu, so the cpu time covers the whole frame like a swap would
+        gl.glFinish()
+        cpu.add(time.perf_counter() - start)
+
+    show.graph.profiler = None
+
+    free = get_free_vram()
+    report = {
+        "version": REPORT_VERSION,
+        "renderer": (gl.glGetString(gl.GL_RENDERER) or b"").decode(),
+        "gl_version": (gl.glGetString(gl.GL_VERSION) or b"").decode(),
+        "resolution": [ show.width, show.height ],
+        "quality": show.quality,
+        "frames": frames,
+        "frame": {
+            "cpu_ms": NodeProfile.times(cpu),
+            "gpu_ms": NodeProfile.times(gpu),
+        },
+        "memory": get_process_memory(),
+        "vram_free": free,
+        "components": profiler.summary(),
+    }
+
+    profiler.cleanup()
+    timer.cleanup()
+
+    return report
+
+def format_bytes(size) -> str:
+    if size is None:
+        return "-"
+    return f"{size / (1024 * 1024):.1f} MiB"
+
+def print_report(report):
+    frame = report["frame"]
+    print(f"{report['renderer']} ({report['gl_version']}), {report['resolution'][0]}x{report['resolution'][1]}, "
+          f"quality {report['quality']}, {report['frames']} frames")
+    print(f"frame: cpu {frame['cpu_ms']['mean']:.3f} ms (p95 {frame['cpu_ms']['p95']:.3f}), "
+          f"gpu {frame['gpu_ms']['mean']:.3f} ms (p95 {frame['gpu_ms']['p95']:.3f}), "
+          f"memory {format_bytes(report['memory'])}")
+    print()
+    print(f"{'component':<40} {'cpu ms':>9} {'cpu p95':>9} {'gpu ms':>9} {'gpu p95':>9} {'memory':>11} {'vram':>11}")
+
+    for c in report["components"]:
+        print(f"{c['name'][:40]:<40} {c['cpu_ms']['mean']:>9.3f} {c['cpu_ms']['p95']:>9.3f} "
+              f"{c['gpu_ms']['mean']:>9.3f} {c['gpu_ms']['p95']:>9.3f} {format_bytes(c['memory']):>11} {format_bytes(c['vram']):>11}")
+
+# Prints the change of every measured time against the baseline, returns the number of regressions
+def compare(report, baseline, threshold) -> int:
+    if baseline.get("version") != REPORT_VERSION:
+        log.warning("baseline was created by a different version of shadow-bench")
+
+    def pairs():
+        for key in ("cpu_ms", "gpu_ms"):
+            yield f"frame {key}", report["frame"][key]["mean"], baseline["frame"][key]["mean"]
+
+        previous = { c["name"]: c for c in baseline.get("components", []) }
+        for c in report["components"]:
+            if c["name"] in previous:
+                for key in ("cpu_ms", "gpu_ms"):
+                    yield f"{c['name']} {key}", c[key]["mean"], previous[c["name"]][key]["mean"]
+
+    print()
+    print(f"{'measurement':<48} {'baseline':>9} {'current':>9} {'change':>8}")
+
+    regressions = 0
+    for name, current, old in pairs():
+        if old <= 0:
+            continue
+
+        change = current / old - 1
+        marker = ""
+        if change > threshold:
+            marker = " regression"
+            regressions += 1
+
+        print(f"{name[:48]:<48} {old:>9.3f} {current:>9.3f} {change * 100:>+7.1f}%{marker}")
+
+    return regressions
+
+def main():
+    logging.basicConfig(level=logging.WARNING)
+
+    all_args = argparse.ArgumentParser(prog="shadow-bench", description="Renders components offscreen and reports their cpu time, gpu time and memory usage")
+    all_args.add_argument("-n", "--frames", help="Number of measured frames, default 300", default=300, type=int)
+    all_args.add_argument("-w", "--warmup", help="Number of frames rendered before measuring, default 30", default=30, type=int)
+    all_args.add_argument("-width", "--width", help="Width of the rendered image, default 1920", default=1920, type=int)
+    all_args.add_argument("-height", "--height", help="Height of the rendered image, default 1080", default=1080, type=int)
+    all_args.add_argument("-q", "--quality", help="Quality level, default 1", default=Config.QUALITY, type=float)
+    all_args.add_argument("-dt", "--timestep", help="Seconds every frame advances the time, default 1/60", default=1 / 60, type=float)
+    all_args.add_argument("-u", "--uncached", help="Render every component each frame, even if it did not change", action="store_true")
+    all_args.add_argument("-o", "--output", help="Save the report as json", type=str)
+    all_args.add_argument("-b", "--baseline", help="Compare against a report saved with --output", type=str)
+    all_args.add_argument("-t", "--threshold", help="Slowdown counted as regression, default 0.1 (10%%)", default=0.1, type=float)
+    all_args.add_argument("--egl", help="Create the context with EGL instead of GLX", action="store_true")
+    all_args.add_argument("-v", "--verbose", help="Show debug output", action="store_true")
+
+    args, files = all_args.parse_known_args()
+
+    if len(files) <= 0:
+        all_args.print_help()
+        return
+
+    if args.verbose:
+        logging.getLogger().setLevel(logging.DEBUG)
+
+    Config.QUALITY = args.quality
+    Config.BACKGROUND_MODE = BackgroundMode.WINDOW
+
+    if not init_glfw(args.egl):
+        log.error('failed to initialize GLFW')
+        sys.exit(1)
+
+    show = ShadowHeadless(files, args.width, args.height)
+    report = run(show, args.frames, args.warmup, args.timestep, args.uncached)
+    del show
+
+    print_report(report)
+
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(report, file, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, "r") as file:
+            baseline = json.load(file)
+
+        if compare(report, baseline, args.threshold) > 0:
+            sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -4,62 +4,116 @@ import importlib.util
 from OpenGL import GL as gl
 from PIL import Image
 
-from .shader import Shader
+from .shader import Shader, ShaderError
 from .config import Config, QualityMode
-
+from .videodecoder import VideoDecoder
+from .glutils import StreamingTexture, create_framebuffer
+from .gifdecoder import GifDecoder
+from .registry import registry, shared_uniforms, get_sampler_name, QUAD_VERTEX_SHADER
+from .rendergraph import NodeFlags
+from .multipass import ComponentMultipass
+from .compute import ComponentCompute
+from .scripthost import ScriptHost, get_hosted_script_settings
+from .scripting import ScriptRuntime, collect_callbacks
+
+from collections import OrderedDict
 from fnmatch import fnmatch
 import imageio
+import inspect
 import logging
-import mouse
-import glfw
+import os
 import numpy as np
 
 log = logging.getLogger(__name__)
 
+# Returns the name of the shared sampler for an image of the given size
+def get_image_sampler_name(width, height, mipmap=False) -> str:
+    # For smaller images we want them to look pixely
+    nearest = width <= 256 or height <= 256 or Config.QUALITY_MODE == QualityMode.PIXEL
+    return get_sampler_name(mipmap, nearest)
+
 class ComponentShader():
     def __init__(self, path):
         with open(path, 'r') as file:
             source = file.read()
 
+        self.path = path
+
+        # Compiling is only started here, so the driver can work on all shaders at once
         self.shader = Shader({
-            gl.GL_VERTEX_SHADER: '''
-                #version 330 core
-                layout(location = 0) in vec2 pos;
-                void main() {
-                  gl_Position.xy = pos;
-                  gl_Position.w = 1.0;
-                }
-                ''',
+            gl.GL_VERTEX_SHADER: QUAD_VERTEX_SHADER,
             gl.GL_FRAGMENT_SHADER: source
-        })
+        }, deferred=True)
+
+        # Until the program is ready the layer stays empty, it is checked every frame
+        self.flags = NodeFlags.TIME
+        self.ready = False
+        self.error = None
 
         self.elapsed = 0
         self.frame = 0
 
+    # Returns whether the shader can be drawn, never blocks
+    def poll(self) -> bool:
+        if self.error is not None:
+            return False
+
+        try:
+            if not self.shader.ready():
+                return False
+        except ShaderError as e:
+            log.error(f"{self.path} does not compile:\n{e}")
+            self.error = e
+            self.flags = NodeFlags.STATIC
+            return False
+
+        # the inputs the shader actually uses decide when it has to be rendered again
+        self.flags = NodeFlags.STATIC
+        if self.shader.has_uniform("time"):
+            self.flags |= NodeFlags.TIME
+        if self.shader.has_uniform("mouse"):
+            self.flags |= NodeFlags.MOUSE
+        if self.shader.has_uniform("prevBuffer") or self.shader.has_uniform("currentBuffer"):
+            self.flags |= NodeFlags.FEEDBACK
+
+        self.ready = True
+        return True
+
+    # Blocks until the shader is compiled, raises ShaderError if it does not compile
+    def wait(self):
+        self.shader.wait()
+        self.poll()
+
     def render(self, dt, show):
+        if not self.ready and not self.poll():
+            return
+
         self.elapsed += dt
         self.frame += 1
 
-        mouseX, mouseY = mouse.get_position()
-        winX, winY = glfw.get_window_pos(show.window)
+        mouseX, mouseY = show.input.cursor(show)
 
-        mouseX = (mouseX - winX) / show.width
-        mouseY = 1 - (mouseY - winY) / show.height
-
-        width = int(show.width * Config.QUALITY)
-        height = int(show.height * Config.QUALITY)
+        width = int(show.width * show.quality)
+        height = int(show.height * show.quality)
 
         self.shader.bind()
-        gl.glActiveTexture(gl.GL_TEXTURE1)
-        gl.glBindTexture(gl.GL_TEXTURE_2D, show.texture) # prev frame
-        gl.glUniform1i(self.shader.get_uniform("currentBuffer"), 1)
-        gl.glActiveTexture(gl.GL_TEXTURE0)
-        gl.glBindTexture(gl.GL_TEXTURE_2D, show.prevTexture) # prev frame
-        gl.glUniform1i(self.shader.get_uniform("prevBuffer"), 0)
 
-        gl.glUniform2f(self.shader.get_uniform("resolution"), width, height)
-        gl.glUniform2f(self.shader.get_uniform("mouse"), mouseX, mouseY)
-        gl.glUniform1f(self.shader.get_uniform("time"), self.elapsed)
+        if self.flags & NodeFlags.FEEDBACK:
+            gl.glActiveTexture(gl.GL_TEXTURE1)
+            gl.glBindTexture(gl.GL_TEXTURE_2D, show.texture) # current frame
+            registry.bind_sampler(1, None)
+            gl.glActiveTexture(gl.GL_TEXTURE0)
+            gl.glBindTexture(gl.GL_TEXTURE_2D, show.prevTexture) # prev frame
+            registry.bind_sampler(0, None)
+
+        self.shader.set_shared_uniforms(shared_uniforms.values)
+        self.shader.set_uniforms(
+            currentBuffer=1,
+            prevBuffer=0,
+            resolution=(width, height),
+            mouse=(mouseX, mouseY),
+            time=self.elapsed,
+        )
 
         gl.glDrawArrays(gl.GL_TRIANGLES, 0, 6)
 
@@ -71,22 +125,77 @@ class ComponentShader():
         return ["*.glsl", "*.frag", "*.fshader", "*.fsh"]
 
 
+# Scripts with a tick function run in their own process, see scripthost.py. They only publish
+# uniforms and draw nothing themselves. All other scripts run in the render loop, callbacks
+# decorated with every or on_event run on the script loop, see scripting.py.
 class ComponentScript():
+    # scripts can do anything, so they are rendered every frame
+    flags = NodeFlags.TIME
+
     def __init__(self, path):
+        self.path = path
+        self.host = None
+        self.script = None
+        self.runtime = None
+
+        settings = get_hosted_script_settings(path)
+        if settings is not None:
+            self.host = ScriptHost(path, settings)
+            self.flags = NodeFlags.STATIC
+            return
+
         self.spec = importlib.util.spec_from_file_location("", path)
         assert type(self.spec) is ModuleSpec, "Error"
         self.script = importlib.util.module_from_spec(self.spec)
         assert self.spec.loader != None, "Error"
         self.spec.loader.exec_module(self.script)
 
-        if hasattr(self.script, "init"):
-            self.script.init()
+        # render runs on the render thread every frame, only init and the callbacks may be async
+        if inspect.iscoroutinefunction(getattr(self.script, "render", None)):
+            raise TypeError(f"{path}: render must not be async, move async work into a function decorated with every or on_event")
+
+        # an async init runs on the script loop, the callbacks only start once it finished
+        init = getattr(self.script, "init", None)
+        if inspect.iscoroutinefunction(init):
+            self.runtime = ScriptRuntime(self.script, os.path.basename(path), init)
+        else:
+            if init is not None:
+                init()
+
+            if collect_callbacks(self.script):
+                self.runtime = ScriptRuntime(self.script, os.path.basename(path))
+
+        # only scheduled callbacks, nothing to do in the render loop
+        if not hasattr(self.script, "render"):
+            self.flags = NodeFlags.STATIC
+
+    # Publishes the latest uniforms of the script, returns whether there were new ones
+    def sync(self) -> bool:
+        if self.host is not None:
+            values = self.host.poll()
+        elif self.runtime is not None:
+            values = self.runtime.poll()
+        else:
+            return False
+
+        if values is None:
+            return False
+
+        shared_uniforms.publish(values, self.path)
+        return True
 
     def render(self, dt, show):
         if hasattr(self.script, "render"):
             self.script.render(dt, show)
+            registry.invalidate()
 
     def cleanup(self):
+        if self.host is not None:
+            self.host.stop()
+            return
+
+        if self.runtime is not None:
+            self.runtime.stop()
         if hasattr(self.script, "cleanup"):
             self.script.cleanup()
 
@@ -95,62 +204,75 @@ class ComponentScript():
         return [ "*.py" ]
 
 class ComponentAnimatedImage():
+    flags = NodeFlags.TIME
+
     def __init__(self, file):
         self.tex = Image.open(file)
-        self.textures = []
-        self.durations = []
-
-        # TODO: currently loads gif to memory, will cause issues with bigger gifs
-        for frame in range(0, self.tex.n_frames):
-            self.tex.seek(frame)
-            img = self.tex.convert("RGB")
-
-            self.textures.append(gl.glGenTextures(1))
-            self.durations.append(self.tex.info['duration'])
-
-            gl.glPixelStorei(gl.GL_UNPACK_ALIGNMENT, 1)
-            gl.glBindTexture(gl.GL_TEXTURE_2D, self.textures[frame])
-            gl.glTexParameterf(gl.GL_TEXTURE_2D, gl.GL_TEXTURE_WRAP_S, gl.GL_REPEAT)
-            gl.glTexParameterf(gl.GL_TEXTURE_2D, gl.GL_TEXTURE_WRAP_T, gl.GL_REPEAT)
-            gl.glTexParameterf(gl.GL_TEXTURE_2D, gl.GL_TEXTURE_MIN_FILTER, gl.GL_LINEAR_MIPMAP_LINEAR)
-
-            # For smaller images we want them to look pixely
-            if self.tex.width <= 256 or self.tex.height <= 256 or Config.QUALITY_MODE == QualityMode.PIXEL:
-                gl.glTexParameterf(gl.GL_TEXTURE_2D, gl.GL_TEXTURE_MAG_FILTER, gl.GL_NEAREST)
-            else:
-                gl.glTexParameterf(gl.GL_TEXTURE_2D, gl.GL_TEXTURE_MAG_FILTER, gl.GL_LINEAR)
-
-            data = img.tobytes("raw", "RGB", 0, -1)
-            gl.glTexImage2D(gl.GL_TEXTURE_2D, 0, gl.GL_RGB, self.tex.width, self.tex.height, 0, gl.GL_RGB, gl.GL_UNSIGNED_BYTE, data)
+        self.n_frames = self.tex.n_frames
+
+        # Frames are decoded on a separate thread and kept in a small window of textures that
+        # is reused in least recently used order. Short animations fit into the window entirely
+        # and are only decoded once, longer ones are streamed with a bounded memory usage.
+        self.resident = self.n_frames <= Config.GIF_CACHE_FRAMES
+        self.capacity = self.n_frames if self.resident else 2
+        self.textures = OrderedDict() # frame index -> texture
+        self.durations = {}
+
+        self.decoder = GifDecoder(file, loop=not self.resident)
+        self.decoder.start()
+        self.pending = None
+
+        # the textured quad program and samplers are shared with all other image layers
+        self.shader = registry.acquire("program:image")
+        self.sampler_name = get_image_sampler_name(self.tex.width, self.tex.height)
+        self.sampler = registry.acquire(self.sampler_name)
+
+        self.seq = 0 # number of frames played, the current frame is seq % n_frames
+        self.elapsed = 0
+        self.texture = None
 
-            gl.glGenerateMipmap(gl.GL_TEXTURE_2D)
+    def create_texture(self):
+        texture = gl.glGenTextures(1)
 
-        # load shader for texture
-        self.shader = Shader({
-            gl.GL_VERTEX_SHADER: '''
-                #version 330 core
-                layout(location = 0) in vec2 pos;
-
-                void main() {
-                  gl_Position.xy = pos;
-                  gl_Position.w = 1.0;
-                }
-                ''',
-            gl.GL_FRAGMENT_SHADER: '''
-                #version 330 core
-                uniform sampler2D tex;
-                uniform vec2 resolution;
-                uniform vec2 position;
-                out vec4 color;
-
-                void main() {
-                    color = texture(tex, gl_FragCoord.xy / resolution.xy - position / resolution.xy);
-                }
-                '''
-        })
+        # filtering and wrapping come from the shared sampler
+        gl.glBindTexture(gl.GL_TEXTURE_2D, texture)
+        gl.glTexImage2D(gl.GL_TEXTURE_2D, 0, gl.GL_RGB8, self.tex.width, self.tex.height, 0, gl.GL_RGB, gl.GL_UNSIGNED_BYTE, None)
 
-        self.frame = 0
-        self.elapsed = 0
+        return texture
+
+    # Returns the texture of the frame with the given sequence number if it is available
+    def get_texture(self, seq):
+        index = seq % self.n_frames
+
+        if index in self.textures:
+            self.textures.move_to_end(index)
+            return self.textures[index]
+
+        # Skip decoded frames that are already too old
+        while self.pending is None or self.pending[0] < seq:
+            self.pending = self.decoder.get()
+            if self.pending is None:
+                return None
+
+        if self.pending[0] > seq:
+            return None
+
+        _, index, data, duration = self.pending
+        self.pending = None
+        self.durations[index] = duration
+
+        # Reuse the least recently used texture once the window is full
+        if len(self.textures) >= self.capacity:
+            _, texture = self.textures.popitem(last=False)
+        else:
+            texture = self.create_texture()
+
+        gl.glPixelStorei(gl.GL_UNPACK_ALIGNMENT, 1)
+        gl.glBindTexture(gl.GL_TEXTURE_2D, texture)
+        gl.glTexSubImage2D(gl.GL_TEXTURE_2D, 0, 0, 0, self.tex.width, self.tex.height, gl.GL_RGB, gl.GL_UNSIGNED_BYTE, data)
+
+        self.textures[index] = texture
+        return texture
 
     def render(self, dt, show):
         self.elapsed += dt
@@ -165,24 +287,38 @@ class ComponentAnimatedImage():
         x = (show.width - w) / 2
         y = (show.height - h) / 2
 
-        if self.frame >= self.tex.n_frames - 1:
-            self.frame = 0
-        elif self.elapsed > self.durations[self.frame] / 1000:
-            self.elapsed -= self.durations[self.frame] / 1000
-            self.frame += 1
+        # Advance to the next frame only once it got decoded, otherwise keep showing the current one
+        texture = self.get_texture(self.seq)
+        if texture is not None:
+            self.texture = texture
+
+            duration = self.durations.get(self.seq % self.n_frames, 100) / 1000
+            if self.elapsed > duration:
+                self.elapsed -= duration
+                self.seq += 1
+
+        if self.texture is None:
+            return
 
         # bind image and render it
-        gl.glBindTexture(gl.GL_TEXTURE_2D, self.textures[self.frame])
+        gl.glBindTexture(gl.GL_TEXTURE_2D, self.texture)
+        registry.bind_sampler(0, self.sampler)
         self.shader.bind()
-        gl.glUniform2f(self.shader.get_uniform("position"), x * Config.QUALITY, y * Config.QUALITY)
-        gl.glUniform2f(self.shader.get_uniform("resolution"), w * Config.QUALITY, h * Config.QUALITY)
+        self.shader.set_uniforms(
+            position=(x * show.quality, y * show.quality),
+            resolution=(w * show.quality, h * show.quality),
+        )
         gl.glDrawArrays(gl.GL_TRIANGLES, 0, 6)
 
 
     def cleanup(self):
-        gl.glDeleteTextures(len(self.textures), self.textures)
+        self.decoder.stop()
 
-        del self.shader
+        textures = list(self.textures.values())
+        gl.glDeleteTextures(len(textures), textures)
+
+        registry.release("program:image")
+        registry.release(self.sampler_name)
 
     @staticmethod
     def extensions():
@@ -190,23 +326,16 @@ class ComponentAnimatedImage():
 
 
 class ComponentImage():
+    flags = NodeFlags.STATIC
+
     def __init__(self, file):
         self.texture_id = gl.glGenTextures(1)
 
         gl.glPixelStorei(gl.GL_UNPACK_ALIGNMENT, 1)
         gl.glBindTexture(gl.GL_TEXTURE_2D, self.texture_id)
-        gl.glTexParameterf(gl.GL_TEXTURE_2D, gl.GL_TEXTURE_WRAP_S, gl.GL_REPEAT)
-        gl.glTexParameterf(gl.GL_TEXTURE_2D, gl.GL_TEXTURE_WRAP_T, gl.GL_REPEAT)
-        gl.glTexParameterf(gl.GL_TEXTURE_2D, gl.GL_TEXTURE_MIN_FILTER, gl.GL_LINEAR_MIPMAP_LINEAR)
 
         self.tex = Image.open(file)
 
-        # For smaller images we want them to look pixely
-        if self.tex.width <= 256 or self.tex.height <= 256 or Config.QUALITY_MODE == QualityMode.PIXEL:
-            gl.glTexParameterf(gl.GL_TEXTURE_2D, gl.GL_TEXTURE_MAG_FILTER, gl.GL_NEAREST)
-        else:
-            gl.glTexParameterf(gl.GL_TEXTURE_2D, gl.GL_TEXTURE_MAG_FILTER, gl.GL_LINEAR)
-
         # depending on image type we have an alpha channel
         mode = "".join(Image.Image.getbands(self.tex))
         if mode == "RGB":
@@ -218,29 +347,10 @@ class ComponentImage():
 
         gl.glGenerateMipmap(gl.GL_TEXTURE_2D)
 
-        # load shader for texture
-        self.shader = Shader({
-            gl.GL_VERTEX_SHADER: '''
-                #version 330 core
-                layout(location = 0) in vec2 pos;
-
-                void main() {
-                  gl_Position.xy = pos;
-                  gl_Position.w = 1.0;
-                }
-                ''',
-            gl.GL_FRAGMENT_SHADER: '''
-                #version 330 core
-                uniform sampler2D tex;
-                uniform vec2 resolution;
-                uniform vec2 position;
-                out vec4 color;
-
-                void main() {
-                    color = texture(tex, gl_FragCoord.xy / resolution.xy - position / resolution.xy);
-                }
-                '''
-        })
+        # the textured quad program and samplers are shared with all other image layers
+        self.shader = registry.acquire("program:image")
+        self.sampler_name = get_image_sampler_name(self.tex.width, self.tex.height, mipmap=True)
+        self.sampler = registry.acquire(self.sampler_name)
 
     def render(self, _, show):
 
@@ -256,28 +366,122 @@ class ComponentImage():
 
         # bind image and render it
         gl.glBindTexture(gl.GL_TEXTURE_2D, self.texture_id)
+        registry.bind_sampler(0, self.sampler)
         self.shader.bind()
-        gl.glUniform2f(self.shader.get_uniform("position"), x * Config.QUALITY, y * Config.QUALITY)
-        gl.glUniform2f(self.shader.get_uniform("resolution"), w * Config.QUALITY, h * Config.QUALITY)
+        self.shader.set_uniforms(
+            position=(x * show.quality, y * show.quality),
+            resolution=(w * show.quality, h * show.quality),
+        )
         gl.glDrawArrays(gl.GL_TRIANGLES, 0, 6)
 
 
     def cleanup(self):
         gl.glDeleteTextures(1, [self.texture_id])
-        del self.shader
+
+        registry.release("program:image")
+        registry.release(self.sampler_name)
 
     @staticmethod
     def extensions():
         return [ "*.jpeg", "*.jpg", "*.png", "*.bmp" ]
 
 
+# Consecutive image layers never change, so they are drawn once into a cached texture per render
+# target, which is then composited with a single draw call. The cache is rebuilt when the size of
+# the target or its render scale changes.
+class ComponentImageStack():
+    flags = NodeFlags.STATIC
+
+    def __init__(self, images):
+        self.images = images
+        self.name = " + ".join(getattr(i, "name", "image") for i in images)
+        self.cache = {} # render target -> (width, height, texture, fbo)
+
+        self.shader = registry.acquire("program:image")
+
+    def flatten(self, show, width, height):
+        log.debug(f'flattening {len(self.images)} image layers at {width}x{height}')
+
+        # the stack may be drawn into another framebuffer than the one of the render target
+        previous = gl.glGetIntegerv(gl.GL_DRAW_FRAMEBUFFER_BINDING)
+        texture, fbo = create_framebuffer(show.width, show.height, show.quality)
+
+        gl.glBindFramebuffer(gl.GL_FRAMEBUFFER, fbo)
+        gl.glClearColor(0, 0, 0, 0)
+        gl.glClear(gl.GL_COLOR_BUFFER_BIT)
+
+        # Store premultiplied colors with the combined coverage in alpha, so that drawing the result
+        # later gives the same image as drawing every layer on its own
+        gl.glBlendFuncSeparate(gl.GL_SRC_ALPHA, gl.GL_ONE_MINUS_SRC_ALPHA, gl.GL_ONE, gl.GL_ONE_MINUS_SRC_ALPHA)
+        for image in self.images:
+            image.render(0, show)
+        gl.glBlendFunc(gl.GL_SRC_ALPHA, gl.GL_ONE_MINUS_SRC_ALPHA)
+
+        gl.glBindFramebuffer(gl.GL_FRAMEBUFFER, previous)
+
+        return texture, fbo
+
+    def render(self, _, show):
+        width = max(int(show.width * show.quality), 1)
+        height = max(int(show.height * show.quality), 1)
+
+        cached = self.cache.get(show)
+        if cached is None or cached[:2] != (width, height):
+            if cached is not None:
+                gl.glDeleteFramebuffers(1, [cached[3]])
+                gl.glDeleteTextures(1, [cached[2]])
+
+            cached = self.cache[show] = (width, height) + self.flatten(show, width, height)
+
+        gl.glActiveTexture(gl.GL_TEXTURE0)
+        gl.glBindTexture(gl.GL_TEXTURE_2D, cached[2])
+        registry.bind_sampler(0, None)
+
+        self.shader.bind()
+        self.shader.set_uniforms(position=(0, 0), resolution=(width, height))
+
+        gl.glBlendFunc(gl.GL_ONE, gl.GL_ONE_MINUS_SRC_ALPHA)
+        gl.glDrawArrays(gl.GL_TRIANGLES, 0, 6)
+        gl.glBlendFunc(gl.GL_SRC_ALPHA, gl.GL_ONE_MINUS_SRC_ALPHA)
+
+    # Deletes the flattened layers cached for a render target that is not used anymore
+    def release_target(self, target):
+        cached = self.cache.pop(target, None)
+        if cached is not None:
+            gl.glDeleteFramebuffers(1, [cached[3]])
+            gl.glDeleteTextures(1, [cached[2]])
+
+    # The layers are kept with images=False, e.g. to batch them again
+    def cleanup(self, images=True):
+        for _, _, texture, fbo in self.cache.values():
+            gl.glDeleteFramebuffers(1, [fbo])
+            gl.glDeleteTextures(1, [texture])
+        self.cache.clear()
+
+        if images:
+            for image in self.images:
+                image.cleanup()
+
+        registry.release("program:image")
+
+    @staticmethod
+    def extensions():
+        return []
+
+
 class ComponentVideo():
+    flags = NodeFlags.TIME
+
     def __init__(self, file):
 
         # Setup ImageIO
         self.reader = imageio.get_reader(file, 'ffmpeg')
 
         self.len = self.reader.count_frames()
+        if self.len == 0:
+            self.reader.close()
+            raise ValueError("the video has no frames")
+
         metadata = self.reader.get_meta_data()
         (self.width, self.height) = metadata["size"]
         self.frametime = 1.0 / metadata["fps"]
@@ -286,56 +490,36 @@ class ComponentVideo():
         self.elapsed = 0
         self.frame = 0
 
-        # Create Image
-        self.texture_id = gl.glGenTextures(1)
-        gl.glPixelStorei(gl.GL_UNPACK_ALIGNMENT, 1)
-        gl.glBindTexture(gl.GL_TEXTURE_2D, self.texture_id)
-        gl.glTexParameterf(gl.GL_TEXTURE_2D, gl.GL_TEXTURE_WRAP_S, gl.GL_REPEAT)
-        gl.glTexParameterf(gl.GL_TEXTURE_2D, gl.GL_TEXTURE_WRAP_T, gl.GL_REPEAT)
-        gl.glTexParameterf(gl.GL_TEXTURE_2D, gl.GL_TEXTURE_MIN_FILTER, gl.GL_LINEAR_MIPMAP_LINEAR)
-
-        # For smaller images we want them to look pixely
-        if self.width <= 256 or self.height <= 256 or Config.QUALITY_MODE == QualityMode.PIXEL:
-            gl.glTexParameterf(gl.GL_TEXTURE_2D, gl.GL_TEXTURE_MAG_FILTER, gl.GL_NEAREST)
-        else:
-            gl.glTexParameterf(gl.GL_TEXTURE_2D, gl.GL_TEXTURE_MAG_FILTER, gl.GL_LINEAR)
+        # Frames are decoded ahead of time on a separate thread
+        self.decoder = VideoDecoder(self.reader, self.len, self.width, self.height)
+        self.decoder.start()
 
+        # Create streaming texture, mipmaps are not needed as videos are always scaled to screen size
+        self.texture = StreamingTexture(self.width, self.height)
 
-        # load shader for texture
-        self.shader = Shader({
-            gl.GL_VERTEX_SHADER: '''
-                #version 330 core
-                layout(location = 0) in vec2 pos;
-
-                void main() {
-                  gl_Position.xy = pos;
-                  gl_Position.w = 1.0;
-                }
-                ''',
-            gl.GL_FRAGMENT_SHADER: '''
-                #version 330 core
-                uniform sampler2D tex;
-                uniform vec2 resolution;
-                uniform vec2 position;
-                out vec4 color;
-
-                void main() {
-                    color = texture(tex, vec2(0, 1) - (gl_FragCoord.xy / resolution.xy - position / resolution.xy));
-                }
-                '''
-        })
+        # the textured quad program and samplers are shared with all other layers
+        self.shader = registry.acquire("program:video")
+        self.sampler_name = get_image_sampler_name(self.width, self.height)
+        self.sampler = registry.acquire(self.sampler_name)
 
     def render(self, dt, show):
         self.elapsed += dt
 
-        while self.elapsed >= self.frametime / Config.SPEED:
-            self.elapsed -= self.frametime / Config.SPEED
-            self.frame += 1
+        # after a freeze dt covers the whole frozen time, the decoder seeks to catch up
+        frametime = self.frametime / Config.SPEED
+        frames = int(self.elapsed / frametime)
+        self.elapsed -= frames * frametime
+        self.frame += frames
 
-        gl.glBindTexture(gl.GL_TEXTURE_2D, self.texture_id)
-        image = self.reader.get_data(self.frame % self.len)
-        gl.glTexImage2D(gl.GL_TEXTURE_2D, 0, gl.GL_RGB, self.width, self.height, 0, gl.GL_RGB, gl.GL_UNSIGNED_BYTE, image)
-        gl.glGenerateMipmap(gl.GL_TEXTURE_2D)
+        # Transfer the frame uploaded last time to the texture and
+        # only upload the next one if a newer frame got decoded
+        self.texture.commit()
+
+        image = self.decoder.acquire(self.frame)
+        if image is not None:
+            self.texture.upload(image)
+
+        self.texture.bind()
 
         # scale to fit screen
         s = max(show.width / self.width, show.height / self.height)
@@ -348,15 +532,23 @@ class ComponentVideo():
         y = (show.height - h) / 2
 
         # bind image and render it
+        registry.bind_sampler(0, self.sampler)
         self.shader.bind()
-        gl.glUniform2f(self.shader.get_uniform("position"), x * Config.QUALITY, y * Config.QUALITY)
-        gl.glUniform2f(self.shader.get_uniform("resolution"), w * Config.QUALITY, h * Config.QUALITY)
+        self.shader.set_uniforms(
+            position=(x * show.quality, y * show.quality),
+            resolution=(w * show.quality, h * show.quality),
+        )
         gl.glDrawArrays(gl.GL_TRIANGLES, 0, 6)
 
 
     def cleanup(self):
-        gl.glDeleteTextures(1, [self.texture_id])
-        del self.shader
+        self.decoder.stop()
+        self.reader.close()
+
+        self.texture.cleanup()
+
+        registry.release("program:video")
+        registry.release(self.sampler_name)
 
     @staticmethod
     def extensions():
@@ -364,13 +556,45 @@ class ComponentVideo():
         return [ "*.mp4", "*.mkv", "*.mov", "*.webm", "*.mvi", "*.mjpeg" ]
 
 
-components = [ ComponentShader, ComponentScript, ComponentImage, ComponentAnimatedImage, ComponentVideo ]
+components = [ ComponentShader, ComponentScript, ComponentImage, ComponentAnimatedImage, ComponentVideo, ComponentMultipass, ComponentCompute ]
 
 def create_component_from_file(path):
     for c in components:
         for ext in c.extensions():
             if fnmatch(path, ext):
-                return c(path)
+                component = c(path)
+                component.name = os.path.basename(path)
+                return component
 
     log.error("Unsupported file extension in: " + path)
     return None
+
+# Files a component would be built from, without loading it. Only manifests reference others.
+def get_files_from_file(path) -> list:
+    for c in components:
+        for ext in c.extensions():
+            if fnmatch(path, ext) and hasattr(c, "get_files"):
+                return c.get_files(path)
+
+    return [ path ]
+
+# Replaces runs of two or more consecutive image layers with a single pre-flattened stack
+def batch_static_layers(components) -> list:
+    batched = []
+    run = []
+
+    for c in components + [ None ]:
+        if isinstance(c, ComponentImage):
+            run.append(c)
+            continue
+
+        if len(run) > 1:
+            batched.append(ComponentImageStack(run))
+        else:
+            batched.extend(run)
+        run = []
+
+        if c is not None:
+            batched.append(c)
+
+    return batched
@@ -0,0 +1,230 @@
+from OpenGL import GL as gl
+
+from .shader import Shader
+from .registry import registry, QUAD_VERTEX_SHADER
+from .rendergraph import NodeFlags
+from .multipass import BufferSpec, MultipassBuffer, BUFFER_FORMATS
+
+from functools import lru_cache
+import logging
+import json
+import math
+import os
+
+log = logging.getLogger(__name__)
+
+# Ticks run at most per frame, so a slow frame does not make the next one even slower
+MAX_TICKS_PER_FRAME = 4
+
+# Compute shaders are core since OpenGL 4.3, the context may still be older
+@lru_cache(maxsize=None)
+def supports_compute() -> bool:
+    version = (gl.glGetIntegerv(gl.GL_MAJOR_VERSION), gl.glGetIntegerv(gl.GL_MINOR_VERSION))
+    if version >= (4, 3):
+        return True
+
+    extensions = { gl.glGetStringi(gl.GL_EXTENSIONS, i) for i in range(gl.glGetIntegerv(gl.GL_NUM_EXTENSIONS)) }
+    return b"GL_ARB_compute_shader" in extensions and b"GL_ARB_shader_image_load_store" in extensions
+
+# Simulation that runs independently from the display, defined by a json manifest:
+#
+#   {
+#     "compute": "sim.comp",        compute shader, reads image2D "previous" (binding 0), writes "next" (binding 1)
+#     "fallback": "sim.glsl",       fragment shader used without compute support, reads sampler "state"
+#     "display": "image.glsl",      fragment shader drawing the simulation, reads sampler "state"
+#     "size": [ 480, 270 ],         simulation size, or "scale" relative to the render target
+#     "format": "rgba8", "filter": "nearest", "wrap": "repeat",
+#     "steps": 1,                   simulation steps per tick
+#     "tickrate": 30                ticks per second, 0 ticks once per frame
+#   }
+#
+# The simulation shaders get resolution (of the simulation), mouse, time and frame (the number of
+# the step) uniforms, the display shader resolution (of the render target), mouse and time.
+class ComponentCompute():
+    def __init__(self, path):
+        with open(path, 'r') as file:
+            manifest = json.load(file)
+
+        base = os.path.dirname(path)
+
+        # everything the component is built from, for reloading it on changes
+        self.files = self.manifest_files(path, manifest)
+
+        self.spec = BufferSpec("state", manifest)
+        self.size = manifest.get("size")
+        self.steps = max(int(manifest.get("steps", 1)), 1)
+        self.tickrate = float(manifest.get("tickrate", 0))
+
+        self.compute = supports_compute() and "compute" in manifest
+        if self.compute:
+            self.simulation = Shader({ gl.GL_COMPUTE_SHADER: self.read(base, manifest["compute"]) })
+            self.group_size = gl.glGetProgramiv(self.simulation.program_id, gl.GL_COMPUTE_WORK_GROUP_SIZE)
+        elif "fallback" in manifest:
+            log.info(f"{path}: compute shaders are not supported, using the fragment shader fallback")
+            self.simulation = Shader({
+                gl.GL_VERTEX_SHADER: QUAD_VERTEX_SHADER,
+                gl.GL_FRAGMENT_SHADER: self.read(base, manifest["fallback"])
+            })
+        else:
+            raise ValueError(f"{path}: compute shaders are not supported and there is no fallback")
+
+        self.display = Shader({
+            gl.GL_VERTEX_SHADER: QUAD_VERTEX_SHADER,
+            gl.GL_FRAGMENT_SHADER: self.read(base, manifest["display"])
+        })
+
+        self.flags = NodeFlags.TIME
+        if self.simulation.has_uniform("mouse") or self.display.has_uniform("mouse"):
+            self.flags |= NodeFlags.MOUSE
+
+        self.states = {} # render target -> MultipassBuffer
+        self.frames = {} # render target -> steps run on its state
+        self.elapsed = 0
+        self.pending = 0 # simulation time not ticked yet
+        self.ticks = 0   # ticks of the current frame, repeated for the other render targets
+
+    @staticmethod
+    def read(base, file) -> str:
+        with open(os.path.join(base, file), 'r') as f:
+            return f.read()
+
+    def get_state(self, show) -> MultipassBuffer:
+        if self.size is not None:
+            width, height = int(self.size[0]), int(self.size[1])
+        else:
+            width = max(int(show.width * show.quality * self.spec.scale), 1)
+            height = max(int(show.height * show.quality * self.spec.scale), 1)
+
+        state = self.states.get(show)
+        if state is None or (state.width, state.height) != (width, height):
+            if state is not None:
+                state.cleanup()
+
+            log.debug(f'creating simulation state with {width}x{height} as {self.spec.format}')
+            state = self.states[show] = MultipassBuffer(self.spec, width, height)
+
+            # new states are empty, the simulation seeds them when frame is 1
+            self.frames[show] = 0
+
+        return state
+
+    def step(self, state, mouse, frame):
+        self.simulation.bind()
+        self.simulation.set_uniforms(
+            resolution=(state.width, state.height),
+            mouse=mouse,
+            time=self.elapsed,
+            frame=frame,
+        )
+
+        if self.compute:
+            internal_format = BUFFER_FORMATS[self.spec.format][0]
+
+            gl.glBindImageTexture(0, state.texture, 0, gl.GL_FALSE, 0, gl.GL_READ_ONLY, internal_format)
+            gl.glBindImageTexture(1, state.textures[1 - state.front], 0, gl.GL_FALSE, 0, gl.GL_WRITE_ONLY, internal_format)
+
+            gl.glDispatchCompute(math.ceil(state.width / self.group_size[0]), math.ceil(state.height / self.group_size[1]), 1)
+
+            # the next step reads the image, the display pass samples it
+            gl.glMemoryBarrier(gl.GL_SHADER_IMAGE_ACCESS_BARRIER_BIT | gl.GL_TEXTURE_FETCH_BARRIER_BIT)
+        else:
+            gl.glActiveTexture(gl.GL_TEXTURE0)
+            gl.glBindTexture(gl.GL_TEXTURE_2D, state.texture)
+            registry.bind_sampler(0, None)
+            self.simulation.set_uniforms(state=0)
+
+            gl.glBindFramebuffer(gl.GL_FRAMEBUFFER, state.back_fbo)
+            gl.glViewport(0, 0, state.width, state.height)
+            gl.glDisable(gl.GL_BLEND)
+            gl.glDrawArrays(gl.GL_TRIANGLES, 0, 6)
+
+        state.swap()
+
+    # Returns the number of ticks to run for a frame that took dt
+    def advance(self, dt) -> int:
+        if self.tickrate <= 0:
+            return 1
+
+        self.pending += dt
+        ticks = min(int(self.pending * self.tickrate), MAX_TICKS_PER_FRAME)
+        self.pending = min(self.pending - ticks / self.tickrate, 1 / self.tickrate)
+
+        return ticks
+
+    def render(self, dt, show):
+        self.elapsed += dt
+
+        mouse = show.input.cursor(show)
+        state = self.get_state(show)
+
+        width = int(show.width * show.quality)
+        height = int(show.height * show.quality)
+
+        # The simulation advances with its own tick rate, independent of the framerate. Time only
+        # advances for the first render target, the others repeat its number of ticks.
+        if dt > 0:
+            self.ticks = self.advance(dt)
+        steps = self.ticks * self.steps
+
+        # a new state has to be seeded before it is displayed, whatever the tick rate says
+        if self.frames[show] == 0:
+            steps = max(steps, 1)
+
+        if steps > 0:
+            target_fbo = gl.glGetIntegerv(gl.GL_DRAW_FRAMEBUFFER_BINDING)
+
+            for _ in range(steps):
+                self.frames[show] += 1
+                self.step(state, mouse, self.frames[show])
+
+            gl.glBindFramebuffer(gl.GL_FRAMEBUFFER, target_fbo)
+            gl.glViewport(0, 0, width, height)
+            gl.glEnable(gl.GL_BLEND)
+
+        # Only display the current state
+        gl.glActiveTexture(gl.GL_TEXTURE0)
+        gl.glBindTexture(gl.GL_TEXTURE_2D, state.texture)
+        registry.bind_sampler(0, None)
+
+        self.display.bind()
+        self.display.set_uniforms(
+            state=0,
+            resolution=(width, height),
+            mouse=mouse,
+            time=self.elapsed,
+        )
+        gl.glDrawArrays(gl.GL_TRIANGLES, 0, 6)
+
+    # Deletes the simulation state of a render target that is not used anymore
+    def release_target(self, target):
+        self.frames.pop(target, None)
+        state = self.states.pop(target, None)
+        if state is not None:
+            state.cleanup()
+
+    def cleanup(self):
+        for state in self.states.values():
+            state.cleanup()
+        self.states.clear()
+        self.frames.clear()
+
+        del self.simulation
+        del self.display
+
+    @staticmethod
+    def manifest_files(path, manifest) -> list:
+        base = os.path.dirname(path)
+        return [ path ] + [ os.path.join(base, manifest[key]) for key in ("compute", "fallback", "display") if key in manifest ]
+
+    # Files of a manifest that could not be loaded, so fixing a broken shader reloads it as well
+    @staticmethod
+    def get_files(path) -> list:
+        try:
+            with open(path, 'r') as file:
+                return ComponentCompute.manifest_files(path, json.load(file))
+        except (OSError, ValueError, TypeError, AttributeError):
+            return [ path ]
+
+    @staticmethod
+    def extensions():
+        return [ "*.compute.json" ]
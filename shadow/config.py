@@ -11,11 +11,37 @@ class QualityMode(enum.Enum):
     PIXEL = "pixel"
     SMOOTH = "smooth"
 
+class PowerAction(enum.Enum):
+    RUN = "run"
+    THROTTLE = "throttle"
+    FREEZE = "freeze"
+    PAUSE = "pause"
+
 class Config():
     SPEED: float = 1.0
     OPACITY: float = 1.0
     BACKGROUND_MODE = BackgroundMode.WIN10 if sys.platform.startswith("win") else BackgroundMode.BACKGROUND
     DISPLAY = None
     FRAMELIMIT: int = 60
+    ADAPTIVE_FRAMELIMIT: bool = False
+    VSYNC: bool = False
     QUALITY: float = 1.0
+    DYNAMIC_QUALITY: bool = False
+    QUALITY_MIN: float = 0.25
+    QUALITY_MAX: float = 1.0
     QUALITY_MODE = QualityMode.SMOOTH
+    GIF_CACHE_FRAMES: int = 16
+    PROGRAM_CACHE: bool = True
+    POWER_OCCLUDED = PowerAction.PAUSE
+    POWER_IDLE = PowerAction.THROTTLE
+    POWER_IDLE_TIMEOUT: float = 300
+    POWER_BATTERY = PowerAction.THROTTLE
+    POWER_LOW_FRAMELIMIT: int = 10
+    MOUSE_SMOOTHING: float = 0.0
+    INPUT_EVENTS: bool = False
+    HOT_RELOAD: bool = False
+    PROFILE: bool = False
+    PROFILE_OVERLAY: bool = False
+    PROFILE_EXPORT = None
+    PROFILE_FORMAT: str = "jsonl"
+    PROFILE_INTERVAL: float = 5.0
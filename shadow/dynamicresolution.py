@@ -0,0 +1,85 @@
+from .glutils import GpuTimer
+
+import logging
+import math
+
+log = logging.getLogger(__name__)
+
+# Render scales are changed in steps of this size, so framebuffers are not reallocated constantly
+BUCKET = 0.125
+
+# Frames measured before the gpu time is evaluated and frames ignored after a change
+WINDOW = 30
+
+class DynamicResolution():
+    def __init__(self, quality, min_quality, max_quality, framelimit) -> None:
+        self.min_quality = min(min_quality, max_quality)
+        self.max_quality = max(min_quality, max_quality)
+        self.quality = self.quantize(quality)
+        self.budget = 1 / framelimit
+
+        self.timer = GpuTimer()
+        self.times = []
+        self.cooldown = WINDOW
+        self.headroom_windows = 0
+
+    def quantize(self, quality) -> float:
+        quality = math.floor(quality / BUCKET) * BUCKET
+        return min(max(quality, self.min_quality), self.max_quality)
+
+    def begin(self):
+        self.timer.begin()
+
+    def end(self):
+        self.timer.end()
+
+    # Returns the new render scale if it should change, None otherwise. Should be called once per
+    # frame before begin.
+    def update(self):
+        elapsed = self.timer.result()
+        if elapsed is None:
+            return None
+
+        if self.cooldown > 0:
+            self.cooldown -= 1
+            return None
+
+        self.times.append(elapsed)
+        if len(self.times) < WINDOW:
+            return None
+
+        # The median ignores single slow frames, e.g. from compiling or uploading something
+        gputime = sorted(self.times)[len(self.times) // 2]
+        self.times.clear()
+
+        quality = self.quality
+
+        # Over budget, the rendered pixel count scales roughly linearly with the gpu time
+        if gputime > self.budget * 0.9:
+            self.headroom_windows = 0
+            quality = self.quantize(self.quality * math.sqrt(self.budget * 0.75 / gputime))
+            if quality == self.quality:
+                quality = self.quantize(self.quality - BUCKET)
+
+        # Raising is only done one step at a time after a few windows with enough headroom
+        elif gputime < self.budget * 0.5:
+            self.headroom_windows += 1
+            if self.headroom_windows >= 4:
+                self.headroom_windows = 0
+                quality = self.quantize(self.quality + BUCKET)
+        else:
+            self.headroom_windows = 0
+
+        if quality == self.quality:
+            return None
+
+        log.debug("gpu time %.2f ms with a budget of %.2f ms, changing quality from %.3f to %.3f",
+                  gputime * 1000, self.budget * 1000, self.quality, quality)
+
+        self.quality = quality
+        self.cooldown = WINDOW
+
+        return quality
+
+    def cleanup(self):
+        self.timer.cleanup()
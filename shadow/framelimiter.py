@@ -1,35 +1,145 @@
+from collections import deque
+
 import logging
 import time
 
 log = logging.getLogger(__name__)
 
+# Time before a deadline which is spent busy waiting instead of sleeping, as sleep is not precise
+SPIN_NS = 2_000_000
+
+# Framerates the adaptive mode steps down to if frames are consistently late
+ADAPTIVE_STEPS = [ 240, 165, 144, 120, 90, 75, 60, 48, 45, 40, 30, 24, 20, 15, 10 ]
+
+class FrameStats():
+    def __init__(self, size=240) -> None:
+        self.frametimes = deque(maxlen=size)
+
+    def add(self, dt):
+        self.frametimes.append(dt)
+
+    def percentile(self, p) -> float:
+        if not self.frametimes:
+            return 0
+        ordered = sorted(self.frametimes)
+        return ordered[min(int(len(ordered) * p / 100), len(ordered) - 1)]
+
+    def mean(self) -> float:
+        return sum(self.frametimes) / len(self.frametimes) if self.frametimes else 0
+
+    # Mean absolute difference between consecutive frame times
+    def jitter(self) -> float:
+        if len(self.frametimes) < 2:
+            return 0
+        times = list(self.frametimes)
+        return sum(abs(b - a) for a, b in zip(times, times[1:])) / (len(times) - 1)
+
+    def summary(self) -> dict:
+        return {
+            "fps": 1 / self.mean() if self.mean() > 0 else 0,
+            "p50": self.percentile(50),
+            "p95": self.percentile(95),
+            "p99": self.percentile(99),
+            "jitter": self.jitter(),
+        }
+
 class FrameLimiter():
-    def __init__(self, limit) -> None:
+    def __init__(self, limit, vsync=False, adaptive=False) -> None:
         self.limit = limit
-        self.old = time.time()
+        self.max_limit = limit
+        self.cap = None # temporary upper limit, e.g. while running on battery
+        self.vsync = vsync
+        self.adaptive = adaptive
+
+        self.old = time.perf_counter_ns()
+        self.deadline = self.old
+        self.stats = FrameStats()
+        self.work = FrameStats() # time spent outside of tick, i.e. for rendering a frame
+
         self.elapsed = 0
-        self.frames = 0
+        self.late_seconds = 0
+        self.good_seconds = 0
+
+    # Restarts timing, so that the time while not rendering is not counted as a frame
+    def reset(self):
+        self.old = time.perf_counter_ns()
+        self.deadline = self.old
+
+    # Sleeps until shortly before the deadline, then busy waits for the rest
+    @staticmethod
+    def wait_until(deadline):
+        remaining = deadline - time.perf_counter_ns()
+        if remaining > SPIN_NS:
+            time.sleep((remaining - SPIN_NS) / 1e9)
+
+        while time.perf_counter_ns() < deadline:
+            pass
 
     def tick(self) -> float:
-        # calculate deltatime
-        now = time.time()
-        dt = now - self.old
+        limit = min(self.limit, self.cap) if self.cap else self.limit
+        period = int(1e9 / limit)
+        self.work.add((time.perf_counter_ns() - self.old) / 1e9)
 
-        # sleep to reach frame rate limit
-        time.sleep(max(1 / self.limit - dt, 0))
+        # With vsync the buffer swap already blocks until the next refresh, waiting in
+        # addition to that would only cause missed refreshes, unless there is a cap.
+        if not self.vsync or self.cap:
+            self.deadline += period
 
-        # calculate deltatime
-        now = time.time()
-        dt = now - self.old
+            # Frames that took too long move the deadline instead of trying to catch up
+            now = time.perf_counter_ns()
+            if self.deadline < now - period:
+                self.deadline = now
+            else:
+                self.wait_until(self.deadline)
+
+        # calculate real deltatime
+        now = time.perf_counter_ns()
+        dt = (now - self.old) / 1e9
         self.old = now
 
+        self.stats.add(dt)
         self.elapsed += dt
-        self.frames += 1
 
-        # debugging message every second
+        # statistics and adaption every second
         if self.elapsed >= 1:
-            log.debug(self.frames)
             self.elapsed = 0
-            self.frames = 0
+            summary = self.stats.summary()
+
+            log.debug("%.1f fps, p50 %.2f ms, p95 %.2f ms, p99 %.2f ms, jitter %.2f ms, limit %d",
+                      summary["fps"], summary["p50"] * 1000, summary["p95"] * 1000,
+                      summary["p99"] * 1000, summary["jitter"] * 1000, self.limit)
+
+            if self.adaptive and not self.cap:
+                self.adapt(self.work.percentile(95))
+
+        return dt
+
+    # Lowers the frame limit if rendering frames consistently takes longer than the frame period
+    # and raises it again once there is enough headroom, each change needs a few seconds of agreement.
+    def adapt(self, worktime):
+        higher = [ step for step in ADAPTIVE_STEPS if self.limit < step <= self.max_limit ]
+        lower = [ step for step in ADAPTIVE_STEPS if step < self.limit ]
+        next_limit = higher[-1] if higher else self.max_limit
+
+        if worktime > 1 / self.limit:
+            self.late_seconds += 1
+            self.good_seconds = 0
+        elif self.limit < self.max_limit and worktime < 0.75 / next_limit:
+            self.good_seconds += 1
+            self.late_seconds = 0
+        else:
+            self.late_seconds = 0
+            self.good_seconds = 0
+
+        if self.late_seconds >= 3 and lower:
+            log.debug("frames are late, lowering the frame limit to %d", lower[0])
+            self.limit = lower[0]
+        elif self.good_seconds >= 10:
+            log.debug("raising the frame limit to %d", next_limit)
+            self.limit = next_limit
+        else:
+            return
 
-        return max(1 / self.limit, dt)
+        self.late_seconds = 0
+        self.good_seconds = 0
+        self.work.frametimes.clear()
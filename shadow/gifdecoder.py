@@ -0,0 +1,72 @@
+from threading import Thread, Event
+from queue import Queue, Empty, Full
+from PIL import Image
+
+import logging
+
+log = logging.getLogger(__name__)
+
+# Decodes the frames of an animated image in playback order on a background thread. Only a few
+# decoded frames are buffered at a time, which keeps the memory usage independent of the length
+# of the animation. If loop is False, decoding stops after the first pass.
+class GifDecoder():
+    def __init__(self, file, loop=True, prefetch=4) -> None:
+        self.file = file
+        self.loop = loop
+        self.queue = Queue(maxsize=prefetch)
+        self.stopped = Event()
+        self.thread = None
+
+    def start(self):
+        self.thread = Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+
+        # unblock the decoder if it waits for free space in the queue
+        try:
+            while True:
+                self.queue.get_nowait()
+        except Empty:
+            pass
+
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def put(self, item) -> bool:
+        while not self.stopped.is_set():
+            try:
+                self.queue.put(item, timeout=0.1)
+                return True
+            except Full:
+                pass
+        return False
+
+    def run(self):
+        # PIL images are not thread safe, so the decoder works on its own instance
+        with Image.open(self.file) as image:
+            seq = 0
+
+            while not self.stopped.is_set():
+                for index in range(image.n_frames):
+                    image.seek(index)
+
+                    data = image.convert("RGB").tobytes("raw", "RGB", 0, -1)
+                    duration = image.info.get("duration", 100)
+
+                    if not self.put((seq, index, data, duration)):
+                        return
+
+                    seq += 1
+
+                if not self.loop:
+                    return
+
+    # Returns the next decoded frame as (sequence number, frame index, data, duration) or None
+    def get(self):
+        try:
+            return self.queue.get_nowait()
+        except Empty:
+            return None
@@ -1,16 +1,24 @@
 from OpenGL import GL as gl
 from .config import Config, QualityMode
+from .shader import Shader
+from .registry import QUAD_VERTEX_SHADER
+from .PboDownloader import PboDownloader
 
 import logging
+import ctypes
+import numpy as np
 
 log = logging.getLogger(__name__)
 
-def create_frametexture(width, height):
+def create_frametexture(width, height, quality=None):
     texture = gl.glGenTextures(1)
     gl.glBindTexture(gl.GL_TEXTURE_2D, texture)
 
-    width = int(width * Config.QUALITY)
-    height = int(height * Config.QUALITY)
+    if quality is None:
+        quality = Config.QUALITY
+
+    width = max(int(width * quality), 1)
+    height = max(int(height * quality), 1)
 
     gl.glTexImage2D(gl.GL_TEXTURE_2D, 0, gl.GL_RGBA, width, height, 0, gl.GL_RGBA, gl.GL_UNSIGNED_BYTE, None)
 
@@ -25,16 +33,271 @@ def create_frametexture(width, height):
     return texture
 
 
-def create_framebuffer(width, height):
+def create_framebuffer(width, height, quality=None):
     # create a new framebuffer
     fbo = gl.glGenFramebuffers(1)
     gl.glBindFramebuffer(gl.GL_FRAMEBUFFER, fbo)
 
     # create a new texture
-    texture = create_frametexture(width, height)
+    texture = create_frametexture(width, height, quality)
 
     # apply texture to framebuffer
     gl.glFramebufferTexture2D(gl.GL_FRAMEBUFFER, gl.GL_COLOR_ATTACHMENT0, gl.GL_TEXTURE_2D, texture, 0)
     gl.glBindFramebuffer(gl.GL_FRAMEBUFFER, 0)
 
     return texture, fbo
+
+
+# Measures the time the gpu spends on the commands between begin and end. Results are read
+# back with a delay of num - 1 frames, so that reading them never stalls the pipeline.
+# Timestamp queries are used, because unlike GL_TIME_ELAPSED they can overlap with other timers.
+class GpuTimer():
+    def __init__(self, num=3):
+        self.num = num
+        self.queries = gl.glGenQueries(num * 2)
+        self.pending = [ False ] * num
+        self.dx = 0
+
+    def begin(self):
+        gl.glQueryCounter(self.queries[self.dx * 2], gl.GL_TIMESTAMP)
+
+    def end(self):
+        gl.glQueryCounter(self.queries[self.dx * 2 + 1], gl.GL_TIMESTAMP)
+        self.pending[self.dx] = True
+        self.dx = (self.dx + 1) % self.num
+
+    # Returns the oldest measurement in seconds, should be called before begin. Returns
+    # None if there is none or if it is not available yet, in that case it gets discarded.
+    def result(self):
+        if not self.pending[self.dx]:
+            return None
+
+        self.pending[self.dx] = False
+        start, end = self.queries[self.dx * 2], self.queries[self.dx * 2 + 1]
+
+        if not gl.glGetQueryObjectiv(end, gl.GL_QUERY_RESULT_AVAILABLE):
+            return None
+
+        return (int(gl.glGetQueryObjectui64v(end, gl.GL_QUERY_RESULT)) - int(gl.glGetQueryObjectui64v(start, gl.GL_QUERY_RESULT))) / 1e9
+
+    def cleanup(self):
+        gl.glDeleteQueries(len(self.queries), self.queries)
+
+
+# Texture that is updated every frame (e.g. by videos). Storage is allocated once and new frames are
+# written into a ring of pixel unpack buffers, the texture itself is updated from the buffer filled
+# in the previous frame, so the copy to the gpu overlaps with rendering.
+class StreamingTexture():
+    def __init__(self, width, height, fmt=gl.GL_RGB, internal_format=gl.GL_RGB8, channels=3, num_pbos=2, mipmaps=False):
+        self.width = width
+        self.height = height
+        self.fmt = fmt
+        self.mipmaps = mipmaps
+        self.nbytes = width * height * channels
+
+        self.texture = gl.glGenTextures(1)
+        gl.glBindTexture(gl.GL_TEXTURE_2D, self.texture)
+
+        levels = 1
+        if mipmaps:
+            levels = max(width, height).bit_length()
+
+        # immutable storage if available (GL 4.2 or ARB_texture_storage)
+        if bool(gl.glTexStorage2D):
+            gl.glTexStorage2D(gl.GL_TEXTURE_2D, levels, internal_format, width, height)
+        else:
+            gl.glTexImage2D(gl.GL_TEXTURE_2D, 0, internal_format, width, height, 0, fmt, gl.GL_UNSIGNED_BYTE, None)
+            gl.glTexParameteri(gl.GL_TEXTURE_2D, gl.GL_TEXTURE_MAX_LEVEL, 0 if not mipmaps else levels - 1)
+
+        if mipmaps:
+            gl.glTexParameterf(gl.GL_TEXTURE_2D, gl.GL_TEXTURE_MIN_FILTER, gl.GL_LINEAR_MIPMAP_LINEAR)
+        else:
+            gl.glTexParameterf(gl.GL_TEXTURE_2D, gl.GL_TEXTURE_MIN_FILTER, gl.GL_LINEAR)
+
+        self.pbos = gl.glGenBuffers(num_pbos)
+        if num_pbos == 1:
+            self.pbos = [ self.pbos ]
+
+        for pbo in self.pbos:
+            gl.glBindBuffer(gl.GL_PIXEL_UNPACK_BUFFER, pbo)
+            gl.glBufferData(gl.GL_PIXEL_UNPACK_BUFFER, self.nbytes, None, gl.GL_STREAM_DRAW)
+
+        gl.glBindBuffer(gl.GL_PIXEL_UNPACK_BUFFER, 0)
+
+        self.dx = 0
+        self.pending = None
+
+    def bind(self):
+        gl.glBindTexture(gl.GL_TEXTURE_2D, self.texture)
+
+    # Writes a new frame (uint8 array of width * height * channels bytes) into the next pixel buffer,
+    # it is transferred to the texture with the next call of commit
+    def upload(self, data):
+        gl.glBindBuffer(gl.GL_PIXEL_UNPACK_BUFFER, self.pbos[self.dx])
+
+        # Orphan the buffer so that the driver does not wait for a pending transfer from it
+        gl.glBufferData(gl.GL_PIXEL_UNPACK_BUFFER, self.nbytes, None, gl.GL_STREAM_DRAW)
+
+        ptr = gl.glMapBufferRange(gl.GL_PIXEL_UNPACK_BUFFER, 0, self.nbytes, gl.GL_MAP_WRITE_BIT | gl.GL_MAP_INVALIDATE_BUFFER_BIT)
+        if ptr:
+            ctypes.memmove(ptr, np.ascontiguousarray(data).ctypes.data, self.nbytes)
+            gl.glUnmapBuffer(gl.GL_PIXEL_UNPACK_BUFFER)
+            self.pending = self.dx
+            self.dx = (self.dx + 1) % len(self.pbos)
+        else:
+            log.error("Failed to map the pixel unpack buffer")
+
+        gl.glBindBuffer(gl.GL_PIXEL_UNPACK_BUFFER, 0)
+
+    # Updates the texture from the most recently uploaded frame, if there is one
+    def commit(self):
+        if self.pending is None:
+            return
+
+        gl.glBindTexture(gl.GL_TEXTURE_2D, self.texture)
+        gl.glPixelStorei(gl.GL_UNPACK_ALIGNMENT, 1)
+        gl.glBindBuffer(gl.GL_PIXEL_UNPACK_BUFFER, self.pbos[self.pending])
+
+        # When a GL_PIXEL_UNPACK_BUFFER is bound, the last argument is an offset into the buffer
+        gl.glTexSubImage2D(gl.GL_TEXTURE_2D, 0, 0, 0, self.width, self.height, self.fmt, gl.GL_UNSIGNED_BYTE, ctypes.c_void_p(0))
+        gl.glBindBuffer(gl.GL_PIXEL_UNPACK_BUFFER, 0)
+
+        if self.mipmaps:
+            gl.glGenerateMipmap(gl.GL_TEXTURE_2D)
+
+        self.pending = None
+
+    def cleanup(self):
+        gl.glDeleteBuffers(len(self.pbos), self.pbos)
+        gl.glDeleteTextures(1, [self.texture])
+
+
+def union_rect(a, b):
+    if a is None:
+        return b
+    if b is None:
+        return a
+
+    x0, y0 = min(a[0], b[0]), min(a[1], b[1])
+    x1, y1 = max(a[0] + a[2], b[0] + b[2]), max(a[1] + a[3], b[1] + b[3])
+
+    return (x0, y0, x1 - x0, y1 - y0)
+
+
+# Finds the area of the default framebuffer that changed since the last frame. The comparison
+# runs on the gpu and results in one byte per tile, which is read back asynchronously with the
+# same latency as a PboDownloader with the same number of buffers.
+class DamageTracker():
+    def __init__(self, width, height, num, tile=32):
+        self.width = width
+        self.height = height
+        self.tile = tile
+        self.tiles_x = (width + tile - 1) // tile
+        self.tiles_y = (height + tile - 1) // tile
+
+        # copies of the current and the previous frame, swapped every frame
+        self.frames = [ self.create_texture(width, height, gl.GL_RGBA8) for _ in range(2) ]
+
+        # one texel per tile, non zero if any pixel in it changed
+        self.mask_texture = self.create_texture(self.tiles_x, self.tiles_y, gl.GL_R8)
+        self.mask_fbo = gl.glGenFramebuffers(1)
+        gl.glBindFramebuffer(gl.GL_FRAMEBUFFER, self.mask_fbo)
+        gl.glFramebufferTexture2D(gl.GL_FRAMEBUFFER, gl.GL_COLOR_ATTACHMENT0, gl.GL_TEXTURE_2D, self.mask_texture, 0)
+        gl.glBindFramebuffer(gl.GL_FRAMEBUFFER, 0)
+
+        self.mask_pbo = PboDownloader(gl.GL_RED, self.tiles_x, self.tiles_y, num)
+        self.mask = (ctypes.c_ubyte * self.mask_pbo.nbytes)()
+
+        self.shader = Shader({
+            gl.GL_VERTEX_SHADER: QUAD_VERTEX_SHADER,
+            gl.GL_FRAGMENT_SHADER: '''
+                #version 330 core
+                uniform sampler2D current;
+                uniform sampler2D previous;
+                uniform int tile;
+                out vec4 color;
+
+                void main() {
+                    ivec2 size = textureSize(current, 0);
+                    ivec2 origin = ivec2(gl_FragCoord.xy) * tile;
+                    ivec2 end = min(origin + ivec2(tile), size);
+                    float changed = 0.0;
+
+                    for (int y = origin.y; y < end.y && changed == 0.0; y++) {
+                        for (int x = origin.x; x < end.x; x++) {
+                            if (texelFetch(current, ivec2(x, y), 0) != texelFetch(previous, ivec2(x, y), 0)) {
+                                changed = 1.0;
+                                break;
+                            }
+                        }
+                    }
+
+                    color = vec4(changed);
+                }
+                ''',
+        })
+
+    @staticmethod
+    def create_texture(width, height, internal_format):
+        texture = gl.glGenTextures(1)
+        gl.glBindTexture(gl.GL_TEXTURE_2D, texture)
+        gl.glTexImage2D(gl.GL_TEXTURE_2D, 0, internal_format, width, height, 0, gl.GL_RGBA, gl.GL_UNSIGNED_BYTE, None)
+        gl.glTexParameterf(gl.GL_TEXTURE_2D, gl.GL_TEXTURE_MIN_FILTER, gl.GL_NEAREST)
+        gl.glTexParameterf(gl.GL_TEXTURE_2D, gl.GL_TEXTURE_MAG_FILTER, gl.GL_NEAREST)
+        return texture
+
+    # Compares the current content of the default framebuffer with the one of the last call and
+    # returns the changed area (x, y, width, height) of the frame from num - 1 calls ago, None if
+    # nothing changed. Rows are counted from the bottom, like glReadPixels does.
+    def update(self):
+        current, previous = self.frames
+
+        # copy the frame, the default framebuffer can not be sampled from
+        gl.glBindFramebuffer(gl.GL_FRAMEBUFFER, 0)
+        gl.glActiveTexture(gl.GL_TEXTURE0)
+        gl.glBindTexture(gl.GL_TEXTURE_2D, current)
+        gl.glCopyTexSubImage2D(gl.GL_TEXTURE_2D, 0, 0, 0, 0, 0, self.width, self.height)
+
+        gl.glActiveTexture(gl.GL_TEXTURE1)
+        gl.glBindTexture(gl.GL_TEXTURE_2D, previous)
+
+        # compare both frames tile by tile
+        gl.glBindFramebuffer(gl.GL_FRAMEBUFFER, self.mask_fbo)
+        gl.glViewport(0, 0, self.tiles_x, self.tiles_y)
+        gl.glDisable(gl.GL_BLEND)
+
+        self.shader.bind()
+        self.shader.set_uniforms(current=0, previous=1, tile=self.tile)
+        gl.glDrawArrays(gl.GL_TRIANGLES, 0, 6)
+
+        gl.glActiveTexture(gl.GL_TEXTURE0)
+        gl.glPixelStorei(gl.GL_PACK_ALIGNMENT, 1)
+        available = self.mask_pbo.download(ctypes.addressof(self.mask))
+
+        gl.glBindFramebuffer(gl.GL_FRAMEBUFFER, 0)
+        gl.glViewport(0, 0, self.width, self.height)
+
+        self.frames.reverse()
+
+        # no result yet, assume that everything changed
+        if not available:
+            return (0, 0, self.width, self.height)
+
+        mask = np.frombuffer(self.mask, dtype=np.uint8).reshape(self.tiles_y, self.tiles_x)
+        rows = np.flatnonzero(mask.any(axis=1))
+        if rows.size == 0:
+            return None
+        cols = np.flatnonzero(mask.any(axis=0))
+
+        x0 = int(cols[0]) * self.tile
+        y0 = int(rows[0]) * self.tile
+        x1 = min(int(cols[-1] + 1) * self.tile, self.width)
+        y1 = min(int(rows[-1] + 1) * self.tile, self.height)
+
+        return (x0, y0, x1 - x0, y1 - y0)
+
+    def cleanup(self):
+        self.mask_pbo.cleanup()
+        gl.glDeleteFramebuffers(1, [self.mask_fbo])
+        gl.glDeleteTextures(3, self.frames + [self.mask_texture])
+        del self.shader
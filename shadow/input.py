@@ -0,0 +1,114 @@
+from typing import NamedTuple, FrozenSet
+
+import logging
+import math
+import mouse
+import glfw
+
+log = logging.getLogger(__name__)
+
+# Mouse buttons read from the window while the global hook is not used
+GLFW_BUTTONS = {
+    mouse.LEFT: glfw.MOUSE_BUTTON_LEFT,
+    mouse.RIGHT: glfw.MOUSE_BUTTON_RIGHT,
+    mouse.MIDDLE: glfw.MOUSE_BUTTON_MIDDLE,
+}
+
+# Cursor movements below this many pixels end the smoothing, so the cursor comes to rest
+SMOOTHING_EPSILON = 0.01
+
+# State of the input devices at the start of a frame, every component sees the same one.
+# Coordinates are in screen pixels.
+class FrameInput(NamedTuple):
+    x: float
+    y: float
+    buttons: FrozenSet[str]
+    window_x: int
+    window_y: int
+    moved: bool
+
+    # Cursor position relative to the window
+    @property
+    def local(self):
+        return (self.x - self.window_x, self.y - self.window_y)
+
+    # Cursor position inside of an area of the window (e.g. a render target) from 0 to 1,
+    # with y pointing upwards like in OpenGL
+    def cursor(self, area):
+        x, y = self.local
+        return ((x - area.x) / area.width, 1 - (y - area.y) / area.height)
+
+    def is_pressed(self, button=mouse.LEFT) -> bool:
+        return button in self.buttons
+
+# Samples the input devices once per frame. With events, the cursor and buttons are updated by
+# the global mouse hook (which needs root on linux) and frames without input do not query
+# anything. Otherwise the cursor is polled once per frame. The window position is always
+# tracked through glfw callbacks instead of asking the window system every frame.
+class InputSampler():
+    def __init__(self, window, smoothing=0.0, events=False) -> None:
+        self.window = window
+        self.smoothing = smoothing
+
+        self.window_pos = glfw.get_window_pos(window)
+        glfw.set_window_pos_callback(window, self.on_window_pos)
+
+        self.position = mouse.get_position()
+        self.buttons = frozenset()
+        self.hooked = False
+
+        if events:
+            try:
+                mouse.hook(self.on_event)
+                self.hooked = True
+            except Exception as e:
+                log.warning(f"could not hook the mouse, polling it instead: {e}")
+
+        self.input = None
+
+    def on_window_pos(self, _, x, y):
+        self.window_pos = (x, y)
+
+    # Called on the thread of the mouse hook, the state is replaced as a whole
+    def on_event(self, event):
+        if isinstance(event, mouse.MoveEvent):
+            self.position = (event.x, event.y)
+        elif isinstance(event, mouse.ButtonEvent):
+            if event.event_type == mouse.UP:
+                self.buttons = self.buttons - { event.button }
+            else:
+                self.buttons = self.buttons | { event.button }
+
+    def poll(self):
+        self.position = mouse.get_position()
+        self.buttons = frozenset(name for name, button in GLFW_BUTTONS.items() if glfw.get_mouse_button(self.window, button) == glfw.PRESS)
+
+    # Returns the input of this frame, dt is the time since the last call
+    def sample(self, dt) -> FrameInput:
+        if not self.hooked:
+            self.poll()
+
+        x, y = self.position
+        prev = self.input
+
+        # Move towards the cursor exponentially, independent of the framerate
+        if self.smoothing > 0 and prev is not None:
+            alpha = 1 - math.exp(-dt / self.smoothing)
+            sx = prev.x + (x - prev.x) * alpha
+            sy = prev.y + (y - prev.y) * alpha
+
+            if abs(x - sx) > SMOOTHING_EPSILON or abs(y - sy) > SMOOTHING_EPSILON:
+                x, y = sx, sy
+
+        window_x, window_y = self.window_pos
+        moved = prev is None or (x, y) != (prev.x, prev.y) or (window_x, window_y) != (prev.window_x, prev.window_y)
+
+        self.input = FrameInput(x, y, self.buttons, window_x, window_y, moved)
+        return self.input
+
+    def cleanup(self):
+        if self.hooked:
+            mouse.unhook(self.on_event)
+            self.hooked = False
+
+        glfw.set_window_pos_callback(self.window, None)
@@ -4,6 +4,7 @@ from screeninfo import get_monitors
 from .framelimiter import *
 from .config import *
 from .shadow import *
+from .powerpolicy import PowerPolicy, CHECK_INTERVAL
 
 import logging
 import argparse
@@ -19,22 +20,28 @@ def get_default_monitor():
             return monitor
     return monitors[0]
 
+# Returns the list of selected monitors
 def parse_argument_monitor(select):
     if select != None:
         monitors = get_monitors()
 
+        if select.lower() == "all":
+            return monitors
+
         for monitor in monitors:
             if monitor.name != None and monitor.name.lower() == select.lower():
-                return monitor
+                return [ monitor ]
 
         print("Please select one of the following monitors:")
 
         for monitor in monitors:
             print("\t{}{}: {}x{}+{}+{}".format('*' if monitor.is_primary else '', monitor.name, monitor.width, monitor.height, monitor.x, monitor.y))
 
+        print("\tall: every monitor")
+
         sys.exit(0)
 
-    return get_default_monitor()
+    return [ get_default_monitor() ]
 
 def main():
     logging.basicConfig(level=logging.DEBUG)
@@ -45,12 +52,30 @@ def main():
 
     all_args = argparse.ArgumentParser()
     all_args.add_argument("-q", "--quality", help="Changes quality level of the shader, default 1.", default=Config.QUALITY, type=float)
+    all_args.add_argument("-dq", "--dynamicquality", help="Adjust the quality level to the gpu time, to reach the framerate limit", action="store_true")
+    all_args.add_argument("-qmin", "--qualitymin", help="Lowest quality level used with dynamic quality, default 0.25", default=Config.QUALITY_MIN, type=float)
+    all_args.add_argument("-qmax", "--qualitymax", help="Highest quality level used with dynamic quality, default 1", default=Config.QUALITY_MAX, type=float)
     all_args.add_argument("-s", "--speed", help="Changes animation speed, default 1.", default=Config.SPEED, type=float)
     all_args.add_argument("-o", "--opacity", help="Sets background window transparency, default 1.", default=Config.OPACITY, type=float)
     all_args.add_argument("-m", "--mode", help="Changes rendering mode. modes: root, window, background, win10.", default=Config.BACKGROUND_MODE, type=BackgroundMode)
-    all_args.add_argument("-d", "--display", help="Selects a monitor", default=Config.DISPLAY, type=str)
+    all_args.add_argument("-d", "--display", help="Selects a monitor, 'all' renders to every monitor using a single process", default=Config.DISPLAY, type=str)
     all_args.add_argument("-f", "--framelimit", help="Set the maximum framerate limit, default 60", default=Config.FRAMELIMIT, type=int)
+    all_args.add_argument("-af", "--adaptiveframelimit", help="Lower the framelimit while frames take too long to render", action="store_true")
+    all_args.add_argument("-v", "--vsync", help="Synchronize buffer swaps with the monitor refresh rate", action="store_true")
     all_args.add_argument("-qm", "--qualitymode", help="Set it to pixelize or smoothen the image at lower quality. default: smooth; modes: pixel, smooth", default=Config.QUALITY_MODE, type=QualityMode)
+    all_args.add_argument("-po", "--occluded", help="What to do while covered by a fullscreen window, default pause; actions: run, throttle, freeze, pause", default=Config.POWER_OCCLUDED, type=PowerAction)
+    all_args.add_argument("-pi", "--idle", help="What to do while the user is idle, default throttle; actions: run, throttle, freeze, pause", default=Config.POWER_IDLE, type=PowerAction)
+    all_args.add_argument("-pit", "--idletimeout", help="Seconds without input until the user counts as idle, default 300", default=Config.POWER_IDLE_TIMEOUT, type=float)
+    all_args.add_argument("-pb", "--battery", help="What to do while running on battery, default throttle; actions: run, throttle, freeze, pause", default=Config.POWER_BATTERY, type=PowerAction)
+    all_args.add_argument("-pf", "--lowframelimit", help="Framerate limit while throttled, default 10", default=Config.POWER_LOW_FRAMELIMIT, type=int)
+    all_args.add_argument("-ms", "--mousesmoothing", help="Seconds the mouse position takes to follow the cursor, default 0", default=Config.MOUSE_SMOOTHING, type=float)
+    all_args.add_argument("-ie", "--inputevents", help="Update the mouse from a global hook instead of polling it every frame, needs root on linux", action="store_true")
+    all_args.add_argument("-hr", "--hotreload", help="Reload shaders, images and scripts when their files change", action="store_true")
+    all_args.add_argument("-pr", "--profile", help="Measure the cpu and gpu time of every component", action="store_true")
+    all_args.add_argument("-pro", "--profileoverlay", help="Show the measured times in the top left corner", action="store_true")
+    all_args.add_argument("-pre", "--profileexport", help="Periodically write the measured times to a file or to unix:/path/to/socket", default=Config.PROFILE_EXPORT, type=str)
+    all_args.add_argument("-prf", "--profileformat", help="Format of exported times, default jsonl; formats: jsonl, prometheus", default=Config.PROFILE_FORMAT, choices=[ "jsonl", "prometheus" ])
+    all_args.add_argument("-pri", "--profileinterval", help="Seconds between two exports, default 5", default=Config.PROFILE_INTERVAL, type=float)
     all_args.add_argument("-width", "--width", help="Set window width", default=900, type=int)
     all_args.add_argument("-height", "--height", help="Set window height", default=600, type=int)
 
@@ -62,15 +87,33 @@ def main():
         return
 
     Config.QUALITY = args["quality"]
+    Config.DYNAMIC_QUALITY = args["dynamicquality"]
+    Config.QUALITY_MIN = args["qualitymin"]
+    Config.QUALITY_MAX = args["qualitymax"]
     Config.SPEED = args["speed"]
     Config.OPACITY = args["opacity"]
     Config.BACKGROUND_MODE = args["mode"]
     Config.DISPLAY = args["display"]
     Config.FRAMELIMIT = args["framelimit"]
+    Config.ADAPTIVE_FRAMELIMIT = args["adaptiveframelimit"]
+    Config.VSYNC = args["vsync"]
     Config.QUALITY_MODE = args["qualitymode"]
-
-    monitor = parse_argument_monitor(Config.DISPLAY)
-    frameLimiter = FrameLimiter(Config.FRAMELIMIT)
+    Config.POWER_OCCLUDED = args["occluded"]
+    Config.POWER_IDLE = args["idle"]
+    Config.POWER_IDLE_TIMEOUT = args["idletimeout"]
+    Config.POWER_BATTERY = args["battery"]
+    Config.POWER_LOW_FRAMELIMIT = args["lowframelimit"]
+    Config.MOUSE_SMOOTHING = args["mousesmoothing"]
+    Config.INPUT_EVENTS = args["inputevents"]
+    Config.HOT_RELOAD = args["hotreload"]
+    Config.PROFILE = args["profile"]
+    Config.PROFILE_OVERLAY = args["profileoverlay"]
+    Config.PROFILE_EXPORT = args["profileexport"]
+    Config.PROFILE_FORMAT = args["profileformat"]
+    Config.PROFILE_INTERVAL = args["profileinterval"]
+
+    monitors = parse_argument_monitor(Config.DISPLAY)
+    frameLimiter = FrameLimiter(Config.FRAMELIMIT, Config.VSYNC and Config.BACKGROUND_MODE != BackgroundMode.ROOT, Config.ADAPTIVE_FRAMELIMIT)
 
     if not sys.platform.startswith("linux") and (Config.BACKGROUND_MODE == BackgroundMode.BACKGROUND or Config.BACKGROUND_MODE == BackgroundMode.ROOT):
         print("This mode is not supported by your current operating system.")
@@ -83,21 +126,35 @@ def main():
 
     show = None
     if Config.BACKGROUND_MODE == BackgroundMode.BACKGROUND:
-        show = ShadowBackground(monitor, files)
+        show = ShadowBackground(monitors, files)
     elif Config.BACKGROUND_MODE == BackgroundMode.WIN10:
-        show = ShadowWin10(monitor, files)
+        show = ShadowWin10(monitors, files)
     elif Config.BACKGROUND_MODE == BackgroundMode.ROOT:
-        show = ShadowRoot(monitor, files)
+        show = ShadowRoot(monitors, files)
     elif Config.BACKGROUND_MODE == BackgroundMode.WINDOW:
-        show = ShadowWindow(monitor, files, int(args["width"]), int(args["height"]))
+        show = ShadowWindow(monitors, files, int(args["width"]), int(args["height"]))
 
     # this if should never be true
     if show == None:
         all_args.print_help()
         return
 
+    policy = PowerPolicy(show)
+
     try:
         while show.is_running():
+            action = policy.update()
+
+            # Nothing is rendered, the last frame stays visible. While paused, time stands still,
+            # while frozen it continues and the animation jumps ahead once rendering resumes.
+            if action == PowerAction.PAUSE or action == PowerAction.FREEZE:
+                glfw.wait_events_timeout(CHECK_INTERVAL)
+                if action == PowerAction.PAUSE:
+                    frameLimiter.reset()
+                continue
+
+            frameLimiter.cap = Config.POWER_LOW_FRAMELIMIT if action == PowerAction.THROTTLE else None
+
             dt = frameLimiter.tick()
             show.render(dt * Config.SPEED)
             show.swap()
@@ -0,0 +1,254 @@
+from OpenGL import GL as gl
+
+from .shader import Shader
+from .registry import registry, shared_uniforms, QUAD_VERTEX_SHADER
+from .rendergraph import NodeFlags
+
+import logging
+import json
+import os
+
+log = logging.getLogger(__name__)
+
+# Texture formats a buffer can be stored in
+BUFFER_FORMATS = {
+    "rgba8":   (gl.GL_RGBA8, gl.GL_UNSIGNED_BYTE),
+    "rgba16f": (gl.GL_RGBA16F, gl.GL_FLOAT),
+    "rgba32f": (gl.GL_RGBA32F, gl.GL_FLOAT),
+    "rg16f":   (gl.GL_RG16F, gl.GL_FLOAT),
+    "r16f":    (gl.GL_R16F, gl.GL_FLOAT),
+    "r32f":    (gl.GL_R32F, gl.GL_FLOAT),
+}
+
+BUFFER_FILTERS = { "linear": gl.GL_LINEAR, "nearest": gl.GL_NEAREST }
+BUFFER_WRAPS = { "clamp": gl.GL_CLAMP_TO_EDGE, "repeat": gl.GL_REPEAT, "mirror": gl.GL_MIRRORED_REPEAT }
+
+# Settings of a named buffer from the manifest
+class BufferSpec():
+    def __init__(self, name, spec):
+        self.name = name
+        self.scale = float(spec.get("scale", 1.0))
+        self.format = spec.get("format", "rgba8").lower()
+        self.filter = spec.get("filter", "linear").lower()
+        self.wrap = spec.get("wrap", "clamp").lower()
+
+        if self.format not in BUFFER_FORMATS:
+            raise ValueError(f"buffer {name}: unknown format {self.format}, use one of {', '.join(BUFFER_FORMATS)}")
+        if self.filter not in BUFFER_FILTERS:
+            raise ValueError(f"buffer {name}: unknown filter {self.filter}, use one of {', '.join(BUFFER_FILTERS)}")
+        if self.wrap not in BUFFER_WRAPS:
+            raise ValueError(f"buffer {name}: unknown wrap {self.wrap}, use one of {', '.join(BUFFER_WRAPS)}")
+
+# Private ping-pong framebuffers of a named buffer. Passes write into the back one, while reading
+# the front one still gives the result of the last frame.
+class MultipassBuffer():
+    def __init__(self, spec, width, height):
+        self.spec = spec
+        self.width = width
+        self.height = height
+
+        internal_format, pixel_type = BUFFER_FORMATS[spec.format]
+
+        self.textures = gl.glGenTextures(2)
+        self.fbos = gl.glGenFramebuffers(2)
+
+        for texture, fbo in zip(self.textures, self.fbos):
+            gl.glBindTexture(gl.GL_TEXTURE_2D, texture)
+            gl.glTexImage2D(gl.GL_TEXTURE_2D, 0, internal_format, width, height, 0, gl.GL_RGBA, pixel_type, None)
+            gl.glTexParameteri(gl.GL_TEXTURE_2D, gl.GL_TEXTURE_MIN_FILTER, BUFFER_FILTERS[spec.filter])
+            gl.glTexParameteri(gl.GL_TEXTURE_2D, gl.GL_TEXTURE_MAG_FILTER, BUFFER_FILTERS[spec.filter])
+            gl.glTexParameteri(gl.GL_TEXTURE_2D, gl.GL_TEXTURE_WRAP_S, BUFFER_WRAPS[spec.wrap])
+            gl.glTexParameteri(gl.GL_TEXTURE_2D, gl.GL_TEXTURE_WRAP_T, BUFFER_WRAPS[spec.wrap])
+
+            # start with an empty buffer, the content of new textures is undefined
+            gl.glBindFramebuffer(gl.GL_FRAMEBUFFER, fbo)
+            gl.glFramebufferTexture2D(gl.GL_FRAMEBUFFER, gl.GL_COLOR_ATTACHMENT0, gl.GL_TEXTURE_2D, texture, 0)
+            gl.glClear(gl.GL_COLOR_BUFFER_BIT)
+
+        self.front = 0
+
+    @property
+    def texture(self):
+        return self.textures[self.front]
+
+    @property
+    def back_fbo(self):
+        return self.fbos[1 - self.front]
+
+    def swap(self):
+        self.front = 1 - self.front
+
+    def cleanup(self):
+        gl.glDeleteFramebuffers(2, self.fbos)
+        gl.glDeleteTextures(2, self.textures)
+
+class Pass():
+    def __init__(self, base, spec, buffers):
+        self.output = spec.get("output")
+        self.inputs = dict(spec.get("inputs", {})) # sampler uniform -> buffer name
+
+        if self.output is not None and self.output not in buffers:
+            raise ValueError(f"pass {spec.get('shader')}: unknown output buffer {self.output}")
+        for uniform, name in self.inputs.items():
+            if name not in buffers:
+                raise ValueError(f"pass {spec.get('shader')}: unknown input buffer {name} for {uniform}")
+
+        with open(os.path.join(base, spec["shader"]), 'r') as file:
+            source = file.read()
+
+        self.shader = Shader({
+            gl.GL_VERTEX_SHADER: QUAD_VERTEX_SHADER,
+            gl.GL_FRAGMENT_SHADER: source
+        })
+
+# Shadertoy like shader with multiple passes, defined by a json manifest:
+#
+#   {
+#     "buffers": { "A": { "scale": 0.25, "format": "rgba16f", "filter": "nearest", "wrap": "repeat" } },
+#     "passes": [
+#       { "shader": "sim.glsl", "output": "A", "inputs": { "state": "A" } },
+#       { "shader": "image.glsl", "inputs": { "state": "A" } }
+#     ]
+#   }
+#
+# Passes run in order. A pass with an output renders into that buffer, otherwise into the render
+# target like a normal shader. Inputs bind buffers to sampler uniforms, a buffer that was not
+# rendered yet in this frame (e.g. the output of the pass itself) gives the last frame. Every
+# pass gets resolution (of what it renders to), time, frame and mouse uniforms.
+class ComponentMultipass():
+    def __init__(self, path):
+        with open(path, 'r') as file:
+            manifest = json.load(file)
+
+        base = os.path.dirname(path)
+
+        # everything the component is built from, for reloading it on changes
+        self.files = self.manifest_files(path, manifest)
+
+        self.specs = { name: BufferSpec(name, spec) for name, spec in manifest.get("buffers", {}).items() }
+        self.passes = [ Pass(base, spec, self.specs) for spec in manifest.get("passes", []) ]
+
+        if not self.passes:
+            raise ValueError(f"{path}: no passes defined")
+
+        self.buffers = {} # render target -> buffer name -> MultipassBuffer
+        self.frames = {}  # render target -> frames rendered into its buffers
+
+        # Reading a buffer before it is written in the same frame carries state over, so it changes every frame
+        self.flags = NodeFlags.STATIC
+        written = set()
+        for p in self.passes:
+            if p.shader.has_uniform("time") or p.shader.has_uniform("frame") or any(name not in written for name in p.inputs.values()):
+                self.flags |= NodeFlags.TIME
+            if p.shader.has_uniform("mouse"):
+                self.flags |= NodeFlags.MOUSE
+            if p.output is not None:
+                written.add(p.output)
+
+        self.elapsed = 0
+
+    def get_buffers(self, show) -> dict:
+        buffers = self.buffers.setdefault(show, {})
+
+        for name, spec in self.specs.items():
+            width = max(int(show.width * show.quality * spec.scale), 1)
+            height = max(int(show.height * show.quality * spec.scale), 1)
+
+            buffer = buffers.get(name)
+            if buffer is None or (buffer.width, buffer.height) != (width, height):
+                if buffer is not None:
+                    buffer.cleanup()
+
+                log.debug(f'creating multipass buffer {name} with {width}x{height} as {spec.format}')
+                buffers[name] = MultipassBuffer(spec, width, height)
+
+                # new buffers are empty, passes seed them when frame is 1
+                self.frames[show] = 0
+
+        return buffers
+
+    def render(self, dt, show):
+        self.elapsed += dt
+
+        mouse = show.input.cursor(show)
+
+        width = int(show.width * show.quality)
+        height = int(show.height * show.quality)
+
+        target_fbo = gl.glGetIntegerv(gl.GL_DRAW_FRAMEBUFFER_BINDING)
+        buffers = self.get_buffers(show)
+        frame = self.frames[show] = self.frames.get(show, 0) + 1
+
+        for p in self.passes:
+            p.shader.bind()
+
+            for unit, (uniform, name) in enumerate(p.inputs.items()):
+                gl.glActiveTexture(gl.GL_TEXTURE0 + unit)
+                gl.glBindTexture(gl.GL_TEXTURE_2D, buffers[name].texture)
+                registry.bind_sampler(unit, None)
+                p.shader.set_uniforms(**{ uniform: unit })
+            gl.glActiveTexture(gl.GL_TEXTURE0)
+
+            # Buffers store plain values, blending only applies to what ends up in the render target
+            if p.output is not None:
+                output = buffers[p.output]
+                gl.glBindFramebuffer(gl.GL_FRAMEBUFFER, output.back_fbo)
+                gl.glViewport(0, 0, output.width, output.height)
+                gl.glDisable(gl.GL_BLEND)
+                resolution = (output.width, output.height)
+            else:
+                gl.glBindFramebuffer(gl.GL_FRAMEBUFFER, target_fbo)
+                gl.glViewport(0, 0, width, height)
+                gl.glEnable(gl.GL_BLEND)
+                resolution = (width, height)
+
+            p.shader.set_shared_uniforms(shared_uniforms.values)
+            p.shader.set_uniforms(
+                resolution=resolution,
+                mouse=mouse,
+                time=self.elapsed,
+                frame=frame,
+            )
+
+            gl.glDrawArrays(gl.GL_TRIANGLES, 0, 6)
+
+            if p.output is not None:
+                output.swap()
+
+        gl.glBindFramebuffer(gl.GL_FRAMEBUFFER, target_fbo)
+        gl.glViewport(0, 0, width, height)
+        gl.glEnable(gl.GL_BLEND)
+
+    # Deletes the buffers of a render target that is not used anymore
+    def release_target(self, target):
+        self.frames.pop(target, None)
+        for buffer in self.buffers.pop(target, {}).values():
+            buffer.cleanup()
+
+    def cleanup(self):
+        for buffers in self.buffers.values():
+            for buffer in buffers.values():
+                buffer.cleanup()
+        self.buffers.clear()
+        self.frames.clear()
+
+        for p in self.passes:
+            del p.shader
+
+    @staticmethod
+    def manifest_files(path, manifest) -> list:
+        base = os.path.dirname(path)
+        return [ path ] + [ os.path.join(base, spec["shader"]) for spec in manifest.get("passes", []) if "shader" in spec ]
+
+    # Files of a manifest that could not be loaded, so fixing a broken pass reloads it as well
+    @staticmethod
+    def get_files(path) -> list:
+        try:
+            with open(path, 'r') as file:
+                return ComponentMultipass.manifest_files(path, json.load(file))
+        except (OSError, ValueError, TypeError, AttributeError):
+            return [ path ]
+
+    @staticmethod
+    def extensions():
+        return [ "*.multipass.json" ]
@@ -0,0 +1,102 @@
+from OpenGL import GL as gl
+from screeninfo import Monitor
+
+from .glutils import create_framebuffer
+
+import logging
+
+log = logging.getLogger(__name__)
+
+# Returns a monitor covering all of the given monitors
+def get_bounding_monitor(monitors) -> Monitor:
+    if len(monitors) == 1:
+        return monitors[0]
+
+    x0 = min(m.x for m in monitors)
+    y0 = min(m.y for m in monitors)
+    x1 = max(m.x + m.width for m in monitors)
+    y1 = max(m.y + m.height for m in monitors)
+
+    return Monitor(x=x0, y=y0, width=x1 - x0, height=y1 - y0, name="all")
+
+# Offscreen framebuffer the components are rendered into. There is one per distinct resolution,
+# outputs with the same size share it. It is passed to the components as "show".
+class RenderTarget():
+    def __init__(self, shadow, x, y, width, height) -> None:
+        self.shadow = shadow
+        self.x = x
+        self.y = y
+        self.width = width
+        self.height = height
+
+        self.texture, self.fbo = create_framebuffer(width, height, self.quality)
+
+        # Framebuffer of the last frame, only created once a shader samples it
+        self.prevTexture, self.prevFbo = None, None
+
+    @property
+    def quality(self):
+        return self.shadow.quality
+
+    @property
+    def window(self):
+        return self.shadow.window
+
+    # Scripts can change the projection of the whole wallpaper
+    @property
+    def mvp(self):
+        return self.shadow.mvp
+
+    @mvp.setter
+    def mvp(self, mvp):
+        self.shadow.mvp = mvp
+
+    def __getattr__(self, name):
+        # everything else, e.g. attributes set by scripts, comes from the wallpaper itself
+        return getattr(self.shadow, name)
+
+    def resize(self, width, height):
+        self.width = width
+        self.height = height
+        self.resize_framebuffers()
+
+    # Recreates the framebuffers after the size or the render scale changed
+    def resize_framebuffers(self):
+        feedback = self.prevFbo is not None
+        self.cleanup()
+
+        self.texture, self.fbo = create_framebuffer(self.width, self.height, self.quality)
+        if feedback:
+            self.prevTexture, self.prevFbo = create_framebuffer(self.width, self.height, self.quality)
+
+    def render(self, graph, dt):
+        # The framebuffers of this and the last frame swap roles every frame, so the last frame is
+        # available as "prevBuffer" without copying it. Only done if a shader samples it.
+        if graph.feedback:
+            if self.prevFbo is None:
+                self.prevTexture, self.prevFbo = create_framebuffer(self.width, self.height, self.quality)
+
+            self.texture, self.fbo, self.prevTexture, self.prevFbo = self.prevTexture, self.prevFbo, self.texture, self.fbo
+
+        # Render shader background animation to framebuffer with less quality if set
+        gl.glViewport(0, 0, int(self.width * self.quality), int(self.height * self.quality))
+
+        # Update all components that changed
+        graph.render(self, dt)
+
+    def cleanup(self):
+        gl.glDeleteFramebuffers(1, [self.fbo])
+        gl.glDeleteTextures(1, [self.texture])
+
+        if self.prevFbo is not None:
+            gl.glDeleteFramebuffers(1, [self.prevFbo])
+            gl.glDeleteTextures(1, [self.prevTexture])
+
+# Area of the window showing one monitor, (x, y) is its top left corner inside of the window
+class Output():
+    def __init__(self, x, y, width, height, target) -> None:
+        self.x = x
+        self.y = y
+        self.width = width
+        self.height = height
+        self.target = target
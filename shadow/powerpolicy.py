@@ -0,0 +1,104 @@
+from .config import Config, PowerAction
+
+import logging
+import time
+import sys
+import os
+
+if sys.platform.startswith("win"):
+    import ctypes
+    from ctypes import wintypes
+
+    class SYSTEM_POWER_STATUS(ctypes.Structure):
+        _fields_ = [
+            ("ACLineStatus", wintypes.BYTE),
+            ("BatteryFlag", wintypes.BYTE),
+            ("BatteryLifePercent", wintypes.BYTE),
+            ("SystemStatusFlag", wintypes.BYTE),
+            ("BatteryLifeTime", wintypes.DWORD),
+            ("BatteryFullLifeTime", wintypes.DWORD),
+        ]
+
+log = logging.getLogger(__name__)
+
+POWER_SUPPLY_PATH = "/sys/class/power_supply"
+
+# Seconds between two checks, as some of them need a round trip to the display server
+CHECK_INTERVAL = 1.0
+
+# Actions ordered from least to most restrictive
+ACTION_ORDER = [ PowerAction.RUN, PowerAction.THROTTLE, PowerAction.FREEZE, PowerAction.PAUSE ]
+
+def read_power_supply(name, attribute):
+    try:
+        with open(os.path.join(POWER_SUPPLY_PATH, name, attribute), 'r') as file:
+            return file.read().strip()
+    except OSError:
+        return None
+
+def is_on_battery() -> bool:
+    if sys.platform.startswith("win"):
+        status = SYSTEM_POWER_STATUS()
+        if not ctypes.windll.kernel32.GetSystemPowerStatus(ctypes.byref(status)):
+            return False
+        return status.ACLineStatus == 0
+
+    try:
+        supplies = os.listdir(POWER_SUPPLY_PATH)
+    except OSError:
+        return False
+
+    discharging = False
+    for supply in supplies:
+        kind = read_power_supply(supply, "type")
+
+        if kind in ("Mains", "USB") and read_power_supply(supply, "online") == "1":
+            return False
+
+        if kind == "Battery" and read_power_supply(supply, "status") == "Discharging":
+            discharging = True
+
+    return discharging
+
+# Decides whether the wallpaper should be rendered normally, with a lower framerate or not at all,
+# depending on whether it is covered by a fullscreen window, the user is idle or the device
+# runs on battery.
+class PowerPolicy():
+    def __init__(self, show) -> None:
+        self.show = show
+        self.action = PowerAction.RUN
+        self.last_check = 0
+
+    def check(self) -> PowerAction:
+        actions = [ PowerAction.RUN ]
+
+        if Config.POWER_OCCLUDED != PowerAction.RUN and self.show.is_occluded():
+            actions.append(Config.POWER_OCCLUDED)
+
+        if Config.POWER_IDLE != PowerAction.RUN:
+            idle = self.show.get_idle_time()
+            if idle is not None and idle >= Config.POWER_IDLE_TIMEOUT:
+                actions.append(Config.POWER_IDLE)
+
+        if Config.POWER_BATTERY != PowerAction.RUN and is_on_battery():
+            actions.append(Config.POWER_BATTERY)
+
+        return max(actions, key=ACTION_ORDER.index)
+
+    def update(self) -> PowerAction:
+        now = time.monotonic()
+
+        if now - self.last_check >= CHECK_INTERVAL:
+            self.last_check = now
+
+            try:
+                action = self.check()
+            except Exception as e:
+                log.debug(f"power policy check failed: {e}")
+                action = PowerAction.RUN
+
+            if action != self.action:
+                log.debug(f"power policy: {self.action.value} -> {action.value}")
+                self.action = action
+
+        return self.action
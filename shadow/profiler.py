@@ -0,0 +1,325 @@
+from OpenGL import GL as gl
+
+from PIL import Image, ImageDraw, ImageFont
+
+from .glutils import GpuTimer
+from .framelimiter import FrameStats
+from .registry import registry
+from .shader import get_extensions
+
+import logging
+import socket
+import json
+import time
+import os
+
+log = logging.getLogger(__name__)
+
+# Free video memory in KiB, from GL_NVX_gpu_memory_info and GL_ATI_meminfo
+GPU_MEMORY_INFO_CURRENT_AVAILABLE_VIDMEM_NVX = 0x9049
+TEXTURE_FREE_MEMORY_ATI = 0x87FC
+
+# Resident memory of this process in bytes
+def get_process_memory() -> int:
+    try:
+        with open("/proc/self/statm", "r") as file:
+            return int(file.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        pass
+
+    try:
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024 # peak only
+    except ImportError:
+        return 0
+
+# Free video memory in bytes, None if the driver can not tell (e.g. Mesa llvmpipe)
+def get_free_vram():
+    extensions = get_extensions()
+
+    if "GL_NVX_gpu_memory_info" in extensions:
+        return int(gl.glGetIntegerv(GPU_MEMORY_INFO_CURRENT_AVAILABLE_VIDMEM_NVX)) * 1024
+    if "GL_ATI_meminfo" in extensions:
+        return int(gl.glGetIntegerv(TEXTURE_FREE_MEMORY_ATI)[0]) * 1024
+
+    return None
+
+def get_component_name(component) -> str:
+    return getattr(component, "name", type(component).__name__)
+
+# Measures how much memory and video memory creating something takes
+class AllocationMeter():
+    def __init__(self) -> None:
+        gl.glFinish()
+        self.memory = get_process_memory()
+        self.vram = get_free_vram()
+
+    def stop(self):
+        gl.glFinish()
+        memory = get_process_memory() - self.memory
+
+        vram = None
+        free = get_free_vram()
+        if free is not None and self.vram is not None:
+            vram = self.vram - free
+
+        return memory, vram
+
+# Rolling cpu and gpu times of rendering one component
+class NodeProfile():
+    def __init__(self, name, window) -> None:
+        self.name = name
+        self.cpu = FrameStats(window)
+        self.gpu = FrameStats(window)
+        self.timer = GpuTimer()
+        self.start = 0
+
+        # cost of creating the component, if it was measured
+        self.memory = None
+        self.vram = None
+
+    def begin(self):
+        elapsed = self.timer.result()
+        if elapsed is not None:
+            self.gpu.add(elapsed)
+
+        self.timer.begin()
+        self.start = time.perf_counter()
+
+    def end(self):
+        self.cpu.add(time.perf_counter() - self.start)
+        self.timer.end()
+
+    @staticmethod
+    def times(stats) -> dict:
+        return {
+            "mean": stats.mean() * 1000,
+            "p50": stats.percentile(50) * 1000,
+            "p95": stats.percentile(95) * 1000,
+            "max": stats.percentile(100) * 1000,
+        }
+
+    def summary(self) -> dict:
+        return {
+            "name": self.name,
+            "cpu_ms": self.times(self.cpu),
+            "gpu_ms": self.times(self.gpu),
+            "memory": self.memory,
+            "vram": self.vram,
+        }
+
+    def cleanup(self):
+        self.timer.cleanup()
+
+# Profiles every node of a render graph, see RenderGraph.profiler. Gpu times come from timestamp
+# queries read back a few frames later, so measuring never stalls the pipeline.
+class Profiler():
+    def __init__(self, nodes, window=300, allocations=None) -> None:
+        allocations = allocations or {}
+
+        # the whole frame, including drawing the outputs
+        self.frame = NodeProfile("frame", window)
+
+        self.profiles = []
+        for node in nodes:
+            profile = NodeProfile(get_component_name(node), window)
+            profile.memory, profile.vram = allocations.get(id(node), (None, None))
+            self.profiles.append(profile)
+
+    def begin(self, index):
+        self.profiles[index].begin()
+
+    def end(self, index):
+        self.profiles[index].end()
+
+    def summary(self) -> list:
+        return [ p.summary() for p in self.profiles ]
+
+    # Rolling statistics of the last frames, also the content of exported metrics
+    def snapshot(self) -> dict:
+        return {
+            "time": time.time(),
+            "frame": self.frame.summary(),
+            "components": self.summary(),
+        }
+
+    def cleanup(self):
+        self.frame.cleanup()
+        for p in self.profiles:
+            p.cleanup()
+
+def format_prometheus(snapshot) -> str:
+    lines = []
+
+    def metric(name, help, samples):
+        lines.append(f"# HELP {name} {help}")
+        lines.append(f"# TYPE {name} gauge")
+        for labels, value in samples:
+            label = ",".join(f'{k}="{v}"' for k, v in labels.items())
+            lines.append(f"{name}{{{label}}} {value:.9f}" if label else f"{name} {value:.9f}")
+
+    def quantiles(stats, labels):
+        yield dict(labels, quantile="0.5"), stats["p50"] / 1000
+        yield dict(labels, quantile="0.95"), stats["p95"] / 1000
+        yield dict(labels, quantile="1"), stats["max"] / 1000
+
+    frame = snapshot["frame"]
+    components = snapshot["components"]
+    escape = lambda name: name.replace("\\", "\\\\").replace('"', '\\"')
+
+    metric("shadow_frame_cpu_seconds", "Cpu time of rendering a frame", quantiles(frame["cpu_ms"], {}))
+    metric("shadow_frame_gpu_seconds", "Gpu time of rendering a frame", quantiles(frame["gpu_ms"], {}))
+    metric("shadow_component_cpu_seconds", "Cpu time of rendering a component",
+           (s for c in components for s in quantiles(c["cpu_ms"], { "component": escape(c["name"]) })))
+    metric("shadow_component_gpu_seconds", "Gpu time of rendering a component",
+           (s for c in components for s in quantiles(c["gpu_ms"], { "component": escape(c["name"]) })))
+
+    return "\n".join(lines) + "\n"
+
+# Periodically writes the statistics of a profiler as json lines or in the prometheus text format,
+# either to a file or to a unix socket given as "unix:/path/to/socket". Prometheus files are
+# replaced every time, like the textfile collector of the node exporter expects.
+class MetricsExporter():
+    def __init__(self, profiler, destination, format="jsonl", interval=5.0) -> None:
+        self.profiler = profiler
+        self.destination = destination
+        self.format = format
+        self.interval = interval
+        self.last = time.monotonic()
+        self.socket = None
+        self.unsent = b"" # tail of a message the socket did not take at once
+
+    def format_snapshot(self) -> str:
+        snapshot = self.profiler.snapshot()
+
+        if self.format == "prometheus":
+            return format_prometheus(snapshot)
+
+        return json.dumps(snapshot) + "\n"
+
+    def send(self, data):
+        path = self.destination[len("unix:"):]
+
+        if self.socket is None:
+            self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self.socket.connect(path)
+            self.socket.setblocking(False)
+
+        # A reader that does not keep up loses metrics instead of stalling rendering. Only whole
+        # messages are dropped, a partly sent one is finished first so the stream stays parseable.
+        if self.unsent:
+            self.unsent = self.send_some(self.unsent)
+            if self.unsent:
+                log.debug("metrics socket is full, dropping metrics")
+                return
+
+        self.unsent = self.send_some(data.encode())
+
+    # Returns what the socket did not take
+    def send_some(self, data) -> bytes:
+        try:
+            return data[self.socket.send(data):]
+        except BlockingIOError:
+            return data
+
+    def write(self, data):
+        if self.format == "prometheus":
+            with open(self.destination + ".tmp", "w") as file:
+                file.write(data)
+            os.replace(self.destination + ".tmp", self.destination)
+        else:
+            with open(self.destination, "a") as file:
+                file.write(data)
+
+    def update(self):
+        now = time.monotonic()
+        if now - self.last < self.interval:
+            return
+        self.last = now
+
+        data = self.format_snapshot()
+
+        try:
+            if self.destination.startswith("unix:"):
+                self.send(data)
+            else:
+                self.write(data)
+        except OSError as e:
+            log.debug(f"could not export metrics to {self.destination}: {e}")
+            self.close()
+
+    def close(self):
+        if self.socket is not None:
+            self.socket.close()
+            self.socket = None
+        self.unsent = b""
+
+# Draws the statistics of a profiler in the top left corner of the window, the text is only
+# rendered once per interval
+class ProfilerOverlay():
+    def __init__(self, profiler, interval=0.5) -> None:
+        self.profiler = profiler
+        self.interval = interval
+        self.last = 0
+        self.frames = 0
+        self.fps = 0
+
+        self.font = ImageFont.load_default()
+        self.texture = gl.glGenTextures(1)
+        self.width = 0
+        self.height = 0
+
+        self.shader = registry.acquire("program:image")
+        self.sampler = registry.acquire("sampler:nearest")
+
+    def get_text(self) -> str:
+        snapshot = self.profiler.snapshot()
+        frame = snapshot["frame"]
+
+        lines = [ f"{self.fps:.0f} fps, frame cpu {frame['cpu_ms']['mean']:.2f} ms, gpu {frame['gpu_ms']['mean']:.2f} ms" ]
+        for c in snapshot["components"]:
+            lines.append(f"{c['name'][:32]}: cpu {c['cpu_ms']['mean']:.2f} ms, gpu {c['gpu_ms']['mean']:.2f} ms")
+
+        return "\n".join(lines)
+
+    def update_texture(self, flip):
+        text = self.get_text()
+
+        left, top, right, bottom = ImageDraw.Draw(Image.new("RGBA", (1, 1))).multiline_textbbox((0, 0), text, font=self.font)
+        image = Image.new("RGBA", (right - left + 8, bottom - top + 8), (0, 0, 0, 160))
+        ImageDraw.Draw(image).multiline_text((4 - left, 4 - top), text, font=self.font, fill=(255, 255, 255, 255))
+
+        self.width, self.height = image.size
+        data = image.tobytes("raw", "RGBA", 0, -1 if flip else 1)
+
+        gl.glActiveTexture(gl.GL_TEXTURE0)
+        gl.glBindTexture(gl.GL_TEXTURE_2D, self.texture)
+        gl.glPixelStorei(gl.GL_UNPACK_ALIGNMENT, 1)
+        gl.glTexImage2D(gl.GL_TEXTURE_2D, 0, gl.GL_RGBA8, self.width, self.height, 0, gl.GL_RGBA, gl.GL_UNSIGNED_BYTE, data)
+
+    # Draws into the bound framebuffer of the given height, root mode is upside down
+    def render(self, height, root=False):
+        self.frames += 1
+
+        now = time.monotonic()
+        if now - self.last >= self.interval:
+            self.fps = self.frames / (now - self.last) if self.last else 0
+            self.frames = 0
+            self.last = now
+            self.update_texture(not root)
+
+        x, y = 0, 0 if root else height - self.height
+
+        gl.glViewport(x, y, self.width, self.height)
+        gl.glActiveTexture(gl.GL_TEXTURE0)
+        gl.glBindTexture(gl.GL_TEXTURE_2D, self.texture)
+        registry.bind_sampler(0, self.sampler)
+
+        self.shader.bind()
+        self.shader.set_uniforms(position=(x, y), resolution=(self.width, self.height))
+        gl.glDrawArrays(gl.GL_TRIANGLES, 0, 6)
+
+    def cleanup(self):
+        gl.glDeleteTextures(1, [self.texture])
+        registry.release("program:image")
+        registry.release("sampler:nearest")
@@ -0,0 +1,248 @@
+from OpenGL import GL as gl
+
+from .shader import Shader
+from .scripthost import check_uniforms
+
+import logging
+import ctypes
+import numpy as np
+
+log = logging.getLogger(__name__)
+
+# Vertex shader drawing the fullscreen quad, used by every fragment shader component
+QUAD_VERTEX_SHADER = '''
+    #version 330 core
+    layout(location = 0) in vec2 pos;
+
+    void main() {
+      gl_Position.xy = pos;
+      gl_Position.w = 1.0;
+    }
+    '''
+
+IMAGE_FRAGMENT_SHADER = '''
+    #version 330 core
+    uniform sampler2D tex;
+    uniform vec2 resolution;
+    uniform vec2 position;
+    out vec4 color;
+
+    void main() {
+        color = texture(tex, gl_FragCoord.xy / resolution.xy - position / resolution.xy);
+    }
+    '''
+
+# Video frames are stored top to bottom
+VIDEO_FRAGMENT_SHADER = '''
+    #version 330 core
+    uniform sampler2D tex;
+    uniform vec2 resolution;
+    uniform vec2 position;
+    out vec4 color;
+
+    void main() {
+        color = texture(tex, vec2(0, 1) - (gl_FragCoord.xy / resolution.xy - position / resolution.xy));
+    }
+    '''
+
+BLIT_VERTEX_SHADER = '''\
+    #version 330 core
+    layout(location = 0) in vec2 pos;
+    out vec2 coords;
+    uniform mat4 mvp;
+    uniform bool swap;
+
+    void main() {
+      vec4 position = mvp * vec4(pos, 1, 1);
+
+      if (swap) {
+        position *= vec4(1, -1, 1, 1);
+      }
+
+      gl_Position = position;
+      coords = pos * vec2(0.5) + vec2(0.5);
+    }
+    '''
+
+BLIT_FRAGMENT_SHADER = '''\
+    #version 330 core
+    uniform sampler2D tex;
+    uniform vec2 resolution;
+
+    out vec4 color;
+
+    in vec2 coords;
+
+    void main() {
+      color = texture(tex, coords);
+    }
+    '''
+
+# Vertex array with the two triangles covering the screen, which every draw call uses
+class Quad():
+    def __init__(self):
+        log.debug('creating and binding the vertex array (VAO)')
+        self.vertex_array_id = gl.glGenVertexArrays(1)
+        gl.glBindVertexArray(self.vertex_array_id)
+
+        # Create vertex buffer
+        vertex_data = [ 1, -1,   -1, -1,   -1,  1,
+                       -1,  1,    1,  1,    1, -1 ]
+
+        self.attr_id = 0  # No particular reason for 0,
+                     # but must match the layout location in the shader.
+
+        log.debug('creating and binding the vertex buffer (VBO)')
+        self.vertex_buffer = gl.glGenBuffers(1)
+        gl.glBindBuffer(gl.GL_ARRAY_BUFFER, self.vertex_buffer)
+
+        array_type = (gl.GLfloat * len(vertex_data))
+        gl.glBufferData(gl.GL_ARRAY_BUFFER,
+                        len(vertex_data) * ctypes.sizeof(ctypes.c_float),
+                        array_type(*vertex_data),
+                        gl.GL_STATIC_DRAW)
+
+        log.debug('setting the vertex attributes')
+        gl.glVertexAttribPointer(self.attr_id, 2, gl.GL_FLOAT, False, 0, None)
+        gl.glEnableVertexAttribArray(self.attr_id)  # use currently bound VAO
+
+    def bind(self):
+        gl.glBindVertexArray(self.vertex_array_id)
+
+    def cleanup(self):
+        log.debug('cleaning up vertex buffer')
+        gl.glBindVertexArray(self.vertex_array_id)
+        gl.glDisableVertexAttribArray(self.attr_id)
+        gl.glDeleteBuffers(1, [self.vertex_buffer])
+
+        log.debug('cleaning up vertex array')
+        gl.glDeleteVertexArrays(1, [self.vertex_array_id])
+
+# Sampler objects replace the filtering and wrapping set on each texture
+class Sampler():
+    def __init__(self, mipmap, nearest, wrap=gl.GL_REPEAT):
+        self.sampler_id = gl.glGenSamplers(1)
+
+        gl.glSamplerParameteri(self.sampler_id, gl.GL_TEXTURE_WRAP_S, wrap)
+        gl.glSamplerParameteri(self.sampler_id, gl.GL_TEXTURE_WRAP_T, wrap)
+        gl.glSamplerParameteri(self.sampler_id, gl.GL_TEXTURE_MIN_FILTER, gl.GL_LINEAR_MIPMAP_LINEAR if mipmap else gl.GL_LINEAR)
+        gl.glSamplerParameteri(self.sampler_id, gl.GL_TEXTURE_MAG_FILTER, gl.GL_NEAREST if nearest else gl.GL_LINEAR)
+
+    def cleanup(self):
+        gl.glDeleteSamplers(1, [self.sampler_id])
+
+# Built-in resources by name, created on first use
+BUILTINS = {
+    "quad": Quad,
+    "program:image": lambda: Shader({ gl.GL_VERTEX_SHADER: QUAD_VERTEX_SHADER, gl.GL_FRAGMENT_SHADER: IMAGE_FRAGMENT_SHADER }),
+    "program:video": lambda: Shader({ gl.GL_VERTEX_SHADER: QUAD_VERTEX_SHADER, gl.GL_FRAGMENT_SHADER: VIDEO_FRAGMENT_SHADER }),
+    "program:blit": lambda: Shader({ gl.GL_VERTEX_SHADER: BLIT_VERTEX_SHADER, gl.GL_FRAGMENT_SHADER: BLIT_FRAGMENT_SHADER }),
+    "sampler:linear": lambda: Sampler(False, False),
+    "sampler:nearest": lambda: Sampler(False, True),
+    "sampler:mipmap:linear": lambda: Sampler(True, False),
+    "sampler:mipmap:nearest": lambda: Sampler(True, True),
+}
+
+def get_sampler_name(mipmap, nearest) -> str:
+    return "sampler:" + ("mipmap:" if mipmap else "") + ("nearest" if nearest else "linear")
+
+# Process wide, reference counted GL resources that components borrow instead of creating their
+# own copies. It also remembers the bound samplers, so that unchanged state is not set again.
+class Registry():
+    def __init__(self):
+        self.resources = {} # name -> [resource, references]
+        self.samplers = {}  # texture unit -> bound sampler id
+
+    def acquire(self, name):
+        entry = self.resources.get(name)
+
+        if entry is None:
+            log.debug(f'creating shared resource {name}')
+            entry = self.resources[name] = [ BUILTINS[name](), 0 ]
+
+        entry[1] += 1
+        return entry[0]
+
+    def release(self, name):
+        entry = self.resources.get(name)
+        if entry is None:
+            return
+
+        entry[1] -= 1
+
+        if entry[1] <= 0:
+            log.debug(f'deleting shared resource {name}')
+            del self.resources[name]
+
+            if hasattr(entry[0], "cleanup"):
+                entry[0].cleanup()
+
+    # Binds a sampler to a texture unit, 0 restores the parameters of the texture itself
+    def bind_sampler(self, unit, sampler):
+        sampler_id = sampler.sampler_id if sampler else 0
+
+        if self.samplers.get(unit) != sampler_id:
+            gl.glBindSampler(unit, sampler_id)
+            self.samplers[unit] = sampler_id
+
+    # Forgets the tracked state after code outside of shadow, e.g. a script, may have changed it
+    def invalidate(self):
+        self.samplers.clear()
+        Shader.bound = None
+
+# First texture unit of published textures, the units below are used by the components themselves
+SHARED_TEXTURE_UNIT = 8
+
+# Uniforms published from outside the render loop, e.g. by scripts running in their own process.
+# Shader components apply them before their own uniforms. Images (uint8 arrays of height x width
+# x 1-4 channels) are uploaded into textures that stay bound, their uniform is the texture unit.
+# Values no shader could take are dropped, so a script can never break rendering.
+class SharedUniforms():
+    def __init__(self):
+        self.values = {}
+        self.textures = {} # name -> (texture, unit)
+        self.warned = set() # sources that published invalid values
+
+    def publish(self, values, source="script"):
+        values, dropped = check_uniforms(values)
+        if dropped and source not in self.warned:
+            log.warning(f"{source} published values shaders can not use, dropping them: {', '.join(dropped)}")
+            self.warned.add(source)
+
+        for name, value in values.items():
+            if isinstance(value, np.ndarray) and value.dtype == np.uint8 and (value.ndim == 2 or (value.ndim == 3 and value.shape[2] <= 4)):
+                value = self.upload(name, value)
+            self.values[name] = value
+
+    def upload(self, name, image) -> int:
+        if image.ndim == 2:
+            image = image[:, :, None]
+
+        height, width, channels = image.shape
+        formats = { 1: gl.GL_RED, 2: gl.GL_RG, 3: gl.GL_RGB, 4: gl.GL_RGBA }
+
+        texture, unit = self.textures.get(name, (None, None))
+        if texture is None:
+            texture, unit = gl.glGenTextures(1), SHARED_TEXTURE_UNIT + len(self.textures)
+            self.textures[name] = (texture, unit)
+
+        gl.glActiveTexture(gl.GL_TEXTURE0 + unit)
+        gl.glBindTexture(gl.GL_TEXTURE_2D, texture)
+        gl.glTexParameteri(gl.GL_TEXTURE_2D, gl.GL_TEXTURE_MIN_FILTER, gl.GL_LINEAR)
+        gl.glTexParameteri(gl.GL_TEXTURE_2D, gl.GL_TEXTURE_MAG_FILTER, gl.GL_LINEAR)
+        gl.glTexParameteri(gl.GL_TEXTURE_2D, gl.GL_TEXTURE_WRAP_S, gl.GL_CLAMP_TO_EDGE)
+        gl.glTexParameteri(gl.GL_TEXTURE_2D, gl.GL_TEXTURE_WRAP_T, gl.GL_CLAMP_TO_EDGE)
+        gl.glPixelStorei(gl.GL_UNPACK_ALIGNMENT, 1)
+        gl.glTexImage2D(gl.GL_TEXTURE_2D, 0, formats[channels], width, height, 0, formats[channels], gl.GL_UNSIGNED_BYTE, np.ascontiguousarray(image))
+        gl.glActiveTexture(gl.GL_TEXTURE0)
+
+        return unit
+
+    def cleanup(self):
+        for texture, _ in self.textures.values():
+            gl.glDeleteTextures(1, [texture])
+        self.textures.clear()
+        self.values.clear()
+
+registry = Registry()
+shared_uniforms = SharedUniforms()
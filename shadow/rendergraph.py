@@ -0,0 +1,147 @@
+from OpenGL import GL as gl
+
+from .glutils import create_framebuffer
+
+from enum import IntFlag
+import logging
+
+log = logging.getLogger(__name__)
+
+# What the output of a component depends on, besides the size of the render target
+class NodeFlags(IntFlag):
+    STATIC = 0
+    TIME = 1     # changes every frame
+    MOUSE = 2    # changes when the mouse moves
+    FEEDBACK = 4 # samples the previous or current frame
+
+# Components without flags, e.g. from older code, are assumed to change every frame
+def get_node_flags(component) -> NodeFlags:
+    return getattr(component, "flags", NodeFlags.TIME)
+
+# Composites the components in order, but only re-renders what changed. The bottom nodes that
+# are static or only depend on the mouse are rendered into a cached texture per render target,
+# which is copied into the target instead of drawing them again. If no node changed since the
+# last frame, the targets keep their content and the frame is not rendered at all.
+class RenderGraph():
+    def __init__(self, components) -> None:
+        self.nodes = components
+        self.set_flags([ get_node_flags(c) for c in components ])
+
+        # nodes publishing data from outside the render loop, see sync
+        self.syncing = [ c for c in components if hasattr(c, "sync") ]
+
+        self.caches = {} # render target -> (width, height, generation, texture, fbo)
+
+        # measures every node while set, see profiler.Profiler
+        self.profiler = None
+        self.generation = 0
+        self.mouse = None
+        self.dirty = True
+
+    def set_flags(self, flags):
+        self.flags = flags
+
+        self.prefix = 0
+        while self.prefix < len(self.nodes) and not self.flags[self.prefix] & (NodeFlags.TIME | NodeFlags.FEEDBACK):
+            self.prefix += 1
+
+        # whether any node samples the previous or current frame of the render target
+        self.feedback = any(f & NodeFlags.FEEDBACK for f in self.flags)
+
+        # whether any node follows the mouse, which depends on where the render target is shown
+        self.uses_mouse = any(f & NodeFlags.MOUSE for f in self.flags)
+
+        log.debug('render graph with %d nodes, %d of them cached: %s', len(self.nodes), self.prefix,
+                  ", ".join(f"{type(c).__name__}({f!r})" for c, f in zip(self.nodes, self.flags)))
+
+    # Everything has to be rendered again, e.g. after the size or the render scale changed
+    def invalidate(self):
+        self.generation += 1
+        self.dirty = True
+
+    # Returns whether the targets have to be rendered this frame, called once per frame
+    def update(self, mouse) -> bool:
+        # nodes can change their flags, e.g. once their shader finished compiling
+        flags = [ get_node_flags(c) for c in self.nodes ]
+        if flags != self.flags:
+            self.set_flags(flags)
+            self.invalidate()
+
+        # published uniforms can be used by any node, so everything is rendered again
+        if any([ c.sync() for c in self.syncing ]):
+            self.invalidate()
+
+        moved = mouse != self.mouse
+        self.mouse = mouse
+
+        if moved and any(f & NodeFlags.MOUSE for f in self.flags[:self.prefix]):
+            self.generation += 1
+            self.dirty = True
+
+        # the first node after the cached ones changes every frame, so the rest has to be drawn again
+        if self.prefix < len(self.nodes):
+            self.dirty = True
+
+        return self.dirty
+
+    # Called after all targets got rendered
+    def finish(self):
+        self.dirty = False
+
+    def render(self, target, dt):
+        width = max(int(target.width * target.quality), 1)
+        height = max(int(target.height * target.quality), 1)
+
+        if self.prefix > 0:
+            cache = self.caches.get(target)
+
+            if cache is None or cache[:3] != (width, height, self.generation):
+                if cache is not None:
+                    gl.glDeleteFramebuffers(1, [cache[4]])
+                    gl.glDeleteTextures(1, [cache[3]])
+
+                log.debug('rendering %d cached nodes at %dx%d', self.prefix, width, height)
+                texture, fbo = create_framebuffer(target.width, target.height, target.quality)
+
+                gl.glBindFramebuffer(gl.GL_FRAMEBUFFER, fbo)
+                gl.glClear(gl.GL_COLOR_BUFFER_BIT | gl.GL_DEPTH_BUFFER_BIT)
+
+                for i in range(self.prefix):
+                    self.render_node(i, dt, target)
+
+                cache = self.caches[target] = (width, height, self.generation, texture, fbo)
+
+            # the cached nodes were rendered into a cleared framebuffer as well, so copying them
+            # gives exactly the same result as drawing them
+            gl.glBindFramebuffer(gl.GL_READ_FRAMEBUFFER, cache[4])
+            gl.glBindFramebuffer(gl.GL_DRAW_FRAMEBUFFER, target.fbo)
+            gl.glBlitFramebuffer(0, 0, width, height, 0, 0, width, height, gl.GL_COLOR_BUFFER_BIT, gl.GL_NEAREST)
+            gl.glBindFramebuffer(gl.GL_FRAMEBUFFER, target.fbo)
+        else:
+            gl.glBindFramebuffer(gl.GL_FRAMEBUFFER, target.fbo)
+            gl.glClear(gl.GL_COLOR_BUFFER_BIT | gl.GL_DEPTH_BUFFER_BIT)
+
+        for i in range(self.prefix, len(self.nodes)):
+            self.render_node(i, dt, target)
+
+    def render_node(self, index, dt, target):
+        if self.profiler is None:
+            self.nodes[index].render(dt, target)
+            return
+
+        self.profiler.begin(index)
+        self.nodes[index].render(dt, target)
+        self.profiler.end(index)
+
+    # Deletes what was cached for a render target that is not used anymore
+    def release_target(self, target):
+        cache = self.caches.pop(target, None)
+        if cache is not None:
+            gl.glDeleteFramebuffers(1, [cache[4]])
+            gl.glDeleteTextures(1, [cache[3]])
+
+    def cleanup(self):
+        for _, _, _, texture, fbo in self.caches.values():
+            gl.glDeleteFramebuffers(1, [fbo])
+            gl.glDeleteTextures(1, [texture])
+        self.caches.clear()
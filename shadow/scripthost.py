@@ -0,0 +1,241 @@
+from multiprocessing import shared_memory
+import multiprocessing
+import importlib.util
+import logging
+import struct
+import pickle
+import time
+import ast
+import os
+
+log = logging.getLogger(__name__)
+
+# Ticks per second and bytes per published state, unless the script sets TICKRATE or CHANNEL_SIZE
+DEFAULT_TICKRATE = 30.0
+DEFAULT_CHANNEL_SIZE = 1024 * 1024
+
+SEQUENCE = struct.Struct("=Q")
+LENGTH = struct.Struct("=I")
+
+# Seconds a stopped worker gets to exit before it is killed
+STOP_TIMEOUT = 1.0
+
+# Scripts that define a top level tick function run in their own process. The file is only parsed
+# here, importing it would already run whatever the script does at the module level.
+def get_hosted_script_settings(path):
+    with open(path, 'r') as file:
+        tree = ast.parse(file.read(), path)
+
+    settings = None
+    constants = {}
+
+    for node in tree.body:
+        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)) and node.name == "tick":
+            settings = {}
+        elif isinstance(node, ast.Assign) and len(node.targets) == 1 and isinstance(node.targets[0], ast.Name):
+            try:
+                constants[node.targets[0].id] = ast.literal_eval(node.value)
+            except ValueError:
+                pass
+
+    if settings is None:
+        return None
+
+    return {
+        "tickrate": float(constants.get("TICKRATE", DEFAULT_TICKRATE)),
+        "size": int(constants.get("CHANNEL_SIZE", DEFAULT_CHANNEL_SIZE)),
+    }
+
+# Whether a published value can be uploaded to a uniform: a number, a numeric numpy array or a
+# non-empty (nested) sequence of numbers
+def is_numeric(value) -> bool:
+    if isinstance(value, (bool, int, float)):
+        return True
+    if hasattr(value, "dtype") and hasattr(value, "size"): # numpy arrays and scalars
+        return value.dtype.kind in "biuf" and value.size > 0
+    if isinstance(value, (list, tuple)):
+        return len(value) > 0 and all(is_numeric(v) for v in value)
+    return False
+
+# The mvp replaces the projection of the whole wallpaper, so it has to be a 4x4 or flat 16 matrix
+def is_matrix4(value) -> bool:
+    if hasattr(value, "dtype") and hasattr(value, "size"):
+        return value.size == 16 and value.dtype.kind in "biuf"
+    if isinstance(value, (list, tuple)):
+        if len(value) == 4 and all(isinstance(row, (list, tuple)) and len(row) == 4 for row in value):
+            return all(is_numeric(row) for row in value)
+        return len(value) == 16 and all(isinstance(v, (bool, int, float)) for v in value)
+    return False
+
+# Splits published uniforms into the ones shaders can take and the names of the dropped ones
+def check_uniforms(values):
+    if not isinstance(values, dict):
+        return {}, [ f"a {type(values).__name__} instead of a dict" ]
+
+    valid = {}
+    dropped = []
+
+    for name, value in values.items():
+        if isinstance(name, str) and is_numeric(value) and (name != "mvp" or is_matrix4(value)):
+            valid[name] = value
+        else:
+            dropped.append(repr(name))
+
+    return valid, dropped
+
+# Single writer, single reader channel in shared memory that always holds the latest state. The
+# writer fills the buffer that is not published and then increments the sequence number, whose
+# lowest bit selects the published buffer. Every buffer has a version of its own, which is odd
+# while the writer changes it. Neither side ever waits for the other, a reader that got overtaken
+# while copying sees a changed version and keeps its last state.
+class SharedSlot():
+    def __init__(self, size, name=None):
+        self.size = size
+        self.seq = 0
+        self.versions = [ 0, 0 ]
+
+        if name is None:
+            self.memory = shared_memory.SharedMemory(create=True, size=SEQUENCE.size + 2 * (SEQUENCE.size + LENGTH.size + size))
+            self.owner = True
+        else:
+            # workers share the resource tracker of shadow, which removes the memory once
+            self.memory = shared_memory.SharedMemory(name=name)
+            self.owner = False
+
+        self.buffer = self.memory.buf
+
+    @property
+    def name(self) -> str:
+        return self.memory.name
+
+    # Offset of the version of the buffer selected by the sequence number, the length and the data follow
+    def offset(self, seq) -> int:
+        return SEQUENCE.size + (seq & 1) * (SEQUENCE.size + LENGTH.size + self.size)
+
+    def write(self, data) -> bool:
+        if len(data) > self.size:
+            return False
+
+        seq = self.seq + 1
+        offset = self.offset(seq)
+        start = offset + SEQUENCE.size + LENGTH.size
+
+        # a reader still copying the last but one state notices the odd version
+        version = self.versions[seq & 1]
+        SEQUENCE.pack_into(self.buffer, offset, version + 1)
+
+        LENGTH.pack_into(self.buffer, offset + SEQUENCE.size, len(data))
+        self.buffer[start:start + len(data)] = data
+
+        SEQUENCE.pack_into(self.buffer, offset, version + 2)
+        self.versions[seq & 1] = version + 2
+
+        SEQUENCE.pack_into(self.buffer, 0, seq)
+        self.seq = seq
+        return True
+
+    def copy(self, start, length) -> bytes:
+        return bytes(self.buffer[start:start + length])
+
+    # Returns the latest state, or None if nothing new was published since the last read or the
+    # writer got in the way, then the next read tries again
+    def read(self):
+        seq, = SEQUENCE.unpack_from(self.buffer, 0)
+        if seq == self.seq:
+            return None
+
+        offset = self.offset(seq)
+        version, = SEQUENCE.unpack_from(self.buffer, offset)
+        if version & 1:
+            return None
+
+        length = min(LENGTH.unpack_from(self.buffer, offset + SEQUENCE.size)[0], self.size)
+        data = self.copy(offset + SEQUENCE.size + LENGTH.size, length)
+
+        if SEQUENCE.unpack_from(self.buffer, offset)[0] != version:
+            return None
+
+        self.seq = seq
+        return data
+
+    def close(self):
+        self.buffer = None
+        self.memory.close()
+        if self.owner:
+            self.memory.unlink()
+
+# Entry point of the worker process. Every tick returns a dict of uniforms, which is published
+# as a whole. Mvp matrices and numpy arrays are fine, uint8 arrays become textures.
+def run_worker(path, name, size, tickrate):
+    logging.basicConfig(level=logging.WARNING)
+    slot = SharedSlot(size, name)
+    parent = os.getppid()
+
+    spec = importlib.util.spec_from_file_location("", path)
+    script = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(script)
+
+    if hasattr(script, "init"):
+        script.init()
+
+    interval = 1 / tickrate if tickrate > 0 else 0
+    last = time.monotonic()
+
+    # the worker must not outlive shadow, even if it got killed
+    while os.getppid() == parent:
+        now = time.monotonic()
+        values = script.tick(now - last)
+        last = now
+
+        if values:
+            data = pickle.dumps(values, protocol=pickle.HIGHEST_PROTOCOL)
+            if not slot.write(data):
+                log.warning(f"{path}: published {len(data)} bytes, but CHANNEL_SIZE is {size}")
+
+        time.sleep(max(interval - (time.monotonic() - now), 0))
+
+# Runs a script in its own process, so a blocking or crashing script never drops a frame
+class ScriptHost():
+    def __init__(self, path, settings):
+        self.path = path
+        self.slot = SharedSlot(settings["size"])
+        self.crashed = False
+
+        # a fresh interpreter, forking would copy the gl context and the threads of shadow
+        context = multiprocessing.get_context("spawn")
+        self.process = context.Process(
+            target=run_worker,
+            args=(path, self.slot.name, settings["size"], settings["tickrate"]),
+            name=f"shadow script {os.path.basename(path)}",
+            daemon=True,
+        )
+        self.process.start()
+
+        log.debug(f"started script host for {path} with pid {self.process.pid}")
+
+    # Returns the latest published uniforms, or None if there are no new ones. Never blocks.
+    def poll(self):
+        data = self.slot.read()
+
+        if data is None:
+            if not self.crashed and not self.process.is_alive():
+                log.error(f"script {self.path} exited with code {self.process.exitcode}, keeping its last values")
+                self.crashed = True
+            return None
+
+        # a script must never be able to stop the render loop, whatever it published
+        try:
+            return pickle.loads(data)
+        except Exception as e:
+            log.warning(f"script {self.path} published invalid data, dropping it: {e}")
+            return None
+
+    def stop(self):
+        if self.process.is_alive():
+            self.process.terminate()
+            self.process.join(STOP_TIMEOUT)
+        if self.process.is_alive():
+            self.process.kill()
+            self.process.join()
+
+        self.slot.close()
@@ -0,0 +1,183 @@
+import threading
+import asyncio
+import inspect
+import logging
+import time
+
+log = logging.getLogger(__name__)
+
+# Events shadow emits, scripts can emit their own as well:
+#   mouse_down(button), mouse_up(button)  a mouse button changed
+#   mouse_move(x, y)                      the cursor moved, in pixels relative to the window
+#   resize(width, height)                 the window size or the render scale changed
+
+# Runs the decorated function every given seconds, e.g. to poll a web api or /proc
+def every(seconds):
+    def decorator(func):
+        func.shadow_every = seconds
+        return func
+    return decorator
+
+# Runs the decorated function whenever the named event is emitted, with the arguments of the event
+def on_event(name):
+    def decorator(func):
+        func.shadow_events = getattr(func, "shadow_events", ()) + (name,)
+        return func
+    return decorator
+
+# Holds the latest value of a single writer, older values that were never read are dropped.
+# Replacing the tuple is atomic, so neither side ever waits for the other.
+class LatestValue():
+    def __init__(self) -> None:
+        self.value = (0, None)
+        self.seen = 0
+
+    def set(self, value):
+        self.value = (self.value[0] + 1, value)
+
+    # Returns the latest value, or None if it was already taken
+    def take(self):
+        seq, value = self.value
+        if seq == self.seen:
+            return None
+
+        self.seen = seq
+        return value
+
+# Runs a synchronous callback on a daemon thread of its own and waits for it on the loop. Unlike
+# the default executor, whose threads are joined at exit, a callback that blocks forever (e.g.
+# reading audio) can not hang the shutdown of shadow.
+async def run_in_daemon_thread(func, *args):
+    loop = asyncio.get_running_loop()
+    future = loop.create_future()
+
+    def resolve(result, error):
+        if future.done(): # cancelled, e.g. the script got stopped
+            return
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+
+    def run():
+        try:
+            result, error = func(*args), None
+        except Exception as e:
+            result, error = None, e
+        loop.call_soon_threadsafe(resolve, result, error)
+
+    threading.Thread(target=run, name=f"shadow script {func.__name__}", daemon=True).start()
+    return await future
+
+# The asyncio loop all script callbacks run on, in a thread of its own. Synchronous callbacks
+# run on daemon threads, so a blocking one does not hold up the others.
+class ScriptLoop():
+    def __init__(self) -> None:
+        self.loop = asyncio.new_event_loop()
+        self.runtimes = set()
+        self.thread = threading.Thread(target=self.loop.run_forever, name="shadow scripts", daemon=True)
+        self.thread.start()
+
+    def submit(self, coroutine):
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop)
+
+    def emit(self, name, *args):
+        for runtime in list(self.runtimes):
+            runtime.emit(name, *args)
+
+loop = None
+
+def get_loop() -> ScriptLoop:
+    global loop
+    if loop is None:
+        log.debug('starting the script loop')
+        loop = ScriptLoop()
+    return loop
+
+# Sends an event to the handlers of all scripts, can be called from any thread
+def emit(name, *args):
+    if loop is not None:
+        loop.emit(name, *args)
+
+# Schedules the decorated functions of a script module. Each one returns a dict of uniforms (or
+# None), the latest one of every function is kept until the render thread takes it. An async
+# init is awaited on the loop first, events sent before it finished are ignored.
+class ScriptRuntime():
+    def __init__(self, module, name, init=None) -> None:
+        self.name = name
+        self.results = {} # function -> LatestValue
+        self.handlers = {} # event name -> [functions]
+        self.started = False
+
+        self.loop = get_loop()
+
+        callbacks = collect_callbacks(module)
+        for func in callbacks:
+            self.results[func] = LatestValue()
+
+            for event in getattr(func, "shadow_events", ()):
+                self.handlers.setdefault(event, []).append(func)
+
+        self.task = self.loop.submit(self.start(init, [ f for f in callbacks if hasattr(f, "shadow_every") ]))
+        self.loop.runtimes.add(self)
+
+    async def start(self, init, repeating):
+        if init is not None:
+            try:
+                await init()
+            except Exception:
+                log.exception(f"{self.name}: init failed, its callbacks do not run")
+                return
+
+        self.started = True
+        await asyncio.gather(*[ self.repeat(func, func.shadow_every) for func in repeating ])
+
+    async def call(self, func, *args):
+        try:
+            if inspect.iscoroutinefunction(func):
+                result = await func(*args)
+            else:
+                result = await run_in_daemon_thread(func, *args)
+        except Exception:
+            log.exception(f"{self.name}: {func.__name__} failed")
+            return
+
+        if isinstance(result, dict):
+            self.results[func].set(result)
+        elif result is not None:
+            log.warning(f"{self.name}: {func.__name__} returned {type(result).__name__}, only dicts of uniforms are published")
+
+    async def repeat(self, func, seconds):
+        # scheduled by the clock, so the interval does not drift by the time the callback takes
+        deadline = time.monotonic()
+        while True:
+            await self.call(func)
+            deadline = max(deadline + seconds, time.monotonic())
+            await asyncio.sleep(deadline - time.monotonic())
+
+    def emit(self, name, *args):
+        if not self.started:
+            return
+
+        for func in self.handlers.get(name, ()):
+            self.loop.submit(self.call(func, *args))
+
+    # Returns the new uniforms of all callbacks since the last call, or None if there are none.
+    # Never blocks.
+    def poll(self):
+        values = None
+
+        for result in self.results.values():
+            value = result.take()
+            if value is not None:
+                values = { **(values or {}), **value }
+
+        return values
+
+    def stop(self):
+        self.loop.runtimes.discard(self)
+        self.started = False
+        self.task.cancel()
+
+def collect_callbacks(module) -> list:
+    return [ value for value in vars(module).values() if callable(value) and (hasattr(value, "shadow_every") or hasattr(value, "shadow_events")) ]
@@ -1,15 +1,196 @@
 from OpenGL import GL as gl
 
+try:
+    from OpenGL.GL.KHR.parallel_shader_compile import glMaxShaderCompilerThreadsKHR
+    from OpenGL.GL.ARB.parallel_shader_compile import glMaxShaderCompilerThreadsARB
+except ImportError: # older PyOpenGL
+    glMaxShaderCompilerThreadsKHR = glMaxShaderCompilerThreadsARB = None
+
+from .config import Config
+
+from functools import lru_cache
+import hashlib
 import logging
-import sys
+import ctypes
+import struct
+import os
 
 log = logging.getLogger(__name__)
 
-class Shader():
-    def __init__(self, shaders):
+# From GL_KHR_parallel_shader_compile, ARB uses the same value
+COMPLETION_STATUS_KHR = 0x91B1
+
+# Maps the type of an active uniform to a function uploading a python value to it
+UNIFORM_SETTERS = {
+    gl.GL_FLOAT:             lambda loc, v: gl.glUniform1f(loc, v),
+    gl.GL_FLOAT_VEC2:        lambda loc, v: gl.glUniform2f(loc, *v),
+    gl.GL_FLOAT_VEC3:        lambda loc, v: gl.glUniform3f(loc, *v),
+    gl.GL_FLOAT_VEC4:        lambda loc, v: gl.glUniform4f(loc, *v),
+    gl.GL_INT:               lambda loc, v: gl.glUniform1i(loc, v),
+    gl.GL_INT_VEC2:          lambda loc, v: gl.glUniform2i(loc, *v),
+    gl.GL_INT_VEC3:          lambda loc, v: gl.glUniform3i(loc, *v),
+    gl.GL_INT_VEC4:          lambda loc, v: gl.glUniform4i(loc, *v),
+    gl.GL_BOOL:              lambda loc, v: gl.glUniform1i(loc, int(v)),
+    gl.GL_FLOAT_MAT2:        lambda loc, v: gl.glUniformMatrix2fv(loc, 1, False, v),
+    gl.GL_FLOAT_MAT3:        lambda loc, v: gl.glUniformMatrix3fv(loc, 1, False, v),
+    gl.GL_FLOAT_MAT4:        lambda loc, v: gl.glUniformMatrix4fv(loc, 1, False, v),
+    gl.GL_SAMPLER_2D:        lambda loc, v: gl.glUniform1i(loc, v),
+    gl.GL_SAMPLER_2D_ARRAY:  lambda loc, v: gl.glUniform1i(loc, v),
+    gl.GL_SAMPLER_CUBE:      lambda loc, v: gl.glUniform1i(loc, v),
+}
+
+# Uniform arrays (e.g. "float bar[64]") are uploaded as a whole
+UNIFORM_ARRAY_SETTERS = {
+    gl.GL_FLOAT:      lambda loc, n, v: gl.glUniform1fv(loc, n, v),
+    gl.GL_FLOAT_VEC2: lambda loc, n, v: gl.glUniform2fv(loc, n, v),
+    gl.GL_FLOAT_VEC3: lambda loc, n, v: gl.glUniform3fv(loc, n, v),
+    gl.GL_FLOAT_VEC4: lambda loc, n, v: gl.glUniform4fv(loc, n, v),
+    gl.GL_INT:        lambda loc, n, v: gl.glUniform1iv(loc, n, v),
+}
+
+# Returns a hashable, comparable copy of a uniform value
+def freeze_uniform_value(value):
+    if isinstance(value, (int, float, bool)):
+        return value
+    if hasattr(value, "tolist"): # numpy scalars, arrays and matrices
+        value = value.tolist()
+        if not isinstance(value, list):
+            return value
+    return tuple(freeze_uniform_value(v) for v in value)
+
+# Raised if a shader does not compile or a program does not link
+class ShaderError(Exception):
+    pass
+
+class Uniform():
+    def __init__(self, name, location, type, size):
+        self.name = name
+        self.location = location
+        self.type = type
+        self.size = size
+
+        if size > 1 and type in UNIFORM_ARRAY_SETTERS:
+            setter = UNIFORM_ARRAY_SETTERS[type]
+            self.setter = lambda loc, v: setter(loc, min(len(v), size), v)
+        else:
+            self.setter = UNIFORM_SETTERS.get(type)
+
+def get_cache_dir() -> str:
+    cache = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(cache, "shadow", "programs")
+
+# Identifies the sources together with the driver, as binaries are only valid for the driver that created them
+def get_program_key(shaders) -> str:
+    hash = hashlib.sha256()
+    hash.update(gl.glGetString(gl.GL_RENDERER) or b"")
+    hash.update(gl.glGetString(gl.GL_VERSION) or b"")
+
+    for shader_type, shader_src in sorted(shaders.items()):
+        hash.update(str(int(shader_type)).encode())
+        hash.update(shader_src.encode() if isinstance(shader_src, str) else shader_src)
+
+    return hash.hexdigest()
+
+@lru_cache(maxsize=None)
+def get_extensions() -> frozenset:
+    return frozenset(gl.glGetStringi(gl.GL_EXTENSIONS, i).decode() for i in range(gl.glGetIntegerv(gl.GL_NUM_EXTENSIONS)))
+
+# Whether the driver compiles on its own threads and tells when it is done, see Program.ready
+@lru_cache(maxsize=None)
+def supports_parallel_compile() -> bool:
+    extensions = get_extensions()
+    if "GL_KHR_parallel_shader_compile" in extensions:
+        set_max_compiler_threads = glMaxShaderCompilerThreadsKHR
+    elif "GL_ARB_parallel_shader_compile" in extensions:
+        set_max_compiler_threads = glMaxShaderCompilerThreadsARB
+    else:
+        return False
+
+    # let the driver decide how many threads it uses, some only compile in parallel when asked to
+    if set_max_compiler_threads is not None and bool(set_max_compiler_threads):
+        set_max_compiler_threads(0xFFFFFFFF)
+
+    return True
+
+def supports_program_binary() -> bool:
+    return bool(gl.glProgramBinary) and gl.glGetIntegerv(gl.GL_NUM_PROGRAM_BINARY_FORMATS) > 0
+
+# Loads a program from the on disk cache, returns None if there is none or the driver rejected it
+def load_program_binary(key):
+    path = os.path.join(get_cache_dir(), key + ".bin")
+
+    try:
+        with open(path, "rb") as file:
+            binary_format, = struct.unpack("=I", file.read(4))
+            data = file.read()
+    except (OSError, struct.error):
+        return None
+
+    program_id = gl.glCreateProgram()
+    binary = (ctypes.c_ubyte * len(data)).from_buffer_copy(data)
+    gl.glProgramBinary(program_id, binary_format, binary, len(data))
+
+    if not gl.glGetProgramiv(program_id, gl.GL_LINK_STATUS):
+        log.debug(f"cached program binary {key} got rejected, compiling from source")
+        gl.glDeleteProgram(program_id)
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+        return None
+
+    log.debug(f"loaded program binary {key} from cache")
+    return program_id
+
+def store_program_binary(key, program_id):
+    length = gl.glGetProgramiv(program_id, gl.GL_PROGRAM_BINARY_LENGTH)
+    if length <= 0:
+        return
+
+    binary = (ctypes.c_ubyte * length)()
+    written = (gl.GLsizei * 1)()
+    binary_format = (gl.GLenum * 1)()
+    gl.glGetProgramBinary(program_id, length, written, binary_format, binary)
+
+    path = os.path.join(get_cache_dir(), key + ".bin")
+    try:
+        os.makedirs(get_cache_dir(), exist_ok=True)
+
+        # write to a temporary file first, so other processes never read a partial binary
+        with open(path + ".tmp", "wb") as file:
+            file.write(struct.pack("=I", binary_format[0]))
+            file.write(bytes(binary)[:written[0]])
+        os.replace(path + ".tmp", path)
+    except OSError as e:
+        log.debug(f"could not store program binary: {e}")
+
+# A linked program, shared by all Shader instances created with the same sources. Deferred programs
+# are only submitted to the driver, their status is checked once ready reports them complete.
+class Program():
+    def __init__(self, key, shaders, deferred=False):
+        self.key = key
+        self.refs = 0
+        self.shader_ids = [] # (shader id, shader type)
+        self.uniforms = {}
+        self.values = {}
+        self.done = False
+        self.error = None
+
+        self.cache = Config.PROGRAM_CACHE and supports_program_binary()
+
+        self.program_id = load_program_binary(key) if self.cache else None
+        if self.program_id is None:
+            self.submit(shaders)
+            if not deferred:
+                self.finish()
+        else:
+            self.done = True
+            self.introspect()
+
+    # Compiles and links without asking for the result, which would wait for the driver
+    def submit(self, shaders):
         log.debug('creating the shader program')
         self.program_id = gl.glCreateProgram()
-        self.shader_ids = []
 
         for shader_type, shader_src in shaders.items():
             shader_id = gl.glCreateShader(shader_type)
@@ -18,41 +199,197 @@ class Shader():
             log.debug(f'compiling the {shader_type} shader')
             gl.glCompileShader(shader_id)
 
-            # check if compilation was successful
-            result = gl.glGetShaderiv(shader_id, gl.GL_COMPILE_STATUS)
-            info_log_len = gl.glGetShaderiv(shader_id, gl.GL_INFO_LOG_LENGTH)
-            if info_log_len:
-                logmsg = gl.glGetShaderInfoLog(shader_id)
-                log.error(logmsg)
-                sys.exit(10)
-
             gl.glAttachShader(self.program_id, shader_id)
-            self.shader_ids.append(shader_id)
+            self.shader_ids.append((shader_id, shader_type))
+
+        if self.cache:
+            gl.glProgramParameteri(self.program_id, gl.GL_PROGRAM_BINARY_RETRIEVABLE_HINT, gl.GL_TRUE)
 
         log.debug('linking shader program')
         gl.glLinkProgram(self.program_id)
 
+    # Checks the result of submit, blocking until the driver is done. Raises ShaderError if the
+    # shaders did not compile or link, warnings are logged only.
+    def finish(self):
+        if self.done:
+            if self.error is not None:
+                raise ShaderError(self.error)
+            return
+        self.done = True
+
+        for shader_id, shader_type in self.shader_ids:
+            result = gl.glGetShaderiv(shader_id, gl.GL_COMPILE_STATUS)
+            info_log_len = gl.glGetShaderiv(shader_id, gl.GL_INFO_LOG_LENGTH)
+            logmsg = gl.glGetShaderInfoLog(shader_id) if info_log_len else b""
+            logmsg = logmsg.decode(errors="replace") if isinstance(logmsg, bytes) else logmsg
+
+            if not result:
+                self.fail(logmsg.strip() or f"failed to compile the {shader_type} shader")
+            if logmsg.strip():
+                log.warning(logmsg.strip())
+
         # check if linking was successful
         success = gl.glGetProgramiv(self.program_id, gl.GL_LINK_STATUS)
-        info_log_len = gl.glGetProgramiv(self.program_id, gl.GL_INFO_LOG_LENGTH)
         if not success:
             logmsg = gl.glGetProgramInfoLog(self.program_id)
-            log.error(logmsg)
-            sys.exit(0)
+            logmsg = logmsg.decode(errors="replace") if isinstance(logmsg, bytes) else logmsg
+            self.fail(logmsg.strip() or "failed to link the shader program")
 
-        log.debug('installing shader program into rendering state')
-        gl.glUseProgram(self.program_id)
+        if self.cache:
+            store_program_binary(self.key, self.program_id)
 
-    def bind(self):
-        gl.glUseProgram(self.program_id)
+        self.introspect()
 
-    def get_uniform(self, name):
-        return gl.glGetUniformLocation(self.program_id, name)
+    def fail(self, message):
+        self.error = message
+        self.delete()
+        raise ShaderError(message)
 
-    def __del__(self):
+    # Returns whether the program can be used, without blocking if the driver compiles in parallel.
+    # Raises ShaderError like finish once the program turns out to be broken.
+    def ready(self) -> bool:
+        if not self.done:
+            if supports_parallel_compile() and not gl.glGetProgramiv(self.program_id, COMPLETION_STATUS_KHR):
+                return False
+            self.finish()
+
+        if self.error is not None:
+            raise ShaderError(self.error)
+        return True
+
+    def introspect(self):
+        log.debug('introspecting active uniforms')
+        self.uniforms.update(self.introspect_uniforms())
+
+    def introspect_uniforms(self) -> dict:
+        uniforms = {}
+
+        for index in range(gl.glGetProgramiv(self.program_id, gl.GL_ACTIVE_UNIFORMS)):
+            name, size, type = gl.glGetActiveUniform(self.program_id, index)
+            name = name.decode() if isinstance(name, bytes) else name
+
+            # arrays are reported as "name[0]", but are addressed by their plain name
+            if name.endswith("[0]"):
+                name = name[:-3]
+
+            location = gl.glGetUniformLocation(self.program_id, name)
+
+            # uniforms inside of uniform blocks have no location
+            if location < 0:
+                continue
+
+            uniforms[name] = Uniform(name, location, int(type), int(size))
+            log.debug("uniform %s: location %d, type 0x%x, size %d", name, location, type, size)
+
+        return uniforms
+
+    def delete(self):
         log.debug('cleaning up shader program')
-        for shader_id in self.shader_ids:
+        for shader_id, _ in self.shader_ids:
             gl.glDetachShader(self.program_id, shader_id)
             gl.glDeleteShader(shader_id)
         gl.glDeleteProgram(self.program_id)
-        gl.glUseProgram(0)
+        self.shader_ids = []
+        self.program_id = 0
+
+class Shader():
+    # Programs of all living shaders by the key of their sources, identical programs are only created once
+    programs = {}
+
+    # Currently installed program, binding it again is skipped
+    bound = None
+
+    # Names of published uniforms that did not fit, only reported once
+    rejected = set()
+
+    # Raises ShaderError if the sources do not compile. Deferred shaders only submit their sources,
+    # they can not be used before ready returns True and have no uniforms until then.
+    def __init__(self, shaders, deferred=False):
+        self.program = None
+        key = get_program_key(shaders)
+
+        # only kept once it is referenced, so a failing program is never released by __del__
+        program = Shader.programs.get(key)
+        if program is None or program.error is not None:
+            program = Program(key, shaders, deferred)
+            Shader.programs[key] = program
+        else:
+            log.debug('reusing identical shader program')
+
+            # the program may still be compiling for a deferred shader with the same sources
+            if not deferred:
+                program.finish()
+
+        self.program = program
+        self.program.refs += 1
+        self.program_id = self.program.program_id
+        self.uniforms = self.program.uniforms
+
+        # uniform values are part of the program state, so they are shared as well
+        self.values = self.program.values
+
+        if self.program.done:
+            log.debug('installing shader program into rendering state')
+            gl.glUseProgram(self.program_id)
+            Shader.bound = self.program_id
+
+    # Returns whether the program finished compiling, never blocks if the driver supports
+    # parallel compilation. Raises ShaderError if it failed.
+    def ready(self) -> bool:
+        return self.program.ready()
+
+    # Blocks until the program finished compiling, raises ShaderError if it failed
+    def wait(self):
+        self.program.finish()
+
+    def bind(self):
+        if Shader.bound != self.program_id:
+            gl.glUseProgram(self.program_id)
+            Shader.bound = self.program_id
+
+    def has_uniform(self, name) -> bool:
+        return name in self.uniforms
+
+    def get_uniform(self, name):
+        uniform = self.uniforms.get(name)
+        return uniform.location if uniform is not None else -1
+
+    # Uploads the given uniforms to the program, which has to be bound. Values that
+    # did not change since the last upload and uniforms the program does not use
+    # (e.g. because they were optimized away by the compiler) are skipped.
+    def set_uniforms(self, **values):
+        for name, value in values.items():
+            uniform = self.uniforms.get(name)
+            if uniform is None or uniform.setter is None:
+                continue
+
+            frozen = freeze_uniform_value(value)
+            if self.values.get(name) == frozen:
+                continue
+
+            uniform.setter(uniform.location, value)
+            self.values[name] = frozen
+
+    # Uploads uniforms published by scripts. A value that does not fit its uniform, e.g. a number
+    # for an array, is skipped instead of raising in the render loop.
+    def set_shared_uniforms(self, values):
+        for name, value in values.items():
+            try:
+                self.set_uniforms(**{ name: value })
+            except Exception as e:
+                if name not in Shader.rejected:
+                    log.warning(f"published value of {name} does not fit the uniform, skipping it: {e}")
+                    Shader.rejected.add(name)
+
+    def __del__(self):
+        if self.program is None:
+            return
+
+        self.program.refs -= 1
+
+        if self.program.refs <= 0:
+            if Shader.programs.get(self.program.key) is self.program:
+                del Shader.programs[self.program.key]
+            self.program.delete()
+            gl.glUseProgram(0)
+            Shader.bound = None
@@ -1,6 +1,7 @@
 from abc import abstractmethod
 from functools import reduce
 from threading import Thread
+from queue import Queue, Empty, Full
 from OpenGL import GL as gl
 from screeninfo import get_monitors
 
@@ -9,6 +10,14 @@ from .components import *
 from .glutils import *
 from .shader import *
 from .PboDownloader import *
+from .dynamicresolution import DynamicResolution
+from .output import Output, RenderTarget, get_bounding_monitor
+from .registry import registry, shared_uniforms
+from . import scripting
+from .rendergraph import RenderGraph
+from .input import InputSampler
+from .profiler import Profiler, ProfilerOverlay, MetricsExporter
+from .watcher import FileWatcher
 
 import logging
 import sys
@@ -26,7 +35,11 @@ elif sys.platform.startswith("win"):
 log = logging.getLogger(__name__)
 
 class Shadow():
-    def __init__(self, monitor, files, width, height, monitor_offset=(0, 0)):
+    # Renders to one or multiple monitors using the same window and context, monitor is the
+    # area covering all of them
+    def __init__(self, monitors, files, width, height, monitor_offset=(0, 0)):
+        self.monitors = monitors
+        self.monitor = monitor = get_bounding_monitor(monitors)
         self.width = width
         self.height = height
         self.window = self.create_window()
@@ -35,73 +48,25 @@ class Shadow():
         centerY = int((monitor.height - self.height) / 2)
         glfw.set_window_pos(self.window, monitor_offset[0] + monitor.x + centerX, monitor_offset[1] + monitor.y + centerY)
 
-        # Create vertex array
-        log.debug('creating and binding the vertex array (VAO)')
-        self.vertex_array_id = gl.glGenVertexArrays(1)
-        gl.glBindVertexArray(self.vertex_array_id)
+        # Fullscreen quad every draw call uses, shared through the registry and bound once
+        self.quad = registry.acquire("quad")
+        self.quad.bind()
 
-        # Create vertex buffer
-        vertex_data = [ 1, -1,   -1, -1,   -1,  1,
-                       -1,  1,    1,  1,    1, -1 ]
-
-        self.attr_id = 0  # No particular reason for 0,
-                     # but must match the layout location in the shader.
-
-        log.debug('creating and binding the vertex buffer (VBO)')
-        self.vertex_buffer = gl.glGenBuffers(1)
-        gl.glBindBuffer(gl.GL_ARRAY_BUFFER, self.vertex_buffer)
-
-        array_type = (gl.GLfloat * len(vertex_data))
-        gl.glBufferData(gl.GL_ARRAY_BUFFER,
-                        len(vertex_data) * ctypes.sizeof(ctypes.c_float),
-                        array_type(*vertex_data),
-                        gl.GL_STATIC_DRAW)
-
-        log.debug('setting the vertex attributes')
-        gl.glVertexAttribPointer(self.attr_id, 2, gl.GL_FLOAT, False, 0, None)
-        gl.glEnableVertexAttribArray(self.attr_id)  # use currently bound VAO
+        # Render scale of the framebuffers, changes over time with dynamic quality
+        self.quality = Config.QUALITY
+        self.dynres = None
+        if Config.DYNAMIC_QUALITY:
+            self.dynres = DynamicResolution(Config.QUALITY, Config.QUALITY_MIN, Config.QUALITY_MAX, Config.FRAMELIMIT)
+            self.quality = self.dynres.quality
 
         log.debug('creating framebuffers')
-        self.texture, self.fbo = create_framebuffer(self.width, self.height)
-        self.prevTexture = create_frametexture(self.width, self.height)
+        self.outputs = []
+        self.targets = []
+        self.share_targets = True
+        self.create_outputs()
 
         log.debug('loading shaders and locations')
-        self.shader_texture = Shader({
-            gl.GL_VERTEX_SHADER: '''\
-                #version 330 core
-                layout(location = 0) in vec2 pos;
-                out vec2 coords;
-                uniform mat4 mvp;
-                uniform bool swap;
-
-                void main() {
-                  vec4 position = mvp * vec4(pos, 1, 1);
-
-                  if (swap) {
-                    position *= vec4(1, -1, 1, 1);
-                  }
-
-                  gl_Position = position;
-                  coords = pos * vec2(0.5) + vec2(0.5);
-                }
-                ''',
-            gl.GL_FRAGMENT_SHADER: '''\
-                #version 330 core
-                uniform sampler2D tex;
-                uniform vec2 resolution;
-
-                out vec4 color;
-
-                in vec2 coords;
-
-                void main() {
-                  color = texture(tex, coords);
-                }
-                ''',
-        })
-        self.location_resolution = self.shader_texture.get_uniform("resolution")
-        self.location_swap = self.shader_texture.get_uniform("swap")
-        self.location_mvp = self.shader_texture.get_uniform("mvp")
+        self.shader_texture = registry.acquire("program:blit")
 
         # Can be used for cool 3d effects
         self.mvp = [[ 1., 0., 0.,  0., ],
@@ -109,26 +74,65 @@ class Shadow():
                     [ 0., 0., -1,  -1.,],
                     [ 0., 0., 1.7, 1.9,]]
 
+        # Input devices are sampled once per frame, components read the snapshot from "input"
+        self.input_sampler = self.create_input_sampler()
+        self.input = self.input_sampler.sample(0)
+
         # Initialize components at the end, in case if it references the above defined objects
         # that they are already initialized
+        self.files = files
+        self.loaded = [] # component of every file, None if it could not be loaded
         self.components = self.init_components(files)
+        self.graph = RenderGraph(self.components)
+
+        # Rebuilds components in place when their files change
+        self.watcher = None
+        if Config.HOT_RELOAD:
+            self.watcher = FileWatcher(p for c, file in zip(self.loaded, files) for p in self.get_component_files(c, file))
+
+        # Optional per component cpu and gpu times, shown on screen and/or exported periodically
+        self.profiler = None
+        self.overlay = None
+        self.exporter = None
+
+        if Config.PROFILE or Config.PROFILE_OVERLAY or Config.PROFILE_EXPORT:
+            self.profiler = Profiler(self.graph.nodes)
+            self.graph.profiler = self.profiler
+
+            if Config.PROFILE_OVERLAY:
+                self.overlay = ProfilerOverlay(self.profiler)
+
+            if Config.PROFILE_EXPORT:
+                self.exporter = MetricsExporter(self.profiler, Config.PROFILE_EXPORT, Config.PROFILE_FORMAT, Config.PROFILE_INTERVAL)
 
 
     def __del__(self):
         log.debug('cleaning up components')
         for c in self.components:
             c.cleanup()
+        self.graph.cleanup()
+        self.input_sampler.cleanup()
 
-        log.debug('cleaning up vertex buffer')
-        gl.glDisableVertexAttribArray(self.attr_id)
-        gl.glDeleteBuffers(1, [self.vertex_buffer])
+        if self.watcher is not None:
+            self.watcher.close()
 
-        log.debug('cleaning up vertex array')
-        gl.glDeleteVertexArrays(1, [self.vertex_array_id])
+        if self.overlay is not None:
+            self.overlay.cleanup()
+        if self.exporter is not None:
+            self.exporter.close()
+        if self.profiler is not None:
+            self.profiler.cleanup()
+
+        shared_uniforms.cleanup()
+        registry.release("program:blit")
+        registry.release("quad")
 
         log.debug('deleting framebuffer and texture')
-        gl.glDeleteFramebuffers(1, [self.fbo])
-        gl.glDeleteTextures(2, [self.texture, self.prevTexture])
+        for target in self.targets:
+            target.cleanup()
+
+        if self.dynres is not None:
+            self.dynres.cleanup()
 
         log.debug('closing glfw')
         glfw.terminate()
@@ -136,14 +140,90 @@ class Shadow():
     def init_components(self, files) -> list:
         log.debug('initializing components')
 
-        components = []
+        self.loaded = [ self.load_component(file) for file in files ]
+
+        return batch_static_layers([ c for c in self.loaded if c is not None ])
+
+    def create_component(self, file):
+        return create_component_from_file(file)
+
+    # Returns None if the file could not be loaded, e.g. because a shader does not compile. Shaders
+    # compile in the background and are drawn once they are done, unless told to wait for them.
+    def load_component(self, file, wait=False):
+        try:
+            component = self.create_component(file)
+            if wait and hasattr(component, "wait"):
+                component.wait()
+            return component
+        except ShaderError as e:
+            log.error(f"{file} does not compile:\n{e}")
+        except Exception as e:
+            log.error(f"could not load {file}: {e}")
+
+        return None
+
+    # The files of a component that failed to load come from its manifest, fixing any of them
+    # has to reload it
+    @staticmethod
+    def get_component_files(component, file) -> list:
+        if component is None:
+            return get_files_from_file(file)
+        return getattr(component, "files", [ file ])
+
+    # Replaces the components whose files changed. A component is only replaced once its
+    # new version loaded, all other components keep their state and gpu resources.
+    def reload_changed(self):
+        changed = self.watcher.poll()
+        if not changed:
+            return
+
+        replaced = False
+
+        for i, file in enumerate(self.files):
+            old = self.loaded[i]
+            if not changed & { os.path.abspath(p) for p in self.get_component_files(old, file) }:
+                continue
+
+            log.info(f"reloading {file}")
+            # a broken version must not replace the working one, so it has to finish compiling
+            new = self.load_component(file, wait=True)
+            if new is None:
+                log.info(f"keeping the last working version of {file}")
+                # the manifest may reference new files that are still broken
+                self.watcher.watch(self.get_component_files(None, file))
+                continue
+
+            if old is not None:
+                old.cleanup()
+
+            self.loaded[i] = new
+            self.watcher.watch(self.get_component_files(new, file))
+            replaced = True
+
+        if replaced:
+            self.rebuild_graph()
+
+    def rebuild_graph(self):
+        for c in self.components:
+            if isinstance(c, ComponentImageStack):
+                c.cleanup(images=False)
+
+        self.graph.cleanup()
+        self.components = batch_static_layers([ c for c in self.loaded if c is not None ])
+        self.graph = RenderGraph(self.components)
+
+        if self.profiler is not None:
+            self.profiler.cleanup()
+            self.profiler = Profiler(self.graph.nodes)
+            self.graph.profiler = self.profiler
 
-        for file in files:
-            c = create_component_from_file(file)
-            if c is not None:
-                components.append(c)
+            if self.overlay is not None:
+                self.overlay.profiler = self.profiler
+            if self.exporter is not None:
+                self.exporter.profiler = self.profiler
 
-        return components
+    def create_input_sampler(self):
+        return InputSampler(self.window, Config.MOUSE_SMOOTHING, Config.INPUT_EVENTS)
 
     def create_window(self) -> glfw._GLFWwindow:
         log.debug('requiring modern OpenGL without any legacy features')
@@ -165,54 +245,174 @@ class Shadow():
         log.debug('making created window opengl context')
         glfw.make_context_current(window)
 
+        # Root mode never swaps buffers, so vsync would have no effect there
+        glfw.swap_interval(1 if Config.VSYNC and Config.BACKGROUND_MODE != BackgroundMode.ROOT else 0)
+
         return window
 
+    # Creates one output per monitor, monitors with the same resolution share a render target, so
+    # every distinct resolution is only rendered once per frame. The window mode has a single output.
+    #
+    # The cursor is measured from the origin of a render target, so while any component follows
+    # the mouse, every output gets a target of its own.
+    def create_outputs(self):
+        for target in self.targets:
+            self.release_target(target)
+
+        self.outputs = []
+        self.targets = []
+
+        if len(self.monitors) == 1 or Config.BACKGROUND_MODE == BackgroundMode.WINDOW:
+            areas = [ (0, 0, self.width, self.height) ]
+        else:
+            areas = [ (m.x - self.monitor.x, m.y - self.monitor.y, m.width, m.height) for m in self.monitors ]
+
+        for x, y, width, height in areas:
+            target = None
+            if self.share_targets:
+                target = next((t for t in self.targets if t.width == width and t.height == height), None)
+
+            if target is None:
+                target = RenderTarget(self, x, y, width, height)
+                self.targets.append(target)
+
+            self.outputs.append(Output(x, y, width, height, target))
+
+        log.debug('%d outputs using %d render targets', len(self.outputs), len(self.targets))
+
+    # Deletes a render target and everything the components created for it
+    def release_target(self, target):
+        for c in self.components:
+            if hasattr(c, "release_target"):
+                c.release_target(target)
+
+        self.graph.release_target(target)
+        target.cleanup()
+
+    # Recreates the framebuffers after the window size or the render scale changed
+    def resize_framebuffers(self):
+        self.graph.invalidate()
+        scripting.emit("resize", self.width, self.height)
+
+        if len(self.outputs) == 1:
+            self.outputs[0].width = self.width
+            self.outputs[0].height = self.height
+            self.targets[0].resize(self.width, self.height)
+        else:
+            for target in self.targets:
+                target.resize_framebuffers()
+
+    # Tells the event handlers of scripts what changed since the last frame
+    @staticmethod
+    def emit_input_events(previous, current):
+        if current.moved:
+            scripting.emit("mouse_move", *current.local)
+
+        if current.buttons != previous.buttons:
+            for button in current.buttons - previous.buttons:
+                scripting.emit("mouse_down", button)
+            for button in previous.buttons - current.buttons:
+                scripting.emit("mouse_up", button)
+
     def render(self, dt):
-        # Render shader background animation to framebuffer with less quality if set
-        gl.glViewport(0, 0, int(self.width * Config.QUALITY), int(self.height * Config.QUALITY))
-        gl.glBindFramebuffer(gl.GL_FRAMEBUFFER, self.fbo)
-        gl.glClear(gl.GL_COLOR_BUFFER_BIT | gl.GL_DEPTH_BUFFER_BIT)
+        if self.watcher is not None:
+            self.reload_changed()
+
+        # Adjust render scale to the gpu time of the last frames
+        if self.dynres is not None:
+            quality = self.dynres.update()
+            if quality is not None:
+                self.quality = quality
+                self.resize_framebuffers()
+
+            self.dynres.begin()
+
+        if self.profiler is not None:
+            self.profiler.frame.begin()
 
         gl.glEnable(gl.GL_BLEND)
         gl.glBlendFunc(gl.GL_SRC_ALPHA, gl.GL_ONE_MINUS_SRC_ALPHA)
+        self.quad.bind()
 
-        # Update all components
-        for c in self.components:
-            c.render(dt, self)
+        # Render the components once per distinct resolution, time only advances once per frame.
+        # Targets keep their content from the last frame if nothing changed.
+        previous = self.input
+        self.input = self.input_sampler.sample(dt)
+        self.emit_input_events(previous, self.input)
 
-        # Copy rendered framebuffer to prevTexture which is being used for "prevBuffer" sampler
-        gl.glReadBuffer(gl.GL_COLOR_ATTACHMENT0)
-        gl.glActiveTexture(gl.GL_TEXTURE0)
-        gl.glBindTexture(gl.GL_TEXTURE_2D, self.prevTexture)
-        gl.glCopyTexSubImage2D(gl.GL_TEXTURE_2D, 0, 0, 0, 0, 0, int(self.width * Config.QUALITY), int(self.height * Config.QUALITY));
+        dirty = self.graph.update(self.input.local)
+
+        if self.share_targets == self.graph.uses_mouse:
+            self.share_targets = not self.graph.uses_mouse
+            self.create_outputs()
+            self.graph.invalidate()
+            dirty = True
+
+        if dirty:
+            for i, target in enumerate(self.targets):
+                target.render(self.graph, dt if i == 0 else 0)
+            self.graph.finish()
+
+        if self.dynres is not None:
+            self.dynres.end()
 
-        # Draw framebuffer with normal size to window
-        gl.glViewport(0, 0, self.width, self.height)
+        # Draw framebuffers with normal size to their area of the window
         gl.glBindFramebuffer(gl.GL_FRAMEBUFFER, 0)  # unbind FBO to set the default framebuffer
-        gl.glBindTexture(gl.GL_TEXTURE_2D, self.texture) # color attachment texture
+        gl.glActiveTexture(gl.GL_TEXTURE0)
+        registry.bind_sampler(0, None)
+
+        root = Config.BACKGROUND_MODE == BackgroundMode.ROOT
 
         self.shader_texture.bind()
-        gl.glUniform2f(self.location_resolution, self.width, self.height)
-        gl.glUniform1i(self.location_swap, Config.BACKGROUND_MODE == BackgroundMode.ROOT) # root mode needs to be swapped vertically 
-        gl.glUniformMatrix4fv(self.location_mvp, 1, False, self.mvp)
+        self.shader_texture.set_uniforms(swap=root) # root mode needs to be swapped vertically
+
+        # scripts can replace the projection, one that does not fit keeps the last working one
+        self.shader_texture.set_shared_uniforms({ "mvp": shared_uniforms.values.get("mvp", self.mvp) })
+
+        for output in self.outputs:
+            # the viewport origin is the bottom left corner, except in root mode where everything is upside down
+            y = output.y if root else self.height - output.y - output.height
+            gl.glViewport(output.x, y, output.width, output.height)
+            gl.glBindTexture(gl.GL_TEXTURE_2D, output.target.texture) # color attachment texture
+            self.shader_texture.set_uniforms(resolution=(output.width, output.height))
 
-        # Draw rectangle with our texture
-        gl.glDrawArrays(gl.GL_TRIANGLES, 0, 6)
+            # Draw rectangle with our texture
+            gl.glDrawArrays(gl.GL_TRIANGLES, 0, 6)
+
+        if self.profiler is not None:
+            self.profiler.frame.end()
+
+            if self.overlay is not None:
+                self.overlay.render(self.height, root)
+            if self.exporter is not None:
+                self.exporter.update()
 
         # Update
         glfw.poll_events()
 
+    # Rolling cpu and gpu times of the last frames per component, None if profiling is disabled
+    def get_profile(self):
+        return self.profiler.snapshot() if self.profiler is not None else None
+
     def is_running(self):
         return glfw.get_key(self.window, glfw.KEY_ESCAPE) != glfw.PRESS and not glfw.window_should_close(self.window)
 
+    # Returns True if the wallpaper is completely hidden, e.g. by a fullscreen window
+    def is_occluded(self) -> bool:
+        return False
+
+    # Returns the seconds since the last user input, None if unknown
+    def get_idle_time(self):
+        return None
+
     # Apply changes to canvas
     @abstractmethod
     def swap(self):
         log.error('No implementation!')
 
 class ShadowWindow(Shadow):
-    def __init__(self, monitor, files, width, height):
-        super().__init__(monitor, files, width, height)
+    def __init__(self, monitors, files, width, height):
+        super().__init__(monitors, files, width, height)
         glfw.show_window(self.window)
 
     def swap(self):
@@ -227,18 +427,23 @@ class ShadowWindow(Shadow):
             self.height = max(nheight, 10)
 
             # Delete existing framebuffer and create a new one with new scale
-            gl.glDeleteFramebuffers(1, [self.fbo])
-            gl.glDeleteTextures(2, [self.texture, self.prevTexture])
-            
-            self.texture, self.fbo = create_framebuffer(self.width, self.height)
-            self.prevTexture = create_frametexture(self.width, self.height)
-
-class ShadowBackground(Shadow):
-    def __init__(self, monitor, files):
-        super().__init__(monitor, files, monitor.width, monitor.height)
-
-        conn = xcffib.Connection(display=os.environ.get("DISPLAY"))
-        set_window_to_background(conn, glfw.get_x11_window(self.window))
+            self.resize_framebuffers()
+
+class ShadowX11(Shadow):
+    def is_occluded(self) -> bool:
+        return all(is_covered_by_fullscreen(self.conn, self.screen, m.x, m.y, m.width, m.height) for m in self.monitors)
+
+    def get_idle_time(self):
+        return get_idle_time(self.conn, self.screen)
+
+class ShadowBackground(ShadowX11):
+    def __init__(self, monitors, files):
+        monitor = get_bounding_monitor(monitors)
+        super().__init__(monitors, files, monitor.width, monitor.height)
+
+        self.conn = xcffib.Connection(display=os.environ.get("DISPLAY"))
+        self.screen = self.conn.get_setup().roots[0]
+        set_window_to_background(self.conn, glfw.get_x11_window(self.window))
         glfw.set_window_opacity(self.window, Config.OPACITY)
 
         glfw.window_hint(glfw.DECORATED, False)
@@ -248,13 +453,34 @@ class ShadowBackground(Shadow):
     def swap(self):
         glfw.swap_buffers(self.window)
 
-class ShadowRoot(Shadow):
-    def __init__(self, monitor, files):
-        super().__init__(monitor, files, monitor.width, monitor.height)
+class ShadowRoot(ShadowX11):
+    def __init__(self, monitors, files):
+        monitor = get_bounding_monitor(monitors)
+        super().__init__(monitors, files, monitor.width, monitor.height)
 
         self.conn = xcffib.Connection(display=os.environ.get("DISPLAY"))
         self.screen = self.conn.get_setup().roots[0]
-        self.pbo = PboDownloader(gl.GL_BGRA, self.width, self.height, 1)
+        self.pbo = PboDownloader(gl.GL_BGRA, self.width, self.height, 3)
+
+        # Frames are handed to a long-lived uploader thread through a queue only holding the
+        # newest frame. Each frame is copied into one of a few slots owned by this class,
+        # which live in memory shared with the X server if MIT-SHM is available.
+        num_slots = 3
+        try:
+            self.shm = ShmSegment(self.conn, self.pbo.nbytes * num_slots)
+            self.slots = [ (ctypes.c_char * self.pbo.nbytes).from_address(self.shm.address + i * self.pbo.nbytes) for i in range(num_slots) ]
+            log.debug('using MIT-SHM for transferring frames')
+        except Exception as e:
+            log.debug(f'MIT-SHM not available, falling back to PutImage: {e}')
+            self.shm = None
+            self.slots = [ (ctypes.c_char * self.pbo.nbytes)() for _ in range(num_slots) ]
+
+        self.free_slots = Queue()
+        for i in range(len(self.slots)):
+            self.free_slots.put(i)
+
+        self.uploads = Queue(maxsize=1)
+        self.uploader = Thread(target=self.upload_loop, daemon=True)
 
         # Pixmap used to set root background image
         self.pixmap = self.conn.generate_id()
@@ -275,21 +501,90 @@ class ShadowRoot(Shadow):
             None,
         )
 
-    def swap(self):
-        def pbo_to_screen():
-            PutImage(self.conn, xcffib.xproto.ImageFormat.ZPixmap, self.pixmap, self.gc, self.width, self.height, 0, 0, 0, self.screen.root_depth, self.pbo.pixels)
-            set_wallpaper_pixmap(self.conn, self.screen, self.pixmap)
+        # The wallpaper properties are only set once, afterwards only the pixmap gets updated
+        set_wallpaper_pixmap(self.conn, self.screen, self.pixmap)
+
+        # Only the area that changed since the last upload is transferred, at first everything
+        self.damage = DamageTracker(self.width, self.height, self.pbo.num_pbos)
+        self.pending_damage = (0, 0, self.width, self.height)
+
+        self.uploader.start()
+
+    def upload_loop(self):
+        while True:
+            item = self.uploads.get()
+            if item is None:
+                return
+
+            slot, (x, y, w, h) = item
+
+            if self.shm is not None:
+                self.shm.put(self.pixmap, self.gc, self.width, self.height, self.screen.root_depth, slot * self.pbo.nbytes, x, y, w, h)
+            else:
+                # only whole rows can be sent without copying
+                stride = self.pbo.nbytes // self.height
+                rows = (ctypes.c_char * (h * stride)).from_buffer(self.slots[slot], y * stride)
+                PutImage(self.conn, xcffib.xproto.ImageFormat.ZPixmap, self.pixmap, self.gc, self.width, h, 0, y, 0, self.screen.root_depth, rows)
+
+            clear_wallpaper_area(self.conn, self.screen, x, y, w, h)
+
+            self.free_slots.put(slot)
+
+    # Queues a frame for the uploader, a frame that is still waiting gets dropped
+    # and its changed area is added to the one of the new frame
+    def queue_upload(self, item):
+        while True:
+            try:
+                self.uploads.put_nowait(item)
+                return
+            except Full:
+                pass
+
+            try:
+                stale = self.uploads.get_nowait()
+                if stale is not None:
+                    self.free_slots.put(stale[0])
+                    if item is not None:
+                        item = (item[0], union_rect(item[1], stale[1]))
+            except Empty:
+                pass
 
-        self.pbo.download()
-        Thread(target=pbo_to_screen, args=()).start()
+    def swap(self):
+        # Rows of the readback are in the same order as on the screen, as root mode renders upside down
+        damage = union_rect(self.pending_damage, self.damage.update())
+
+        # Nothing is copied if nothing changed or the uploader still holds all slots
+        slot = None
+        if damage is not None:
+            try:
+                slot = self.free_slots.get_nowait()
+            except Empty:
+                pass
+
+        dest = ctypes.addressof(self.slots[slot]) if slot is not None else None
+
+        if self.pbo.download(dest):
+            self.queue_upload((slot, damage))
+            self.pending_damage = None
+        else:
+            if slot is not None:
+                self.free_slots.put(slot)
+            self.pending_damage = damage
 
     def __del__(self):
+        self.queue_upload(None)
+        self.uploader.join()
+
+        self.pbo.cleanup()
+        self.damage.cleanup()
+        if self.shm is not None:
+            self.shm.cleanup()
         self.conn.core.FreePixmap(self.pixmap)
         self.conn.core.FreeGC(self.gc)
         super().__del__()
 
 class ShadowWin10(Shadow):
-    def __init__(self, monitor, files):
+    def __init__(self, monitors, files):
         # We have to set these hints before the window is created and positioned
         glfw.window_hint(glfw.DECORATED, False)
         glfw.window_hint(glfw.FOCUSED, False)
@@ -299,7 +594,8 @@ class ShadowWin10(Shadow):
         # of any monitor, then using *the double of* that as an offset for each window,
         # seems to solve the discrepancies.
         monitor_offset = reduce(lambda acc, m: (max(acc[0], -m.x), max(acc[1], -m.y)), get_monitors(), (0, 0))
-        super().__init__(monitor, files, monitor.width, monitor.height, monitor_offset)
+        monitor = get_bounding_monitor(monitors)
+        super().__init__(monitors, files, monitor.width, monitor.height, monitor_offset)
 
         progman_hwnd = user32.FindWindowW("Progman", None)
         res = ctypes.c_ulong()
@@ -339,11 +635,34 @@ class ShadowWin10(Shadow):
             self.height = max(nheight, 10)
 
             # Delete existing framebuffer and create a new one with new scale
-            gl.glDeleteFramebuffers(1, [self.fbo])
-            gl.glDeleteTextures(2, [self.texture, self.prevTexture])
-            
-            self.texture, self.fbo = create_framebuffer(self.width, self.height)
-            self.prevTexture = create_frametexture(self.width, self.height)
+            self.resize_framebuffers()
+
+    def is_occluded(self) -> bool:
+        hwnd = user32.GetForegroundWindow()
+        if not hwnd or hwnd == self.workerw:
+            return False
+
+        # The desktop itself is the foreground window when clicking on it
+        name = ctypes.create_unicode_buffer(256)
+        user32.GetClassNameW(hwnd, name, 256)
+        if name.value in ("Progman", "WorkerW"):
+            return False
+
+        rect = wintypes.RECT()
+        user32.GetWindowRect(hwnd, ctypes.byref(rect))
+
+        return all(rect.left <= m.x and rect.top <= m.y and rect.right >= m.x + m.width and rect.bottom >= m.y + m.height for m in self.monitors)
+
+    def get_idle_time(self):
+        class LASTINPUTINFO(ctypes.Structure):
+            _fields_ = [("cbSize", wintypes.UINT), ("dwTime", wintypes.DWORD)]
+
+        info = LASTINPUTINFO()
+        info.cbSize = ctypes.sizeof(LASTINPUTINFO)
+        if not user32.GetLastInputInfo(ctypes.byref(info)):
+            return None
+
+        return ((ctypes.windll.kernel32.GetTickCount() - info.dwTime) & 0xFFFFFFFF) / 1000
 
     def __del__(self):
         log.debug("Remove parent")
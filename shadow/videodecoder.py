@@ -0,0 +1,160 @@
+from threading import Thread, Condition
+from collections import deque
+
+import logging
+import time
+import numpy as np
+
+log = logging.getLogger(__name__)
+
+# Frames the decoder may fall behind before it seeks instead of decoding every frame in between,
+# e.g. after the wallpaper was frozen for a while
+SEEK_FRAMES = 60
+
+# Decodes the frames of an imageio reader sequentially on a background thread into a bounded
+# ring of preallocated buffers. The render thread only ever picks up the newest frame that is
+# due, older frames are dropped instead of blocking the render loop.
+class VideoDecoder():
+    def __init__(self, reader, length, width, height, num_buffers=4, channels=3) -> None:
+        self.reader = reader
+        self.length = length
+
+        self.buffers = [ np.empty((height, width, channels), dtype=np.uint8) for _ in range(num_buffers) ]
+        self.free = deque(range(num_buffers))
+        self.ready = deque() # (sequence number, buffer index) in decoding order
+        self.current = None  # buffer index currently held by the render thread
+
+        self.cond = Condition()
+        self.running = False
+        self.thread = None
+
+        # sequence number of the next decoded frame, it keeps growing past the end of the video
+        # and is used together with the frame number requested by the render thread
+        self.seq = 0
+        self.wanted = 0
+        self.index = 0 # position in the video of the next decoded frame
+
+        # statistics, reported through logging
+        self.decoded = 0
+        self.dropped = 0
+        self.late = 0
+        self.report_time = time.perf_counter()
+        self.report_frames = 0
+
+    def start(self):
+        self.running = True
+        self.thread = Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        with self.cond:
+            self.running = False
+            self.cond.notify_all()
+
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def run(self):
+        while True:
+            with self.cond:
+                while self.running and not self.free:
+                    self.cond.wait()
+
+                if not self.running:
+                    return
+
+                seq = self.seq
+                wanted = self.wanted
+                slot = self.free.popleft()
+
+                if wanted - seq > SEEK_FRAMES:
+                    log.debug("video decoder is %d frames behind, seeking", wanted - seq)
+                    self.index = (self.index + wanted - seq) % self.length
+                    seq = self.seq = wanted
+
+            # Looping is done by reading the stream from the beginning again, imageio
+            # restarts the ffmpeg pipe instead of seeking for every frame
+            try:
+                image = self.reader.get_data(self.index)
+            except IndexError:
+                # not even the first frame can be read, looping would retry it forever
+                if self.index == 0:
+                    log.error("video has no frame that can be decoded, stopping the decoder")
+                    with self.cond:
+                        self.running = False
+                        self.free.appendleft(slot)
+                    return
+
+                # metadata sometimes reports more frames than there actually are
+                log.debug("video ended at frame %d, expected %d frames", self.index, self.length)
+                self.length = max(self.index, 1)
+                self.index = 0
+                with self.cond:
+                    self.free.appendleft(slot)
+                continue
+
+            self.index = (self.index + 1) % self.length
+
+            # Frames the render thread already passed are not copied into a buffer at all
+            skip = seq < wanted
+            if not skip:
+                np.copyto(self.buffers[slot], image[:, :, :self.buffers[slot].shape[2]])
+
+            with self.cond:
+                self.seq = seq + 1
+                self.decoded += 1
+
+                if skip:
+                    self.dropped += 1
+                    self.free.appendleft(slot)
+                else:
+                    self.ready.append((seq, slot))
+
+    # Returns the buffer of the newest decoded frame that is due at the given frame number,
+    # or None if the frame shown last is still the newest one
+    def acquire(self, frame):
+        result = None
+
+        with self.cond:
+            self.wanted = frame
+
+            while self.ready and self.ready[0][0] <= frame:
+                seq, slot = self.ready.popleft()
+
+                # an even newer frame is due as well, drop this one
+                if self.ready and self.ready[0][0] <= frame:
+                    self.dropped += 1
+                    self.free.append(slot)
+                    continue
+
+                if self.current is not None:
+                    self.free.append(self.current)
+
+                self.current = slot
+                result = self.buffers[slot]
+
+                if seq < frame:
+                    self.late += 1
+
+            # Nothing due was decoded in time, keep displaying the previous frame
+            if result is None and self.seq <= frame:
+                self.late += 1
+
+            self.cond.notify_all()
+
+        self.report(frame)
+
+        return result
+
+    def report(self, frame):
+        self.report_frames += 1
+
+        now = time.perf_counter()
+        elapsed = now - self.report_time
+
+        if elapsed >= 5:
+            log.debug("video: %.1f fps displayed, frame %d, %d decoded, %d dropped, %d late, %d buffered",
+                      self.report_frames / elapsed, frame, self.decoded, self.dropped, self.late, len(self.ready))
+            self.report_time = now
+            self.report_frames = 0
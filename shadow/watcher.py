@@ -0,0 +1,119 @@
+import ctypes.util
+import logging
+import ctypes
+import struct
+import time
+import sys
+import os
+
+log = logging.getLogger(__name__)
+
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+# Editors often save by writing a new file and renaming it, so directories are watched
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_TO
+
+EVENT_HEADER = struct.Struct("iIII") # wd, mask, cookie, len
+
+# Seconds between two checks of the modification times without inotify
+POLL_INTERVAL = 1.0
+
+libc = None
+if sys.platform.startswith("linux"):
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        libc.inotify_init1.argtypes = [ ctypes.c_int ]
+        libc.inotify_add_watch.argtypes = [ ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32 ]
+    except (OSError, AttributeError):
+        libc = None
+
+# Reports which of the given files changed since the last call of poll
+class FileWatcher():
+    def __init__(self, paths) -> None:
+        self.fd = -1
+        self.dirs = {} # watch descriptor -> directory
+        self.paths = set()
+        self.mtimes = {}
+        self.last_poll = time.monotonic()
+
+        if libc is not None:
+            self.fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+            if self.fd < 0:
+                log.warning(f"inotify is not available, polling files instead: {os.strerror(ctypes.get_errno())}")
+
+        self.watch(paths)
+
+    def watch(self, paths):
+        for path in paths:
+            path = os.path.abspath(path)
+            if path in self.paths:
+                continue
+
+            self.paths.add(path)
+            self.mtimes[path] = self.get_mtime(path)
+
+            directory = os.path.dirname(path)
+            if self.fd >= 0 and directory not in self.dirs.values():
+                wd = libc.inotify_add_watch(self.fd, directory.encode(), WATCH_MASK)
+                if wd < 0:
+                    log.warning(f"could not watch {directory}: {os.strerror(ctypes.get_errno())}")
+                else:
+                    self.dirs[wd] = directory
+
+    @staticmethod
+    def get_mtime(path):
+        try:
+            return os.stat(path).st_mtime_ns
+        except OSError:
+            return None
+
+    def read_events(self) -> set:
+        changed = set()
+
+        while True:
+            try:
+                data = os.read(self.fd, 64 * 1024)
+            except BlockingIOError:
+                break
+
+            offset = 0
+            while offset + EVENT_HEADER.size <= len(data):
+                wd, _, _, length = EVENT_HEADER.unpack_from(data, offset)
+                offset += EVENT_HEADER.size
+                name = data[offset:offset + length].rstrip(b"\0").decode(errors="replace")
+                offset += length
+
+                path = os.path.join(self.dirs.get(wd, ""), name)
+                if path in self.paths:
+                    changed.add(path)
+
+        return changed
+
+    def compare_mtimes(self) -> set:
+        now = time.monotonic()
+        if now - self.last_poll < POLL_INTERVAL:
+            return set()
+        self.last_poll = now
+
+        changed = set()
+        for path in self.paths:
+            mtime = self.get_mtime(path)
+            if mtime != self.mtimes[path]:
+                self.mtimes[path] = mtime
+                changed.add(path)
+
+        return changed
+
+    # Returns the absolute paths of the files that changed, never blocks
+    def poll(self) -> set:
+        if self.fd >= 0:
+            return self.read_events()
+        return self.compare_mtimes()
+
+    def close(self):
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
@@ -1,25 +1,42 @@
 import xcffib
 import xcffib.xproto
+import xcffib.shm
+import xcffib.screensaver
 
+import ctypes.util
+import functools
+import logging
+import ctypes
 import struct
 import io
 
 import cairocffi
 import cairocffi.pixbuf
 
+log = logging.getLogger(__name__)
+
+@functools.lru_cache(maxsize=None)
+def intern_atom(conn, name):
+    return conn.core.InternAtom(False, len(name), name).reply().atom
+
+@functools.lru_cache(maxsize=None)
+def has_extension(conn, name) -> bool:
+    return conn.core.QueryExtension(len(name), name).reply().present
+
+# Sets pixmap as the wallpaper, the pixmap can be updated afterwards, followed by clear_wallpaper_area
 def set_wallpaper_pixmap(conn, screen, pixmap):
     # remove prev: kill()
     conn.core.ChangeProperty(
         xcffib.xproto.PropMode.Replace,
         screen.root,
-        conn.core.InternAtom(False, 13, '_XROOTPMAP_ID').reply().atom,
+        intern_atom(conn, '_XROOTPMAP_ID'),
         xcffib.xproto.Atom.PIXMAP,
         32, 1, [pixmap]
     )
     conn.core.ChangeProperty(
         xcffib.xproto.PropMode.Replace,
         screen.root,
-        conn.core.InternAtom(False, 16, 'ESETROOT_PMAP_ID').reply().atom,
+        intern_atom(conn, 'ESETROOT_PMAP_ID'),
         xcffib.xproto.Atom.PIXMAP,
         32, 1, [pixmap]
     )
@@ -27,16 +44,20 @@ def set_wallpaper_pixmap(conn, screen, pixmap):
     conn.core.ChangeWindowAttributes(
         screen.root, xcffib.xproto.CW.BackPixmap, [pixmap]
     )
+    clear_wallpaper_area(conn, screen, 0, 0, screen.width_in_pixels, screen.height_in_pixels)
+
+    conn.core.SetCloseDownMode(xcffib.xproto.CloseDown.RetainPermanent)
+
+# Redraws the given area of the root window from its background pixmap
+def clear_wallpaper_area(conn, screen, x, y, width, height):
     conn.core.ClearArea(
         0, screen.root,
-        0, 0,           # x and y position
-        screen.width_in_pixels, screen.height_in_pixels
+        x, y,           # x and y position
+        width, height
     )
 
     conn.flush()
 
-    conn.core.SetCloseDownMode(xcffib.xproto.CloseDown.RetainPermanent)
-
 def set_window_to_background(conn, window):
     value = conn.core.InternAtom(False, 27, '_NET_WM_WINDOW_TYPE_DESKTOP').reply().atom
 
@@ -50,6 +71,34 @@ def set_window_to_background(conn, window):
 
     conn.flush()
 
+def get_window_property(conn, window, name, type=xcffib.xproto.Atom.Any, length=1024):
+    return conn.core.GetProperty(False, window, intern_atom(conn, name), type, 0, length).reply().value
+
+# Returns True if the active window is a fullscreen window covering the given area of the screen
+def is_covered_by_fullscreen(conn, screen, x, y, width, height) -> bool:
+    active = get_window_property(conn, screen.root, '_NET_ACTIVE_WINDOW', xcffib.xproto.Atom.WINDOW).to_atoms()
+    if not active or active[0] == 0:
+        return False
+
+    window = active[0]
+    state = get_window_property(conn, window, '_NET_WM_STATE', xcffib.xproto.Atom.ATOM).to_atoms()
+    if intern_atom(conn, '_NET_WM_STATE_FULLSCREEN') not in state:
+        return False
+
+    geometry = conn.core.GetGeometry(window).reply()
+    position = conn.core.TranslateCoordinates(window, screen.root, 0, 0).reply()
+
+    return position.dst_x <= x and position.dst_y <= y and \
+           position.dst_x + geometry.width >= x + width and \
+           position.dst_y + geometry.height >= y + height
+
+# Returns the seconds since the last user input or None if the screensaver extension is not available
+def get_idle_time(conn, screen):
+    if not has_extension(conn, 'MIT-SCREEN-SAVER'):
+        return None
+
+    return conn(xcffib.screensaver.key).QueryInfo(screen.root).reply().ms_since_user_input / 1000
+
 def get_root_visual(screen):
     for depth in screen.allowed_depths:
         for visual in depth.visuals:
@@ -91,4 +140,76 @@ def PutImage(conn, format, drawable, gc, width, height, dst_x, dst_y, left_pad,
     p = struct.pack("=xB2xIIHHhhBB2x", format, drawable, gc, width, height, dst_x, dst_y, left_pad, depth)
     buf.write(p)
     buf.write(data)
-    conn.core.send_request(72, buf, is_checked=is_checked)
\ No newline at end of file
+    conn.core.send_request(72, buf, is_checked=is_checked)
+
+
+libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+libc.shmget.argtypes = [ ctypes.c_int, ctypes.c_size_t, ctypes.c_int ]
+libc.shmget.restype = ctypes.c_int
+libc.shmat.argtypes = [ ctypes.c_int, ctypes.c_void_p, ctypes.c_int ]
+libc.shmat.restype = ctypes.c_void_p
+libc.shmdt.argtypes = [ ctypes.c_void_p ]
+libc.shmctl.argtypes = [ ctypes.c_int, ctypes.c_int, ctypes.c_void_p ]
+
+IPC_PRIVATE = 0
+IPC_CREAT = 0o1000
+IPC_RMID = 0
+
+# A System V shared memory segment attached to the X server through the MIT-SHM extension.
+# Images written to it are transferred with ShmPutImage instead of over the X socket.
+class ShmSegment():
+    def __init__(self, conn, size):
+        self.conn = conn
+        self.size = size
+        self.shmseg = None
+        self.address = None
+
+        if not has_extension(conn, 'MIT-SHM'):
+            raise RuntimeError("MIT-SHM extension is not available")
+
+        self.shm = conn(xcffib.shm.key)
+        self.shm.QueryVersion().reply()
+
+        shmid = libc.shmget(IPC_PRIVATE, size, IPC_CREAT | 0o600)
+        if shmid < 0:
+            raise OSError(ctypes.get_errno(), "shmget failed")
+
+        try:
+            address = libc.shmat(shmid, None, 0)
+            if address is None or address == ctypes.c_void_p(-1).value:
+                raise OSError(ctypes.get_errno(), "shmat failed")
+
+            self.address = address
+
+            # fails if the X server cannot access our memory, e.g. when it runs on another machine
+            self.shmseg = conn.generate_id()
+            self.shm.Attach(self.shmseg, shmid, False, is_checked=True).check()
+        except Exception:
+            self.cleanup()
+            raise
+        finally:
+            # the segment is freed automatically once both sides detached from it
+            libc.shmctl(shmid, IPC_RMID, None)
+
+    # Transfers an area of a ZPixmap image at the given offset in the segment to the same position
+    # in drawable. Returns once the X server is done reading it, so the memory can be reused afterwards.
+    def put(self, drawable, gc, width, height, depth, offset, x=0, y=0, area_width=None, area_height=None):
+        self.shm.PutImage(
+            drawable, gc,
+            width, height, # total size of the image
+            x, y, width if area_width is None else area_width, height if area_height is None else area_height,
+            x, y,
+            depth, xcffib.xproto.ImageFormat.ZPixmap,
+            False, self.shmseg, offset,
+            is_checked=True
+        ).check()
+
+    def cleanup(self):
+        if self.shmseg is not None:
+            self.shm.Detach(self.shmseg)
+            self.conn.flush()
+            self.shmseg = None
+
+        if self.address is not None:
+            libc.shmdt(self.address)
+            self.address = None
@@ -0,0 +1,62 @@
+from shadow.scripthost import SharedSlot, SEQUENCE, LENGTH
+
+import pytest
+
+@pytest.fixture
+def slots():
+    writer = SharedSlot(64)
+    reader = SharedSlot(64, writer.name)
+    yield writer, reader
+    reader.close()
+    writer.close()
+
+# Does the first half of SharedSlot.write for the next state, without publishing it
+def begin_write(writer, data):
+    seq = writer.seq + 1
+    offset = writer.offset(seq)
+    start = offset + SEQUENCE.size + LENGTH.size
+
+    SEQUENCE.pack_into(writer.buffer, offset, writer.versions[seq & 1] + 1)
+    writer.buffer[start:start + len(data)] = data
+
+def test_read_returns_latest_state_once(slots):
+    writer, reader = slots
+
+    assert reader.read() is None
+
+    writer.write(b"first")
+    writer.write(b"second")
+    assert reader.read() == b"second"
+    assert reader.read() is None
+
+def test_write_rejects_oversized_state(slots):
+    writer, reader = slots
+
+    assert not writer.write(b"x" * 65)
+    assert reader.read() is None
+
+def test_read_drops_state_overwritten_while_copying(slots):
+    writer, reader = slots
+    writer.write(b"a" * 32)
+
+    # the writer publishes the next state and starts on the buffer being copied
+    copy = reader.copy
+    def overtaken(start, length):
+        data = copy(start, length // 2)
+        writer.write(b"b" * 32)
+        begin_write(writer, b"c" * 32)
+        return data + copy(start + length // 2, length - length // 2)
+    reader.copy = overtaken
+
+    assert reader.read() is None
+
+    reader.copy = copy
+    assert reader.read() == b"b" * 32
+
+def test_read_skips_buffer_while_it_is_written(slots):
+    writer, reader = slots
+    writer.write(b"a" * 8)
+
+    # the writer started on the published buffer before the reader got to it
+    SEQUENCE.pack_into(writer.buffer, writer.offset(writer.seq), writer.versions[writer.seq & 1] + 1)
+    assert reader.read() is None
@@ -0,0 +1,30 @@
+import subprocess
+import textwrap
+import sys
+
+# A synchronous callback that never returns must neither keep the others from running nor the
+# interpreter from exiting
+def test_blocking_callback_does_not_hang_exit():
+    code = textwrap.dedent("""
+        import threading, time, types
+        from shadow.scripting import ScriptRuntime, every
+
+        module = types.ModuleType("script")
+        module.blocking = every(0.01)(lambda: threading.Event().wait())
+        module.level = every(0.01)(lambda: { "level": 1.0 })
+
+        runtime = ScriptRuntime(module, "script")
+        for _ in range(100):
+            values = runtime.poll()
+            if values:
+                break
+            time.sleep(0.01)
+
+        runtime.stop()
+        print(values)
+    """)
+
+    result = subprocess.run([ sys.executable, "-c", code ], capture_output=True, text=True, timeout=10)
+
+    assert result.returncode == 0, result.stderr
+    assert result.stdout.strip() == "{'level': 1.0}"
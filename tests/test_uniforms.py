@@ -0,0 +1,34 @@
+from shadow.scripthost import check_uniforms
+
+def test_numbers_and_numeric_sequences_are_kept():
+    values = { "level": 0.5, "count": 3, "on": True, "bar": [ 0.1, 0.2 ], "color": (1, 0, 0, 1) }
+
+    assert check_uniforms(values) == (values, [])
+
+def test_values_shaders_can_not_take_are_dropped():
+    valid, dropped = check_uniforms({
+        "level": 0.5,
+        1: 0.5,
+        "name": "text",
+        "nothing": None,
+        "empty": [],
+        "mixed": [ 1.0, "x" ],
+    })
+
+    assert valid == { "level": 0.5 }
+    assert sorted(dropped) == sorted([ "1", "'name'", "'nothing'", "'empty'", "'mixed'" ])
+
+def test_mvp_has_to_be_a_4x4_matrix():
+    identity = [ [ 1., 0., 0., 0. ], [ 0., 1., 0., 0. ], [ 0., 0., 1., 0. ], [ 0., 0., 0., 1. ] ]
+    flat = [ v for row in identity for v in row ]
+
+    assert check_uniforms({ "mvp": identity })[0] == { "mvp": identity }
+    assert check_uniforms({ "mvp": flat })[0] == { "mvp": flat }
+    assert check_uniforms({ "mvp": 1.0 })[1] == [ "'mvp'" ]
+    assert check_uniforms({ "mvp": identity[:3] })[1] == [ "'mvp'" ]
+
+def test_anything_but_a_dict_is_dropped():
+    valid, dropped = check_uniforms([ 1, 2 ])
+
+    assert valid == {}
+    assert len(dropped) == 1